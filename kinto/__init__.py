@@ -1,12 +1,18 @@
 import pkg_resources
 import logging
+import threading
 
 import cliquet
 from pyramid.config import Configurator
 from pyramid.settings import asbool
 from pyramid.security import Authenticated
+from repoze.lru import ExpiringLRUCache
 
+from kinto import timings
 from kinto.authorization import RouteFactory
+from kinto.reaper import Reaper
+from kinto.views.collections import COLLECTIONS_MEMORY_CACHE_SIZE
+from kinto.views.records import build_cache_expires_table
 
 # Module version, as defined in PEP-0396.
 __version__ = pkg_resources.get_distribution(__package__).version
@@ -26,6 +32,30 @@ DEFAULT_SETTINGS = {
     'multiauth.groupfinder': (
         'kinto.authorization.groupfinder'),
     'experimental_collection_schema_validation': 'False',
+    'principals_cache_ttl_seconds': 10,
+    'default_bucket_cache_ttl_seconds': 3600,
+    'collections_cache_ttl_seconds': 3600,
+    'collections_memory_ttl_seconds': 1,
+    'records_cache_ttl_seconds': 0,
+    'async_deletion_enabled': 'False',
+    'async_deletion_reaper_enabled': 'False',
+    'async_deletion_batch_size': 1000,
+    'async_deletion_interval_seconds': 60,
+    'async_deletion_cache_ttl_seconds': 10,
+    'notifications_enabled': 'False',
+    'notifications_backend': 'kinto.notifications.memory',
+    'notifications_timeout_seconds': 30,
+    'notifications_max_waiting': 2,
+    'notifications_cache_ttl_seconds': 60,
+    'name_generator': 'kinto.views.NameGenerator',
+    'export_batch_size': 1000,
+    'import_batch_size': 1000,
+    'timings_enabled': 'False',
+    'timings_hook': 'kinto.timings.statsd_hook',
+    'stats_endpoint_principals': '',
+    'profile_endpoint_enabled': 'False',
+    'profile_endpoint_principals': '',
+    'profile_max_duration_seconds': 30,
 }
 
 
@@ -49,11 +79,59 @@ def main(global_config, **settings):
 
     # Scan Kinto views.
     settings = config.get_settings()
-    kwargs = {}
+    ignored = []
     flush_enabled = asbool(settings.get('flush_endpoint_enabled'))
     if not flush_enabled:
-        kwargs['ignore'] = 'kinto.views.flush'
-    config.scan("kinto.views", **kwargs)
+        ignored.append('kinto.views.flush')
+    profile_enabled = asbool(settings['profile_endpoint_enabled'])
+    if not profile_enabled:
+        ignored.append('kinto.views.profile')
+    notifications_enabled = asbool(settings['notifications_enabled'])
+    if not notifications_enabled:
+        ignored.append('kinto.views.changes')
+
+    # Time the phases of requests.
+    config.registry.timings = None
+    if asbool(settings['timings_enabled']):
+        config.registry.timings = timings.PhasesStats()
+        hook = config.maybe_dotted(settings['timings_hook'])
+        config.registry.timings_hook = hook
+        config.add_tween('kinto.timings.timings_tween_factory')
+    else:
+        ignored.append('kinto.views.stats')
+    config.scan("kinto.views", ignore=ignored)
+
+    # Generator of buckets, collections and groups names.
+    name_generator = config.maybe_dotted(settings['name_generator'])
+    config.registry.name_generator = name_generator()
+
+    # Collections metadata kept in process memory.
+    local_ttl = int(settings['collections_memory_ttl_seconds'])
+    config.registry.collections_cache = ExpiringLRUCache(
+        COLLECTIONS_MEMORY_CACHE_SIZE, default_timeout=local_ttl)
+
+    # Records cache control settings, per bucket and collection.
+    config.registry.record_cache_expires = build_cache_expires_table(settings)
+
+    # Notify waiting clients of changes.
+    config.registry.notifier = None
+    if notifications_enabled:
+        backend = config.maybe_dotted(settings['notifications_backend'])
+        config.registry.notifier = backend.load_from_config(config)
+        max_waiting = int(settings['notifications_max_waiting'])
+        config.registry.notifications_slots = threading.BoundedSemaphore(
+            max_waiting)
+
+    # Purge children of deleted objects in background.
+    if asbool(settings['async_deletion_enabled']):
+        reaper = Reaper(config.registry.storage,
+                        config.registry.permission,
+                        batch_size=int(settings['async_deletion_batch_size']),
+                        cache=config.registry.cache)
+        # A single reaper must run per deployment (see ``kinto reap``).
+        if asbool(settings['async_deletion_reaper_enabled']):
+            reaper.start(int(settings['async_deletion_interval_seconds']))
+        config.registry.reaper = reaper
 
     app = config.make_wsgi_app()
 
@@ -4,6 +4,10 @@ from cliquet.scripts import cliquet
 from pyramid.scripts import pserve
 from pyramid.paster import bootstrap
 
+from kinto import bench
+from kinto.permission import initialize_schema
+from kinto.reaper import reap
+
 
 def main(args=None):
         """The main routine."""
@@ -13,7 +17,8 @@ def main(args=None):
         parser = argparse.ArgumentParser(description="Kinto commands")
         subparsers = parser.add_subparsers(title='subcommands',
                                            description='valid subcommands',
-                                           help='init/start/migrate')
+                                           help='init/start/migrate/bench/'
+                                                'reap')
 
         parser_init = subparsers.add_parser('init')
         parser_init.set_defaults(which='init')
@@ -26,6 +31,28 @@ def main(args=None):
         parser_start = subparsers.add_parser('start')
         parser_start.set_defaults(which='start')
 
+        parser_bench = subparsers.add_parser('bench')
+        parser_bench.set_defaults(which='bench')
+        parser_bench.add_argument('--ini', required=False,
+                                  help='Benchmark the backends of this '
+                                       'config file (memory by default)')
+        parser_bench.add_argument('--scenario', action='append',
+                                  choices=list(bench.SCENARIOS),
+                                  help='Scenario to run (all by default)')
+        parser_bench.add_argument('--iterations', type=int, default=200,
+                                  help='Number of operations per scenario')
+        parser_bench.add_argument('--output', required=False,
+                                  help='Write the JSON results to this file')
+        parser_bench.add_argument('--compare', required=False,
+                                  help='Compare with the JSON results of a '
+                                       'previous run')
+
+        parser_reap = subparsers.add_parser('reap')
+        parser_reap.set_defaults(which='reap')
+        parser_reap.add_argument('--ini', default='config/kinto.ini',
+                                 help='Purge the deleted objects of this '
+                                      'config file backends')
+
         args = vars(parser.parse_args())
 
         if args['which'] == 'init':
@@ -37,9 +64,15 @@ def main(args=None):
         elif args['which'] == 'migrate':
                 env = bootstrap('config/kinto.ini')
                 cliquet.init_schema(env)
+                initialize_schema(env['registry'].permission)
         elif args['which'] == 'start':
                 pserve_argv = ['pserve', 'config/kinto.ini', '--reload']
                 pserve.main(pserve_argv)
+        elif args['which'] == 'bench':
+                bench.main(args)
+        elif args['which'] == 'reap':
+                env = bootstrap(args['ini'])
+                reap(env['registry'])
 
 
 if __name__ == "__main__":
@@ -1,7 +1,15 @@
+import uuid
+from collections import namedtuple
+
 from cliquet import authorization as cliquet_authorization
-from pyramid.security import IAuthorizationPolicy
+from pyramid.security import Everyone, IAuthorizationPolicy
+from pyramid.settings import aslist
+from repoze.lru import LRUCache
 from zope.interface import implementer
 
+from kinto.permission import check_permissions
+from kinto.timings import timed
+
 
 # Vocab really matters when you deal with permissions. Let's do a quick recap
 # of the terms used here:
@@ -67,44 +75,149 @@ PERMISSIONS_INHERITANCE_TREE = {
 }
 
 
+# URI of each object type, and the number of identifiers it contains.
+URI_TEMPLATES = {
+    'bucket': ('/buckets/%s', 1),
+    'collection': ('/buckets/%s/collections/%s', 2),
+    'group': ('/buckets/%s/groups/%s', 2),
+    'record': ('/buckets/%s/collections/%s/records/%s', 3),
+}
+
+# Type of the objects below buckets, by plural endpoint name.
+BUCKET_CHILDREN_TYPES = {
+    'collections': 'collection',
+    'groups': 'group',
+}
+
+# Plural endpoints names of children objects, by parent object type.
+CHILDREN_ENDPOINTS = {
+    'bucket': ('collections', 'groups'),
+    'collection': ('records',),
+    'group': (),
+    'record': (),
+}
+
+# Number of (object URI, unbound permission) couples whose granters are
+# kept in memory by the authorization policy.
+GRANTERS_CACHE_SIZE = 10000
+
+
+class ObjectURI(namedtuple('ObjectURI',
+                           ['type', 'bucket_id', 'child_id', 'record_id'])):
+    """Identifiers of an object, as obtained from
+    :func:`kinto.authorization.parse_object_uri`.
+
+    ``child_id`` is the id of the group for groups, and the id of the
+    collection for collections and records.
+    """
+    __slots__ = ()
+
+    def build(self, obj_type=None):
+        """Return the URI of this object, or of its parent of the specified
+        `obj_type`.
+        """
+        if obj_type is None:
+            obj_type = self.type
+
+        if obj_type not in URI_TEMPLATES:
+            raise ValueError('Invalid object type: %s' % obj_type)
+
+        is_parent = (obj_type == self.type or
+                     obj_type == 'bucket' or
+                     (obj_type, self.type) == ('collection', 'record'))
+        if not is_parent:
+            raise ValueError('You cannot build children keys from its parent '
+                             'key. Trying to build type "%s" from object '
+                             'key "%s".' % (obj_type, self.build()))
+
+        template, nb_ids = URI_TEMPLATES[obj_type]
+        return template % self[1:nb_ids + 1]
+
+
+def object_uri(obj_type, bucket_id, child_id=None, record_id=None):
+    """Build the URI of an object from its identifiers.
+
+    >>> object_uri('collection', 'blog', 'articles')
+    '/buckets/blog/collections/articles'
+
+    """
+    return ObjectURI(obj_type, bucket_id, child_id, record_id).build()
+
+
+def parse_object_uri(object_uri):
+    """Parse the specified object URI in a single pass, and return an
+    :class:`kinto.authorization.ObjectURI`, or ``None`` if the URI is not
+    the one of a known object.
+
+    URIs of plural endpoints (e.g. ``/buckets/blog/collections``) are
+    parsed as their parent object.
+
+    >>> parse_object_uri('/buckets/blog/groups')
+    ObjectURI(type='bucket', bucket_id='blog', child_id=None, record_id=None)
+
+    """
+    parts = object_uri.split('/')
+    nb_parts = len(parts)
+    endpoint = None
+    if nb_parts % 2 == 0:
+        endpoint = parts[-1]
+        nb_parts -= 1
+
+    if nb_parts < 3 or nb_parts > 7 or parts[0] or parts[1] != 'buckets':
+        return None
+
+    obj_type = 'bucket'
+    child_id = record_id = None
+    if nb_parts > 3:
+        obj_type = BUCKET_CHILDREN_TYPES.get(parts[3])
+        child_id = parts[4]
+    if nb_parts > 5:
+        is_record = (obj_type == 'collection' and parts[5] == 'records')
+        obj_type = 'record' if is_record else None
+        record_id = parts[6]
+
+    if obj_type is None or '' in parts[2:nb_parts:2]:
+        return None
+    if endpoint is not None and endpoint not in CHILDREN_ENDPOINTS[obj_type]:
+        return None
+    return ObjectURI(obj_type, parts[2], child_id, record_id)
+
+
 def get_object_type(object_uri):
     """Return the type of an object from its id."""
+    parsed = parse_object_uri(object_uri)
+    return parsed.type if parsed is not None else None
 
-    obj_parts = object_uri.split('/')
-    if len(obj_parts) % 2 == 0:
-        object_uri = '/'.join(obj_parts[:-1])
-
-    # Order matters here. More precise is tested first.
-    if 'records' in object_uri:
-        obj_type = 'record'
-    elif 'collections' in object_uri:
-        obj_type = 'collection'
-    elif 'groups' in object_uri:
-        obj_type = 'group'
-    elif 'buckets' in object_uri:
-        obj_type = 'bucket'
-    else:
-        obj_type = None
-    return obj_type
 
+def build_permission_tuple(obj_type, unbound_permission, parsed_uri):
+    """Returns a tuple of (object_uri, unbound_permission), where the
+    object URI is the one of `parsed_uri` (or of its parent of the specified
+    `obj_type`).
+    """
+    return (parsed_uri.build(obj_type), unbound_permission)
 
-def build_permission_tuple(obj_type, unbound_permission, obj_parts):
-    """Returns a tuple of (object_uri, unbound_permission)"""
-    PARTS_LENGTH = {
-        'bucket': 3,
-        'collection': 5,
-        'group': 5,
-        'record': 7
-    }
-    if obj_type not in PARTS_LENGTH:
-        raise ValueError('Invalid object type: %s' % obj_type)
 
-    if PARTS_LENGTH[obj_type] > len(obj_parts):
-        raise ValueError('You cannot build children keys from its parent key.'
-                         'Trying to build type "%s" from object key "%s".' % (
-                             obj_type, '/'.join(obj_parts)))
-    length = PARTS_LENGTH[obj_type]
-    return ('/'.join(obj_parts[:length]), unbound_permission)
+def compile_inheritance_tree(inheritance_tree):
+    """Flatten the inheritance tree into a table of templates, where each
+    bound permission is associated to the list of ``(object type,
+    unbound permissions)`` couples that grant it.
+
+    >>> compile_inheritance_tree({'bucket:read': {'bucket': ['write']}})
+    {'bucket:read': (('bucket', ('write',)),)}
+
+    """
+    templates = {}
+    for bound_permission, granters in inheritance_tree.items():
+        template = []
+        for obj, permission_list in sorted(granters.items()):
+            if obj not in URI_TEMPLATES:
+                raise ValueError('Invalid object type: %s' % obj)
+            template.append((obj, tuple(permission_list)))
+        templates[bound_permission] = tuple(template)
+    return templates
+
+
+_INHERITANCE_TEMPLATES = compile_inheritance_tree(PERMISSIONS_INHERITANCE_TREE)
 
 
 def build_permissions_set(object_uri, unbound_permission,
@@ -118,38 +231,178 @@ def build_permissions_set(object_uri, unbound_permission,
     """
 
     if inheritance_tree is None:
-        inheritance_tree = PERMISSIONS_INHERITANCE_TREE
+        templates = _INHERITANCE_TEMPLATES
+    else:
+        templates = compile_inheritance_tree(inheritance_tree)
 
-    obj_type = get_object_type(object_uri)
+    parsed_uri = parse_object_uri(object_uri)
 
     # Unknown object type, does not map the INHERITANCE_TREE.
     # In that case, the set of related permissions is empty.
-    if obj_type is None:
+    if parsed_uri is None:
         return set()
 
-    bound_permission = '%s:%s' % (obj_type, unbound_permission)
+    bound_permission = '%s:%s' % (parsed_uri.type, unbound_permission)
     granters = set()
+    for obj, permissions in templates[bound_permission]:
+        uri = parsed_uri.build(obj)
+        granters.update((uri, permission) for permission in permissions)
+    return granters
 
-    obj_parts = object_uri.split('/')
-    for obj, permission_list in inheritance_tree[bound_permission].items():
-        for permission in permission_list:
-            granters.add(build_permission_tuple(obj, permission, obj_parts))
 
-    return granters
+# Keys of user principals in the cache backend, stored for the current
+# version of the user membership.
+PRINCIPALS_CACHE_KEY = 'principals:%s:%s'
+PRINCIPALS_VERSION_KEY = 'principals:version:%s'
+
+
+def _principals_cache_ttl(settings):
+    return int(settings.get('principals_cache_ttl_seconds') or 0)
 
 
-# XXX: May need caching
 def groupfinder(userid, request):
+    """Return the additional principals of the user (i.e. their groups).
+
+    Principals are memoized on the request (and thus shared with batch
+    subrequests), and kept in the cache backend for
+    ``principals_cache_ttl_seconds``, along with the version of the user
+    membership read before them (see :func:`invalidate_principals`).
+    """
     authn_type = request.authn_type
     prefixed_userid = '%s:%s' % (authn_type.lower(), userid)
-    return request.registry.permission.user_principals(prefixed_userid)
+
+    memoized = request.bound_data.setdefault('principals', {})
+    if prefixed_userid in memoized:
+        return memoized[prefixed_userid]
+
+    cache = request.registry.cache
+    ttl = _principals_cache_ttl(request.registry.settings)
+
+    with timed(request, 'groupfinder'):
+        cached = None
+        if ttl > 0:
+            version = cache.get(PRINCIPALS_VERSION_KEY % prefixed_userid)
+            cache_key = PRINCIPALS_CACHE_KEY % (prefixed_userid, version)
+            cached = cache.get(cache_key)
+        if cached is not None:
+            principals = set(cached)
+        else:
+            permission = request.registry.permission
+            principals = permission.user_principals(prefixed_userid)
+            if ttl > 0:
+                cache.set(cache_key, list(principals), ttl)
+
+    memoized[prefixed_userid] = principals
+    return principals
+
+
+def invalidate_principals(request, user_ids):
+    """Drop the memoized principals of the specified users, once their
+    groups membership changed in the permission backend.
+
+    Their membership version is bumped in the cache backend, instead of
+    deleting their cached principals: principals read by concurrent requests
+    before the change can still be cached, but under their former version.
+    """
+    memoized = request.bound_data.get('principals', {})
+    cache = request.registry.cache
+    ttl = _principals_cache_ttl(request.registry.settings)
+    for user_id in user_ids:
+        memoized.pop(user_id, None)
+        if ttl > 0:
+            # Kept longer than the principals cached for the former version.
+            cache.set(PRINCIPALS_VERSION_KEY % user_id, uuid.uuid4().hex,
+                      ttl * 2)
+
+
+# Granters are only computed from the object URI and the inheritance tree.
+# They can thus be shared among requests and workers threads.
+granters_cache = LRUCache(GRANTERS_CACHE_SIZE)
 
 
 @implementer(IAuthorizationPolicy)
 class AuthorizationPolicy(cliquet_authorization.AuthorizationPolicy):
-    def get_bound_permissions(self, *args, **kwargs):
-        return build_permissions_set(*args, **kwargs)
+    def permits(self, context, principals, permission):
+        with timed(context.request, 'permissions'):
+            return super(AuthorizationPolicy, self).permits(context,
+                                                            principals,
+                                                            permission)
+
+    def get_bound_permissions(self, object_uri, unbound_permission):
+        """Return the (memoized) set of permissions that grant the
+        `unbound_permission` on the specified `object_uri`.
+
+        Hits and misses are counted on :data:`granters_cache`.
+        """
+        key = (object_uri, unbound_permission)
+        granters = granters_cache.get(key)
+        if granters is None:
+            granters = frozenset(build_permissions_set(object_uri,
+                                                       unbound_permission))
+            granters_cache.put(key, granters)
+        return granters
 
 
 class RouteFactory(cliquet_authorization.RouteFactory):
-    pass
+    def __init__(self, request):
+        super(RouteFactory, self).__init__(request)
+        self.request = request
+        self._permission = request.registry.permission
+        self._shared_objects = None
+
+    def check_permission(self, permission, principals,
+                         get_bound_permissions=None):
+        """On lists, check the permission on the parents of the objects, and
+        look up the objects shared with the principals, in a single query.
+
+        The shared objects are then returned by
+        :meth:`fetch_shared_records` if the permission is not granted.
+        """
+        is_list_operation = (self.get_shared_ids is not None and
+                             'create' not in permission)
+        if not is_list_operation or get_bound_permissions is None:
+            return super(RouteFactory, self).check_permission(
+                permission, principals,
+                get_bound_permissions=get_bound_permissions)
+
+        object_id_match = self.get_shared_ids.keywords['object_id_match']
+        permitted = check_permissions(self._permission,
+                                      [object_id_match],
+                                      permission,
+                                      principals,
+                                      get_bound_permissions)
+        if object_id_match in permitted:
+            return True
+        self._shared_objects = permitted
+        return False
+
+    def fetch_shared_records(self, perm, principals, get_bound_permissions):
+        if self._shared_objects is None:
+            return super(RouteFactory, self).fetch_shared_records(
+                perm, principals, get_bound_permissions)
+        self.shared_ids = [self.extract_object_id(object_id)
+                           for object_id in self._shared_objects]
+        return self.shared_ids
+
+
+class SettingsRouteFactory(RouteFactory):
+    """Only allow the principals listed in the :attr:`principals_setting`
+    setting (e.g. on the monitoring endpoints), whatever the permissions
+    backend.
+
+    Anonymous requests are never allowed (i.e. ``system.Everyone`` is
+    ignored).
+    """
+    principals_setting = None
+
+    def __init__(self, request):
+        super(SettingsRouteFactory, self).__init__(request)
+        settings = request.registry.settings
+        principals = aslist(settings[self.principals_setting])
+        self.allowed_principals = [p for p in principals if p != Everyone]
+        self.required_permission = 'read'
+
+    def check_permission(self, permission, principals,
+                         get_bound_permissions=None):
+        # Only reached if no principal is listed.
+        return False
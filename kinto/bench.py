@@ -0,0 +1,337 @@
+"""In-process benchmarks of *Kinto* hot paths.
+
+Unlike the load tests, they do not require any server nor broker: requests
+are sent directly to the WSGI application, in the current process, with the
+memory backends by default (or the backends of the specified configuration
+file, e.g. PostgreSQL).
+
+Results are written as JSON, and can be compared with the results of another
+run (e.g. of another commit)::
+
+    kinto bench --output before.json
+    kinto bench --compare before.json
+
+"""
+import base64
+import json
+import math
+import platform
+import sys
+import timeit
+import uuid
+from collections import OrderedDict
+
+from pyramid.paster import get_appsettings
+from webob import Request
+
+import kinto
+
+
+# Settings of the benchmarked application, without configuration file.
+BENCH_SETTINGS = {
+    'userid_hmac_secret': 'kinto bench',
+    'multiauth.policies': 'basicauth',
+    'storage_backend': 'cliquet.storage.memory',
+    'permission_backend': 'cliquet.permission.memory',
+    'cache_backend': 'cliquet.cache.memory',
+}
+
+# Number of records of the benchmarked collection.
+COLLECTION_SIZE = 500
+
+
+class BenchError(Exception):
+    pass
+
+
+class Client(object):
+    """Send the requests of a user to the WSGI application."""
+    def __init__(self, app, user):
+        self.app = app
+        credentials = ('%s:secret' % user).encode('utf-8')
+        self.headers = {
+            'Authorization': 'Basic %s' % base64.b64encode(
+                credentials).decode('ascii'),
+            'Content-Type': 'application/json',
+        }
+
+    def request(self, method, path, body=None, raw_body=None):
+        request = Request.blank('/v1' + path, method=method,
+                                headers=self.headers)
+        if body is not None:
+            raw_body = json.dumps(body).encode('utf-8')
+        if raw_body is not None:
+            request.body = raw_body
+        response = request.get_response(self.app)
+        if response.status_code >= 400:
+            raise BenchError('%s %s: %s' % (method, path, response.status))
+        return response
+
+    def get(self, path):
+        return self.request('GET', path)
+
+    def put(self, path, body=None):
+        return self.request('PUT', path, body or {})
+
+    def post(self, path, body=None):
+        return self.request('POST', path, body or {})
+
+    def delete(self, path):
+        return self.request('DELETE', path)
+
+
+class Scenario(object):
+    """A benchmarked operation.
+
+    Objects are created in the bucket of the run, in the constructor or
+    before each operation (:meth:`prepare`), outside of the measures.
+    """
+    description = ''
+
+    def __init__(self, owner, reader, bucket_url):
+        self.owner = owner
+        self.reader = reader
+        self.bucket_url = bucket_url
+
+    def prepare(self):
+        """Prepare the next operation."""
+
+    def run(self):
+        """Run the measured operation."""
+        raise NotImplementedError
+
+
+class DefaultBucketCreate(Scenario):
+    description = 'Create a record in the personal bucket'
+
+    # Deleted once the run is complete.
+    collection_url = '/buckets/default/collections/bench'
+
+    def run(self):
+        self.owner.post(self.collection_url + '/records',
+                        {'data': {'title': 'bench'}})
+
+
+class CollectionScenario(Scenario):
+    """Scenario on a collection of :data:`COLLECTION_SIZE` records."""
+
+    def __init__(self, *args, **kwargs):
+        super(CollectionScenario, self).__init__(*args, **kwargs)
+        self.collection_url = self.bucket_url + '/collections/articles'
+        self.records_url = self.collection_url + '/records'
+        if not self.owner.get(self.records_url).json['data']:
+            records = (json.dumps({'n': n, 'status': 'status-%s' % (n % 5)})
+                       for n in range(COLLECTION_SIZE))
+            self.owner.request('POST', self.collection_url + '/import',
+                               raw_body='\n'.join(records).encode('utf-8'))
+
+
+class RecordsList(CollectionScenario):
+    description = 'List records with filters, sort and limit'
+
+    def run(self):
+        self.owner.get(self.records_url + '?in_status=status-1,status-2'
+                       '&min_n=100&_sort=-n&_limit=20')
+
+
+class RecordsPaginate(CollectionScenario):
+    description = 'Get the next page of a records list'
+
+    def __init__(self, *args, **kwargs):
+        super(RecordsPaginate, self).__init__(*args, **kwargs)
+        response = self.owner.get(self.records_url + '?_limit=20')
+        next_page = response.headers['Next-Page']
+        self.next_page = next_page[next_page.index(self.records_url):]
+
+    def run(self):
+        self.owner.get(self.next_page)
+
+
+class RecordsPoll(CollectionScenario):
+    description = 'Poll records changes without any change'
+
+    def __init__(self, *args, **kwargs):
+        super(RecordsPoll, self).__init__(*args, **kwargs)
+        response = self.owner.get(self.records_url + '?_limit=1')
+        self.poll_url = self.records_url + '?_since=%s' % (
+            response.headers['ETag'].strip('"'))
+
+    def run(self):
+        self.owner.get(self.poll_url)
+
+
+class GroupMembersUpdate(Scenario):
+    description = 'Replace half of the 20 members of a group'
+
+    def __init__(self, *args, **kwargs):
+        super(GroupMembersUpdate, self).__init__(*args, **kwargs)
+        self.group_url = self.bucket_url + '/groups/members'
+        self.members = [['user:%s' % i for i in range(20)],
+                        ['user:%s' % i for i in range(10, 30)]]
+        self.owner.put(self.group_url, {'data': {'members': self.members[0]}})
+
+    def run(self):
+        self.members.reverse()
+        self.owner.put(self.group_url, {'data': {'members': self.members[0]}})
+
+
+class BucketDelete(Scenario):
+    description = 'Delete a bucket with 2 collections of 20 records'
+
+    def prepare(self):
+        self.deleted_url = '%s-%s' % (self.bucket_url, uuid.uuid4().hex[:8])
+        self.owner.put(self.deleted_url)
+        self.owner.put(self.deleted_url + '/groups/group',
+                       {'data': {'members': ['user:1']}})
+        for collection in ('a', 'b'):
+            collection_url = self.deleted_url + '/collections/' + collection
+            self.owner.put(collection_url)
+            records = (json.dumps({'n': n}) for n in range(20))
+            self.owner.request('POST', collection_url + '/import',
+                               raw_body='\n'.join(records).encode('utf-8'))
+
+    def run(self):
+        self.owner.delete(self.deleted_url)
+
+
+class Authorization(CollectionScenario):
+    description = 'Read a record with a permission inherited from a group'
+
+    def __init__(self, *args, **kwargs):
+        super(Authorization, self).__init__(*args, **kwargs)
+        userid = self.reader.get('/').json['userid']
+        # Objects URIs are their URLs without the version prefix.
+        group_uri = self.bucket_url + '/groups/readers'
+        self.owner.put(group_uri, {'data': {'members': [userid]}})
+        self.owner.request('PATCH', self.bucket_url,
+                           {'permissions': {'read': [group_uri]}})
+        records = self.owner.get(self.records_url + '?_limit=1')
+        self.record_url = '%s/%s' % (self.records_url,
+                                     records.json['data'][0]['id'])
+
+    def run(self):
+        self.reader.get(self.record_url)
+
+
+SCENARIOS = OrderedDict([
+    ('default_bucket_create', DefaultBucketCreate),
+    ('records_list', RecordsList),
+    ('records_paginate', RecordsPaginate),
+    ('records_poll', RecordsPoll),
+    ('group_members_update', GroupMembersUpdate),
+    ('bucket_delete', BucketDelete),
+    ('authorization', Authorization),
+])
+
+
+def percentile(durations, percent):
+    """Return the `percent` percentile of the sorted `durations`, using
+    the nearest rank method.
+    """
+    rank = int(math.ceil(percent / 100.0 * len(durations)))
+    return durations[min(max(rank, 1), len(durations)) - 1]
+
+
+def measure(scenario, iterations, warmup=10):
+    """Run the operation of the scenario `iterations` times, and return
+    its statistics.
+    """
+    for _ in range(warmup):
+        scenario.prepare()
+        scenario.run()
+
+    timer = timeit.default_timer
+    durations = []
+    for _ in range(iterations):
+        scenario.prepare()
+        start = timer()
+        scenario.run()
+        durations.append(timer() - start)
+
+    durations.sort()
+    stats = OrderedDict()
+    stats['description'] = scenario.description
+    stats['iterations'] = iterations
+    stats['ops_per_sec'] = round(iterations / sum(durations), 1)
+    for percent in (50, 90, 99):
+        milliseconds = percentile(durations, percent) * 1000
+        stats['p%s_ms' % percent] = round(milliseconds, 3)
+    stats['max_ms'] = round(durations[-1] * 1000, 3)
+    return stats
+
+
+def run(settings, names=None, iterations=200):
+    """Run the specified scenarios on an application instantiated with
+    `settings`, and return the results.
+    """
+    app = kinto.main({}, **settings)
+    owner = Client(app, 'bench')
+    reader = Client(app, 'reader')
+    bucket_url = '/buckets/bench-%s' % uuid.uuid4().hex[:8]
+    owner.put(bucket_url)
+    owner.put(bucket_url + '/collections/articles')
+
+    results = OrderedDict()
+    results['kinto'] = kinto.__version__
+    results['python'] = platform.python_version()
+    results['backends'] = OrderedDict(
+        (name, settings.get('kinto.%s_backend' % name,
+                            settings.get('%s_backend' % name)))
+        for name in ('storage', 'permission', 'cache'))
+    results['scenarios'] = OrderedDict()
+    names = names or list(SCENARIOS)
+    try:
+        for name in names:
+            scenario = SCENARIOS[name](owner, reader, bucket_url)
+            results['scenarios'][name] = measure(scenario, iterations)
+    finally:
+        owner.delete(bucket_url)
+        # Records are created in the personal bucket of the user.
+        if 'default_bucket_create' in names:
+            owner.delete(DefaultBucketCreate.collection_url)
+    return results
+
+
+def compare(results, baseline):
+    """Return the lines of the comparison of the results with a previous
+    run.
+    """
+    lines = ['%-22s %12s %12s %8s' % ('scenario', 'p50 ms', 'ops/sec',
+                                      'change')]
+    for name, stats in results['scenarios'].items():
+        previous = baseline['scenarios'].get(name)
+        if previous is None:
+            change = 'new'
+        else:
+            ratio = stats['ops_per_sec'] / previous['ops_per_sec'] - 1
+            change = '%+.1f%%' % (ratio * 100)
+        lines.append('%-22s %12.3f %12.1f %8s' % (
+            name, stats['p50_ms'], stats['ops_per_sec'], change))
+    return lines
+
+
+def main(args):
+    """Run the benchmarks from the ``kinto bench`` command arguments."""
+    if args['ini']:
+        settings = get_appsettings(args['ini'])
+    else:
+        settings = BENCH_SETTINGS.copy()
+
+    names = args['scenario']
+    unknown = set(names or []) - set(SCENARIOS)
+    if unknown:
+        raise BenchError('Unknown scenarios: %s' % ', '.join(sorted(unknown)))
+
+    results = run(settings, names, iterations=args['iterations'])
+
+    output = json.dumps(results, indent=2)
+    if args['output']:
+        with open(args['output'], 'w') as f:
+            f.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+    if args['compare']:
+        with open(args['compare']) as f:
+            baseline = json.load(f)
+        sys.stderr.write('\n'.join(compare(results, baseline)) + '\n')
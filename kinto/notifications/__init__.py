@@ -0,0 +1,87 @@
+"""Notification of the changes of buckets and collections.
+
+When ``kinto.notifications_enabled`` is set, the timestamps of the objects
+written through the buckets, collections, groups and records endpoints are
+published on the channels of their bucket and collection. The clients
+waiting on the ``/changes`` endpoints of these objects are then woken up,
+instead of polling their records with ``_since``.
+
+Channels are the URIs of the buckets and collections
+(e.g. ``/buckets/blog/collections/articles``).
+"""
+import uuid
+
+
+# Keys of the timestamp of the latest change stored in a bucket or
+# collection, in the cache backend, for the current version of the channel.
+STORED_CHANGES_CACHE_KEY = 'changes:%s:%s'
+STORED_CHANGES_VERSION_KEY = 'changes:version:%s'
+
+
+class NotifierBase(object):
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def flush(self):
+        """Forget every published timestamp."""
+        raise NotImplementedError
+
+    def publish(self, channel, timestamp):
+        """Publish the timestamp of a change on the specified channel, and
+        wake up the clients waiting on it.
+
+        :param str channel: the URI of the bucket or collection.
+        :param int timestamp: the timestamp of the changed object.
+        """
+        raise NotImplementedError
+
+    def wait(self, channel, since=None, timeout=None):
+        """Wait until a change newer than `since` is published on the
+        specified channel.
+
+        :param str channel: the URI of the bucket or collection.
+        :param int since: the timestamp of the last change known by the
+            client. If ``None``, wait for the next change.
+        :param float timeout: maximum number of seconds to wait.
+        :returns: the timestamp of the latest change, or ``None`` if no
+            newer change was published in the interim.
+        :rtype: int
+        """
+        raise NotImplementedError
+
+
+# Methods whose endpoints do not change any object.
+READ_METHODS = ('GET', 'HEAD')
+
+
+def notify_changes(request, result, channels):
+    """Publish the timestamp of the objects written by the current request
+    on the specified channels, if notifications are enabled.
+
+    The changes stored in the channels, cached by the ``/changes`` endpoints,
+    are invalidated by bumping their version in the cache backend.
+
+    :param result: the object, or list of objects, returned by the resource
+        endpoint.
+    :param list channels: the URIs of the parent bucket and collection.
+    """
+    notifier = request.registry.notifier
+    if notifier is None or request.method in READ_METHODS:
+        return
+
+    objects = result if isinstance(result, list) else [result]
+    timestamps = [obj['last_modified'] for obj in objects
+                  if 'last_modified' in obj]
+    if not timestamps:
+        return
+
+    timestamp = max(timestamps)
+    cache = request.registry.cache
+    ttl = int(request.registry.settings['notifications_cache_ttl_seconds'])
+    for channel in channels:
+        if ttl > 0:
+            # Outlive the stored changes cached for the former version.
+            cache.set(STORED_CHANGES_VERSION_KEY % channel,
+                      uuid.uuid4().hex, ttl * 2)
+        notifier.publish(channel, timestamp)
@@ -0,0 +1,63 @@
+import threading
+import time
+
+from kinto.notifications import NotifierBase
+
+
+class Memory(NotifierBase):
+    """Notifier where changes are published in process memory.
+
+    Only the clients connected to the process where objects were changed
+    are notified.
+    """
+    def __init__(self, *args, **kwargs):
+        super(Memory, self).__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self._timestamps = {}
+        # Condition and number of waiting clients, by channel.
+        self._waiting = {}
+
+    def flush(self):
+        with self._lock:
+            self._timestamps.clear()
+
+    def publish(self, channel, timestamp):
+        with self._lock:
+            latest = self._timestamps.get(channel)
+            if latest is None or timestamp > latest:
+                self._timestamps[channel] = timestamp
+            if channel in self._waiting:
+                condition, _ = self._waiting[channel]
+                condition.notify_all()
+
+    def wait(self, channel, since=None, timeout=None):
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._lock:
+            if since is None:
+                since = self._timestamps.get(channel)
+
+            condition, count = self._waiting.get(
+                channel, (threading.Condition(self._lock), 0))
+            self._waiting[channel] = (condition, count + 1)
+            try:
+                while True:
+                    latest = self._timestamps.get(channel)
+                    if latest is not None and (since is None or
+                                               latest > since):
+                        return latest
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            return None
+                    condition.wait(remaining)
+            finally:
+                condition, count = self._waiting[channel]
+                if count > 1:
+                    self._waiting[channel] = (condition, count - 1)
+                else:
+                    del self._waiting[channel]
+
+
+def load_from_config(config):
+    return Memory()
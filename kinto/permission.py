@@ -0,0 +1,579 @@
+"""Bulk operations on the permission backend, that are not part of the
+*Cliquet* permission API.
+
+They run natively on the memory, Redis and PostgreSQL backends.
+
+The members of each principal are indexed, so that the principals of deleted
+groups can be removed from the members of their nested groups too: the
+``user_principals`` table is indexed on principals with PostgreSQL (see
+:func:`initialize_schema`), and the users ids are kept in a reverse set of
+each principal with Redis and memory.
+"""
+from itertools import islice
+
+from cliquet.permission import memory, postgresql, redis
+
+
+def like_prefix(uri):
+    """Return a SQL ``LIKE`` pattern that matches the URIs below `uri`."""
+    escaped = uri.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '/%'
+
+
+# Members of each principal, with the Redis and memory backends. The
+# principal is not the second part of the key, otherwise the memory backend
+# would drop the members when the permissions of the group are deleted.
+PRINCIPAL_MEMBERS_KEY = 'members:principal:%s'
+
+POSTGRESQL_SCHEMA = """
+DO $$
+BEGIN
+    IF to_regclass('idx_user_principals_principal') IS NULL THEN
+        CREATE INDEX idx_user_principals_principal
+            ON user_principals (principal);
+    END IF;
+END$$;
+"""
+
+
+def _index_principals_members_redis(permission):
+    client = permission._client
+    with client.pipeline() as pipe:
+        for user_key in client.scan_iter(match='user:*'):
+            user_id = user_key.decode('utf-8')[len('user:'):]
+            principals = permission._decode_set(client.smembers(user_key))
+            for principal in principals:
+                pipe.sadd(PRINCIPAL_MEMBERS_KEY % principal, user_id)
+        pipe.execute()
+
+
+def initialize_schema(permission):
+    """Create the index of the principals members with PostgreSQL, or build
+    it from the users principals with Redis, once the permission backend
+    schema is initialized.
+    """
+    if type(permission) is redis.Redis:
+        _index_principals_members_redis(permission)
+        return
+    if type(permission) is not postgresql.PostgreSQL:
+        return
+    with permission.connect() as cursor:
+        cursor.execute(POSTGRESQL_SCHEMA)
+
+
+def _delete_children_permissions_memory(permission, parent_uri, limit=None):
+    prefix = 'permission:%s/' % parent_uri
+    keys = [key for key in permission._store.keys() if key.startswith(prefix)]
+    for key in keys[:limit]:
+        del permission._store[key]
+    return len(keys[:limit])
+
+
+def _delete_children_permissions_redis(permission, parent_uri, limit=None):
+    match = 'permission:%s/*' % parent_uri
+    keys = list(islice(permission._client.scan_iter(match=match), limit))
+    if keys:
+        permission._client.delete(*keys)
+    return len(keys)
+
+
+def _delete_children_permissions_postgresql(permission, parent_uri,
+                                            limit=None):
+    query = """
+    DELETE
+      FROM access_control_entries
+     WHERE object_id LIKE %(prefix)s;"""
+    placeholders = dict(prefix=like_prefix(parent_uri))
+    if limit is not None:
+        # ``DELETE`` has no ``LIMIT`` clause, rows are picked in a sub-query.
+        query = """
+        DELETE
+          FROM access_control_entries
+         WHERE ctid IN (SELECT ctid
+                          FROM access_control_entries
+                         WHERE object_id LIKE %(prefix)s
+                         LIMIT %(limit)s);"""
+        placeholders['limit'] = limit
+    with permission.connect() as cursor:
+        cursor.execute(query, placeholders)
+        count = cursor.rowcount
+    return count
+
+
+def _delete_children_permissions_generic(permission, parent_uri, limit=None):
+    # The permission API does not allow to list objects ids, entries are
+    # left untouched.
+    return 0
+
+
+_DELETE_CHILDREN_PERMISSIONS = {
+    memory.Memory: _delete_children_permissions_memory,
+    redis.Redis: _delete_children_permissions_redis,
+    postgresql.PostgreSQL: _delete_children_permissions_postgresql,
+}
+
+
+def delete_children_permissions(permission, parent_uri, limit=None):
+    """Delete the access control entries of every object below the object of
+    the specified URI (e.g. the groups, collections and records of a bucket).
+
+    :param permission: the permission backend.
+    :param str parent_uri: the URI of the parent object
+        (e.g. ``/buckets/blog``).
+    :param int limit: maximum number of entries to delete at once. The
+        deletion is complete once ``0`` is returned.
+    :returns: the number of deleted entries (or permission keys with Redis).
+    :rtype: int
+    """
+    # Native implementations rely on the backends internals, hence are
+    # not used for sub-classes.
+    implementation = _DELETE_CHILDREN_PERMISSIONS.get(
+        type(permission), _delete_children_permissions_generic)
+    return implementation(permission, parent_uri, limit)
+
+
+def _add_principal_to_users_memory(permission, user_ids, principal):
+    for user_id in user_ids:
+        user_key = 'user:%s' % user_id
+        permission._store.setdefault(user_key, set()).add(principal)
+    members_key = PRINCIPAL_MEMBERS_KEY % principal
+    permission._store.setdefault(members_key, set()).update(user_ids)
+
+
+def _remove_principal_from_users_memory(permission, user_ids, principal):
+    for user_id in user_ids:
+        user_key = 'user:%s' % user_id
+        user_principals = permission._store.get(user_key)
+        if user_principals is None:
+            continue
+        user_principals.discard(principal)
+        if not user_principals:
+            del permission._store[user_key]
+    members = permission._store.get(PRINCIPAL_MEMBERS_KEY % principal, set())
+    members.difference_update(user_ids)
+    if not members:
+        permission._store.pop(PRINCIPAL_MEMBERS_KEY % principal, None)
+
+
+def _add_principal_to_users_redis(permission, user_ids, principal):
+    with permission._client.pipeline() as pipe:
+        for user_id in user_ids:
+            pipe.sadd('user:%s' % user_id, principal)
+        pipe.sadd(PRINCIPAL_MEMBERS_KEY % principal, *user_ids)
+        pipe.execute()
+
+
+def _remove_principal_from_users_redis(permission, user_ids, principal):
+    # Redis deletes the sets once their last member is removed.
+    with permission._client.pipeline() as pipe:
+        for user_id in user_ids:
+            pipe.srem('user:%s' % user_id, principal)
+        pipe.srem(PRINCIPAL_MEMBERS_KEY % principal, *user_ids)
+        pipe.execute()
+
+
+def _add_principal_to_users_postgresql(permission, user_ids, principal):
+    query = """
+    INSERT INTO user_principals (user_id, principal)
+    SELECT DISTINCT members.user_id, %(principal)s
+      FROM unnest(%(user_ids)s::TEXT[]) AS members(user_id)
+     WHERE NOT EXISTS (
+        SELECT principal
+          FROM user_principals
+         WHERE user_principals.user_id = members.user_id
+           AND principal = %(principal)s
+    );"""
+    placeholders = dict(user_ids=list(user_ids), principal=principal)
+    with permission.connect() as cursor:
+        cursor.execute(query, placeholders)
+
+
+def _remove_principal_from_users_postgresql(permission, user_ids, principal):
+    query = """
+    DELETE FROM user_principals
+     WHERE user_id IN %(user_ids)s
+       AND principal = %(principal)s;"""
+    placeholders = dict(user_ids=tuple(user_ids), principal=principal)
+    with permission.connect() as cursor:
+        cursor.execute(query, placeholders)
+
+
+def _add_principal_to_users_generic(permission, user_ids, principal):
+    for user_id in user_ids:
+        permission.add_user_principal(user_id, principal)
+
+
+def _remove_principal_from_users_generic(permission, user_ids, principal):
+    for user_id in user_ids:
+        permission.remove_user_principal(user_id, principal)
+
+
+_ADD_PRINCIPAL_TO_USERS = {
+    memory.Memory: _add_principal_to_users_memory,
+    redis.Redis: _add_principal_to_users_redis,
+    postgresql.PostgreSQL: _add_principal_to_users_postgresql,
+}
+
+_REMOVE_PRINCIPAL_FROM_USERS = {
+    memory.Memory: _remove_principal_from_users_memory,
+    redis.Redis: _remove_principal_from_users_redis,
+    postgresql.PostgreSQL: _remove_principal_from_users_postgresql,
+}
+
+
+def add_principal_to_users(permission, user_ids, principal):
+    """Add the specified principal to every specified user at once
+    (e.g. the principal of a group to its new members).
+
+    :param permission: the permission backend.
+    :param user_ids: the ids of the users.
+    :param str principal: the principal to add (e.g. the group URI).
+    """
+    if not user_ids:
+        return
+    implementation = _ADD_PRINCIPAL_TO_USERS.get(
+        type(permission), _add_principal_to_users_generic)
+    implementation(permission, user_ids, principal)
+
+
+def remove_principal_from_users(permission, user_ids, principal):
+    """Remove the specified principal from every specified user at once
+    (e.g. the principal of a group from its former members).
+
+    :param permission: the permission backend.
+    :param user_ids: the ids of the users.
+    :param str principal: the principal to remove (e.g. the group URI).
+    """
+    if not user_ids:
+        return
+    implementation = _REMOVE_PRINCIPAL_FROM_USERS.get(
+        type(permission), _remove_principal_from_users_generic)
+    implementation(permission, user_ids, principal)
+
+
+def _principal_members_memory(permission, principal):
+    return set(permission._store.get(PRINCIPAL_MEMBERS_KEY % principal, ()))
+
+
+def _principal_members_redis(permission, principal):
+    members = permission._client.smembers(PRINCIPAL_MEMBERS_KEY % principal)
+    return permission._decode_set(members)
+
+
+def _principal_members_postgresql(permission, principal):
+    query = """
+    SELECT user_id
+      FROM user_principals
+     WHERE principal = %(principal)s;"""
+    with permission.connect() as cursor:
+        cursor.execute(query, dict(principal=principal))
+        results = cursor.fetchall()
+    return set(r['user_id'] for r in results)
+
+
+def _principal_members_generic(permission, principal):
+    # The permission API does not allow to list the members of a principal.
+    return set()
+
+
+_PRINCIPAL_MEMBERS = {
+    memory.Memory: _principal_members_memory,
+    redis.Redis: _principal_members_redis,
+    postgresql.PostgreSQL: _principal_members_postgresql,
+}
+
+
+def principal_members(permission, principal):
+    """Return the ids of the users that have the specified principal, using
+    the index of members.
+
+    :param permission: the permission backend.
+    :param str principal: the principal (e.g. the group URI).
+    :rtype: set
+    """
+    implementation = _PRINCIPAL_MEMBERS.get(
+        type(permission), _principal_members_generic)
+    return implementation(permission, principal)
+
+
+def _remove_principals_memory(permission, principals):
+    user_ids = set()
+    for principal in principals:
+        members = permission._store.pop(PRINCIPAL_MEMBERS_KEY % principal,
+                                        set())
+        for user_id in members:
+            user_key = 'user:%s' % user_id
+            user_principals = permission._store.get(user_key, set())
+            user_principals.discard(principal)
+            if not user_principals:
+                permission._store.pop(user_key, None)
+        user_ids.update(members)
+    return user_ids
+
+
+def _remove_principals_redis(permission, principals):
+    members_keys = [PRINCIPAL_MEMBERS_KEY % p for p in principals]
+    with permission._client.pipeline() as pipe:
+        for members_key in members_keys:
+            pipe.smembers(members_key)
+        members = pipe.execute()
+
+    members = [permission._decode_set(m) for m in members]
+    with permission._client.pipeline() as pipe:
+        for principal, user_ids in zip(principals, members):
+            for user_id in user_ids:
+                pipe.srem('user:%s' % user_id, principal)
+        pipe.delete(*members_keys)
+        pipe.execute()
+    return set().union(*members)
+
+
+def _remove_principals_postgresql(permission, principals):
+    query = """
+    DELETE FROM user_principals
+     WHERE principal IN %(principals)s
+ RETURNING user_id;"""
+    placeholders = dict(principals=tuple(principals))
+    with permission.connect() as cursor:
+        cursor.execute(query, placeholders)
+        results = cursor.fetchall()
+    return set(r['user_id'] for r in results)
+
+
+def _remove_principals_generic(permission, principals):
+    # The permission API does not allow to list the members of a principal.
+    return set()
+
+
+_REMOVE_PRINCIPALS = {
+    memory.Memory: _remove_principals_memory,
+    redis.Redis: _remove_principals_redis,
+    postgresql.PostgreSQL: _remove_principals_postgresql,
+}
+
+
+def remove_principals(permission, principals):
+    """Remove the specified principals from every user, using the index of
+    their members (e.g. the principals of deleted groups).
+
+    :param permission: the permission backend.
+    :param list principals: the principals to remove (e.g. the groups URIs).
+    :returns: the ids of the users whose principals were removed.
+    :rtype: set
+    """
+    principals = list(principals)
+    if not principals:
+        return set()
+    implementation = _REMOVE_PRINCIPALS.get(
+        type(permission), _remove_principals_generic)
+    return implementation(permission, principals)
+
+
+def _remove_children_principals_memory(permission, parent_uri):
+    prefix = PRINCIPAL_MEMBERS_KEY % (parent_uri + '/')
+    principals = [key[len(PRINCIPAL_MEMBERS_KEY % ''):]
+                  for key in permission._store.keys()
+                  if key.startswith(prefix)]
+    return _remove_principals_memory(permission, principals)
+
+
+def _remove_children_principals_redis(permission, parent_uri):
+    match = PRINCIPAL_MEMBERS_KEY % (parent_uri + '/*')
+    keys = permission._client.scan_iter(match=match)
+    principals = [key.decode('utf-8')[len(PRINCIPAL_MEMBERS_KEY % ''):]
+                  for key in keys]
+    if not principals:
+        return set()
+    return _remove_principals_redis(permission, principals)
+
+
+def _remove_children_principals_postgresql(permission, parent_uri):
+    query = """
+    DELETE FROM user_principals
+     WHERE principal LIKE %(prefix)s
+ RETURNING user_id;"""
+    placeholders = dict(prefix=like_prefix(parent_uri))
+    with permission.connect() as cursor:
+        cursor.execute(query, placeholders)
+        results = cursor.fetchall()
+    return set(r['user_id'] for r in results)
+
+
+def _remove_children_principals_generic(permission, parent_uri):
+    # The permission API does not allow to list the principals.
+    return set()
+
+
+_REMOVE_CHILDREN_PRINCIPALS = {
+    memory.Memory: _remove_children_principals_memory,
+    redis.Redis: _remove_children_principals_redis,
+    postgresql.PostgreSQL: _remove_children_principals_postgresql,
+}
+
+
+def remove_children_principals(permission, parent_uri):
+    """Remove the principals of every object below the object of the
+    specified URI (e.g. the groups of a bucket) from every user, using the
+    index of their members.
+
+    :param permission: the permission backend.
+    :param str parent_uri: the URI of the parent object
+        (e.g. ``/buckets/blog``).
+    :returns: the ids of the users whose principals were removed.
+    :rtype: set
+    """
+    implementation = _REMOVE_CHILDREN_PRINCIPALS.get(
+        type(permission), _remove_children_principals_generic)
+    return implementation(permission, parent_uri)
+
+
+def _is_child(object_id, pattern):
+    """Tell if the object is directly below the parent of the specified
+    pattern (e.g. ``/buckets/blog/collections/*``).
+    """
+    prefix = pattern[:-1]
+    if not object_id.startswith(prefix):
+        return False
+    child_id = object_id[len(prefix):]
+    return child_id != '' and '/' not in child_id and ':' not in child_id
+
+
+def _get_accessible_objects_memory(permission, principals, granters):
+    accessible = set()
+    for object_id, perm in granters:
+        if not object_id.endswith('*'):
+            key = 'permission:%s:%s' % (object_id, perm)
+            if permission._store.get(key, set()) & principals:
+                accessible.add((object_id, perm))
+            continue
+        prefix = 'permission:%s' % object_id[:-1]
+        suffix = ':%s' % perm
+        for key, ace_principals in permission._store.items():
+            if not (key.startswith(prefix) and key.endswith(suffix)):
+                continue
+            child_id = key[len('permission:'):-len(suffix)]
+            if _is_child(child_id, object_id) and ace_principals & principals:
+                accessible.add((child_id, perm))
+    return accessible
+
+
+def _get_accessible_objects_redis(permission, principals, granters):
+    keys = []
+    for object_id, perm in granters:
+        if object_id.endswith('*'):
+            match = 'permission:%s:%s' % (object_id, perm)
+            keys.extend(k.decode('utf-8')
+                        for k in permission._client.scan_iter(match=match))
+        else:
+            keys.append('permission:%s:%s' % (object_id, perm))
+
+    with permission._client.pipeline() as pipe:
+        for key in keys:
+            pipe.smembers(key)
+        results = pipe.execute()
+
+    accessible = set()
+    for key, members in zip(keys, results):
+        if permission._decode_set(members) & principals:
+            object_id, perm = key[len('permission:'):].split(':', 1)
+            accessible.add((object_id, perm))
+    return accessible
+
+
+def _get_accessible_objects_postgresql(permission, principals, granters):
+    exact = tuple((o, p) for (o, p) in granters if not o.endswith('*'))
+    patterns = [(o, p) for (o, p) in granters if o.endswith('*')]
+
+    conditions = []
+    placeholders = dict(principals=tuple(principals))
+    if exact:
+        conditions.append('(object_id, permission) IN %(exact)s')
+        placeholders['exact'] = exact
+    for i, (pattern, perm) in enumerate(patterns):
+        conditions.append('(object_id LIKE %%(pattern_%s)s '
+                          'AND permission = %%(permission_%s)s)' % (i, i))
+        placeholders['pattern_%s' % i] = like_prefix(pattern[:-2])
+        placeholders['permission_%s' % i] = perm
+
+    query = """
+    SELECT DISTINCT object_id, permission
+      FROM access_control_entries
+     WHERE principal IN %%(principals)s
+       AND (%s);""" % ' OR '.join(conditions)
+    with permission.connect() as cursor:
+        cursor.execute(query, placeholders)
+        results = cursor.fetchall()
+
+    accessible = set()
+    for result in results:
+        object_id, perm = result['object_id'], result['permission']
+        # ``LIKE`` patterns also match the objects further below.
+        if (object_id, perm) in granters or any(
+                p == perm and _is_child(object_id, o) for (o, p) in patterns):
+            accessible.add((object_id, perm))
+    return accessible
+
+
+def _get_accessible_objects_generic(permission, principals, granters):
+    accessible = set()
+    for object_id, perm in granters:
+        if object_id.endswith('*'):
+            objects = permission.principals_accessible_objects(
+                principals, perm, object_id_match=object_id)
+            accessible.update((o, perm) for o in objects
+                              if _is_child(o, object_id))
+        elif permission.object_permission_principals(object_id,
+                                                     perm) & principals:
+            accessible.add((object_id, perm))
+    return accessible
+
+
+_GET_ACCESSIBLE_OBJECTS = {
+    memory.Memory: _get_accessible_objects_memory,
+    redis.Redis: _get_accessible_objects_redis,
+    postgresql.PostgreSQL: _get_accessible_objects_postgresql,
+}
+
+
+def check_permissions(permission, object_uris, unbound_permission, principals,
+                      get_bound_permissions):
+    """Return the objects among the specified ones on which the principals
+    have the `unbound_permission`, granted on the objects themselves or
+    inherited from their parents.
+
+    Every object is answered with a single query on the permission backend.
+
+    Object URIs can end with ``*`` to designate all the objects of a list
+    (e.g. ``/buckets/blog/collections/articles/records/*``). The URI is
+    returned as is if the permission is granted on the parents of the list,
+    otherwise the URIs of the objects of the list that are shared with the
+    principals are returned.
+
+    :param permission: the permission backend.
+    :param list object_uris: the URIs of the objects.
+    :param str unbound_permission: the permission (e.g. ``read``).
+    :param principals: the principals of the current user.
+    :param get_bound_permissions: the callable that returns the permissions
+        granting the `unbound_permission` on an object, according to the
+        inheritance tree (see
+        :meth:`kinto.authorization.AuthorizationPolicy.get_bound_permissions`).
+    :rtype: set
+    """
+    granters = dict((uri, get_bound_permissions(uri, unbound_permission))
+                    for uri in object_uris)
+    all_granters = set().union(*granters.values())
+    if not all_granters:
+        return set()
+
+    implementation = _GET_ACCESSIBLE_OBJECTS.get(
+        type(permission), _get_accessible_objects_generic)
+    accessible = implementation(permission, set(principals), all_granters)
+
+    permitted = set()
+    for uri, uri_granters in granters.items():
+        if accessible & uri_granters:
+            permitted.add(uri)
+        elif uri.endswith('*'):
+            permitted.update(o for (o, p) in accessible
+                             if (uri, p) in uri_granters and _is_child(o, uri))
+    return permitted
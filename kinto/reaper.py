@@ -0,0 +1,256 @@
+"""Deletion of the children of deleted buckets and collections.
+
+When ``kinto.async_deletion_enabled`` is set, deleting a bucket or a
+collection only deletes the object itself, and schedules the purge of its
+children (groups, collections, records and their permissions). Scheduled
+purges are stored in the storage backend, and are processed in batches by
+the :class:`kinto.reaper.Reaper`. They are thus resumed if the process is
+restarted in the interim.
+
+A single reaper must run per deployment: either in the one process where
+``kinto.async_deletion_reaper_enabled`` is set, or with ``kinto reap``.
+
+While their purge is running, the children are considered as deleted, and
+the deleted objects cannot be created again.
+"""
+import logging
+import threading
+
+from cliquet.errors import ERRORS, http_error
+from cliquet.storage import Sort, exceptions as storage_exceptions
+from pyramid import httpexceptions
+from pyramid.settings import asbool
+
+from kinto.permission import delete_children_permissions
+from kinto.storage import delete_children
+
+
+logger = logging.getLogger(__name__)
+
+# Scheduled purges are stored as records of this collection, whose ids are
+# the URIs of the deleted objects.
+PURGE_COLLECTION_ID = 'purge'
+
+# Key of the URIs of the scheduled purges in the cache backend.
+PURGES_CACHE_KEY = 'purges'
+
+
+def async_deletion_enabled(settings):
+    return asbool(settings.get('async_deletion_enabled'))
+
+
+def pending_purges(request):
+    """Return the URIs of the deleted objects whose children are being purged.
+
+    They are memoized on the request (and batch subrequests), and kept in the
+    cache backend for ``async_deletion_cache_ttl_seconds``.
+    """
+    purges = request.bound_data.get('purges')
+    if purges is not None:
+        return purges
+
+    cache = request.registry.cache
+    settings = request.registry.settings
+    ttl = int(settings.get('async_deletion_cache_ttl_seconds') or 0)
+    cached = cache.get(PURGES_CACHE_KEY) if ttl > 0 else None
+    if cached is not None:
+        purges = set(cached)
+    else:
+        records, _ = request.registry.storage.get_all(
+            collection_id=PURGE_COLLECTION_ID, parent_id='')
+        purges = set(record['id'] for record in records)
+        if ttl > 0:
+            cache.set(PURGES_CACHE_KEY, list(purges), ttl)
+    request.bound_data['purges'] = purges
+    return purges
+
+
+def invalidate_purges(request):
+    """Drop the memoized URIs of the scheduled purges, once changed."""
+    request.bound_data.pop('purges', None)
+    request.registry.cache.delete(PURGES_CACHE_KEY)
+
+
+def raise_404_if_purging(request, *uris):
+    """Raise a 404 error if the children of one the specified objects are
+    being purged.
+    """
+    if not async_deletion_enabled(request.registry.settings):
+        return
+    if pending_purges(request).intersection(uris):
+        raise httpexceptions.HTTPNotFound()
+
+
+def purge_children(request, parent_uri):
+    """Delete every object below the deleted object of the specified URI,
+    or schedule their deletion if ``kinto.async_deletion_enabled`` is set.
+    """
+    registry = request.registry
+    if not async_deletion_enabled(registry.settings):
+        delete_children(registry.storage, parent_uri)
+        delete_children_permissions(registry.permission, parent_uri)
+        return
+
+    registry.storage.update(collection_id=PURGE_COLLECTION_ID,
+                            parent_id='',
+                            object_id=parent_uri,
+                            record={})
+    invalidate_purges(request)
+    registry.reaper.wake()
+
+
+def raise_503_if_purging(request, uri):
+    """Raise a 503 error if the children of the specified object are still
+    being purged.
+
+    Objects can be created again once deleted: their former children must
+    not be visible anymore, and the newly created ones must not be purged.
+    """
+    if not async_deletion_enabled(request.registry.settings):
+        return
+    if uri not in pending_purges(request):
+        return
+
+    request.registry.reaper.wake()
+    message = 'The former %s is still being deleted.' % uri
+    raise http_error(httpexceptions.HTTPServiceUnavailable(),
+                     errno=ERRORS.BACKEND,
+                     message=message)
+
+
+class Reaper(object):
+    """Purge the children of deleted objects in batches, and report the
+    progress in the logs.
+
+    Purges are run one at a time, and their scheduled record is only
+    deleted by the reaper once complete.
+
+    :param storage: the storage backend.
+    :param permission: the permission backend.
+    :param int batch_size: number of objects deleted at once.
+    :param cache: the cache backend, where the scheduled purges are
+        invalidated once complete.
+    """
+    def __init__(self, storage, permission, batch_size=1000, cache=None):
+        self.storage = storage
+        self.permission = permission
+        self.cache = cache
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def pending(self):
+        """Return the scheduled purges records, oldest first."""
+        records, _ = self.storage.get_all(
+            collection_id=PURGE_COLLECTION_ID,
+            parent_id='',
+            sorting=[Sort('last_modified', 1)])
+        return records
+
+    def purge_batch(self, uri):
+        """Delete one batch of children of the specified object, or delete
+        its scheduled purge once they are all gone.
+
+        :returns: the number of objects deleted, ``0`` once the purge is
+            complete.
+        :rtype: int
+        """
+        deleted = delete_children(self.storage, uri, self.batch_size)
+        if deleted == 0:
+            deleted = delete_children_permissions(self.permission, uri,
+                                                  self.batch_size)
+        if deleted == 0:
+            try:
+                self.storage.delete(collection_id=PURGE_COLLECTION_ID,
+                                    parent_id='',
+                                    object_id=uri,
+                                    with_deleted=False)
+            except storage_exceptions.RecordNotFoundError:
+                pass
+            if self.cache is not None:
+                self.cache.delete(PURGES_CACHE_KEY)
+        return deleted
+
+    def purge(self, uri):
+        """Delete every child of the specified object.
+
+        The scheduled purge record is never written here: the object cannot
+        be created again until it is deleted, hence the purged children are
+        necessarily former ones.
+        """
+        with self._lock:
+            # Once completed (e.g. by another reaper, before the object is
+            # created again), the children are new and must be kept.
+            try:
+                self.storage.get(collection_id=PURGE_COLLECTION_ID,
+                                 parent_id='',
+                                 object_id=uri)
+            except storage_exceptions.RecordNotFoundError:
+                return
+
+            progress = 0
+            deleted = self.purge_batch(uri)
+            while deleted > 0:
+                progress += deleted
+                logger.info('Purge of %s in progress (%s deleted)',
+                            uri, progress)
+                deleted = self.purge_batch(uri)
+            logger.info('Purge of %s completed (%s deleted)', uri, progress)
+
+    def run_pending(self):
+        """Process every scheduled purge."""
+        for purge in self.pending():
+            try:
+                self.purge(purge['id'])
+            except Exception:
+                # Will be resumed on next run.
+                logger.exception('Purge of %s failed' % purge['id'])
+
+    def start(self, interval):
+        """Process the scheduled purges in a background thread, when woken
+        up or every `interval` seconds.
+        """
+        self._thread = threading.Thread(target=self.run,
+                                        args=(interval,),
+                                        name='kinto-reaper')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop processing the scheduled purges once the current run is
+        complete.
+        """
+        self._stopped = True
+        self.wake()
+        if self._thread is not None:
+            self._thread.join()
+
+    def wake(self):
+        """Start processing the scheduled purges, if waiting."""
+        self._wakeup.set()
+
+    def run(self, interval):
+        """Process the scheduled purges when woken up or every `interval`
+        seconds, until stopped.
+        """
+        while True:
+            self.run_pending()
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            if self._stopped:
+                break
+
+
+def reap(registry):
+    """Process the scheduled purges of the specified application until
+    interrupted, e.g. from the ``kinto reap`` command.
+    """
+    settings = registry.settings
+    if not async_deletion_enabled(settings):
+        raise ValueError('kinto.async_deletion_enabled is not set.')
+    try:
+        registry.reaper.run(int(settings['async_deletion_interval_seconds']))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,308 @@
+"""Bulk operations on the storage backend, that are not part of the
+*Cliquet* storage API.
+
+They run natively on the memory and PostgreSQL backends, and fall back on
+the standard storage API with the other ones.
+"""
+from collections import OrderedDict
+
+from cliquet.storage import Filter, Sort, memory, postgresql
+from cliquet.utils import COMPARISON, json
+
+from kinto.authorization import object_uri, parse_object_uri
+from kinto.permission import like_prefix
+
+
+# Kinto resources stored below each object type.
+CHILDREN_RESOURCES = {
+    'bucket': ('group', 'collection'),
+    'collection': ('record',),
+    'group': (),
+    'record': (),
+}
+
+
+def _delete_children_memory(storage, parent_uri, limit=None):
+    prefix = parent_uri + '/'
+
+    def is_child(parent_id):
+        return parent_id == parent_uri or parent_id.startswith(prefix)
+
+    # Objects are removed by whole parent, hence batches can exceed `limit`.
+    count = 0
+    for tree in (storage._store, storage._cemetery):
+        for by_parent in tree.values():
+            for parent_id in [p for p in by_parent if is_child(p)]:
+                if limit is not None and count >= limit:
+                    return count
+                count += len(by_parent.pop(parent_id))
+    return count
+
+
+def _delete_children_postgresql(storage, parent_uri, limit=None):
+    query = """
+    WITH deleted_tombstones AS (
+        DELETE
+          FROM deleted
+         WHERE {deleted}
+     RETURNING 1
+    ), deleted_records AS (
+        DELETE
+          FROM records
+         WHERE {records}
+     RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM deleted_tombstones) +
+           (SELECT COUNT(*) FROM deleted_records) AS count;
+    """
+    condition = 'parent_id = %(parent_id)s OR parent_id LIKE %(prefix)s'
+    conditions = dict(deleted=condition, records=condition)
+    placeholders = dict(parent_id=parent_uri, prefix=like_prefix(parent_uri))
+    if limit is not None:
+        # ``DELETE`` has no ``LIMIT`` clause, rows are picked in a sub-query.
+        batch = 'ctid IN (SELECT ctid FROM {table} WHERE %s LIMIT %%(limit)s)'
+        for table in conditions:
+            conditions[table] = (batch % condition).format(table=table)
+        placeholders['limit'] = limit
+
+    with storage.connect() as cursor:
+        cursor.execute(query.format(**conditions), placeholders)
+        count = cursor.fetchone()['count']
+    return count
+
+
+def _delete_children_generic(storage, parent_uri, limit=None):
+    # The storage API cannot delete in batches, `limit` is ignored.
+    parsed = parse_object_uri(parent_uri)
+    count = 0
+    for resource in CHILDREN_RESOURCES[parsed.type]:
+        deleted = storage.delete_all(collection_id=resource,
+                                     parent_id=parent_uri,
+                                     with_deleted=False)
+        count += len(deleted)
+        count += storage.purge_deleted(collection_id=resource,
+                                       parent_id=parent_uri)
+
+        if not CHILDREN_RESOURCES[resource]:
+            continue
+        for child in deleted:
+            child_uri = object_uri(resource, parsed.bucket_id, child['id'])
+            count += _delete_children_generic(storage, child_uri)
+    return count
+
+
+_DELETE_CHILDREN = {
+    memory.Memory: _delete_children_memory,
+    postgresql.PostgreSQL: _delete_children_postgresql,
+}
+
+
+def delete_children(storage, parent_uri, limit=None):
+    """Delete every object stored below the object of the specified URI
+    (e.g. the groups, collections and records of a bucket), along with
+    their tombstones.
+
+    With the PostgreSQL backend, this runs as a single statement on the
+    ``parent_id`` prefix, whatever the number of children collections.
+
+    :param storage: the storage backend.
+    :param str parent_uri: the URI of the parent object
+        (e.g. ``/buckets/blog``).
+    :param int limit: approximate number of objects to delete at once. The
+        deletion is complete once ``0`` is returned.
+    :returns: the number of deleted objects and tombstones.
+    :rtype: int
+    """
+    # Native implementations rely on the backends internals, hence are
+    # not used for sub-classes.
+    implementation = _DELETE_CHILDREN.get(type(storage),
+                                          _delete_children_generic)
+    return implementation(storage, parent_uri, limit)
+
+
+def _iter_records_memory(storage, collection_id, parent_id, batch_size):
+    records = storage._store.get(collection_id, {}).get(parent_id, {})
+    records = sorted(records.values(),
+                     key=lambda r: r['last_modified'], reverse=True)
+    for i in range(0, len(records), batch_size):
+        yield records[i:i + batch_size]
+
+
+def _iter_records_postgresql(storage, collection_id, parent_id, batch_size):
+    query = """
+    SELECT id, as_epoch(last_modified) AS last_modified, data
+      FROM records
+     WHERE parent_id = %(parent_id)s
+       AND collection_id = %(collection_id)s
+     ORDER BY last_modified DESC;
+    """
+    placeholders = dict(parent_id=parent_id, collection_id=collection_id)
+    with storage.connect() as cursor:
+        # Rows are sent by the server as they are fetched.
+        server_cursor = cursor.connection.cursor(name='kinto_iter_records')
+        try:
+            server_cursor.itersize = batch_size
+            server_cursor.execute(query, placeholders)
+            while True:
+                rows = server_cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                records = []
+                for object_id, last_modified, record in rows:
+                    record['id'] = object_id
+                    record['last_modified'] = last_modified
+                    records.append(record)
+                yield records
+        finally:
+            server_cursor.close()
+
+
+def _iter_records_generic(storage, collection_id, parent_id, batch_size):
+    sorting = [Sort('last_modified', -1)]
+    pagination_rules = None
+    while True:
+        records, _ = storage.get_all(collection_id=collection_id,
+                                     parent_id=parent_id,
+                                     sorting=sorting,
+                                     pagination_rules=pagination_rules,
+                                     limit=batch_size)
+        if records:
+            yield records
+        if len(records) < batch_size:
+            break
+        # Timestamps are unique within a collection.
+        pagination_rules = [[Filter('last_modified',
+                                    records[-1]['last_modified'],
+                                    COMPARISON.LT)]]
+
+
+_ITER_RECORDS = {
+    memory.Memory: _iter_records_memory,
+    postgresql.PostgreSQL: _iter_records_postgresql,
+}
+
+
+def iter_records(storage, collection_id, parent_id, batch_size=1000):
+    """Iterate over every record of the specified collection, by batches,
+    from the newest to the oldest.
+
+    With the PostgreSQL backend, a single query is run on a server-side
+    cursor. With the other backends, records are fetched page by page.
+
+    :param storage: the storage backend.
+    :param str collection_id: the resource name (e.g. ``record``).
+    :param str parent_id: the URI of the parent object
+        (e.g. ``/buckets/blog/collections/articles``).
+    :param int batch_size: the number of records fetched at once.
+    :returns: an iterator of lists of records.
+    """
+    implementation = _ITER_RECORDS.get(type(storage), _iter_records_generic)
+    return implementation(storage, collection_id, parent_id, batch_size)
+
+
+def _import_records_postgresql(storage, collection_id, parent_id, records):
+    # Updates and inserts run as separate statements: data-modifying CTEs
+    # share the same snapshot, hence the timestamps bumped for the inserted
+    # records would ignore the updated ones.
+    input_query = """
+    WITH input AS (
+        SELECT *
+          FROM unnest(%(ids)s::TEXT[], %(data)s::JSONB[]) AS input(id, data)
+    )"""
+    update_query = input_query + """
+    UPDATE records
+       SET data = input.data
+      FROM input
+     WHERE records.id = input.id
+       AND records.parent_id = %(parent_id)s
+       AND records.collection_id = %(collection_id)s
+ RETURNING records.id, as_epoch(records.last_modified) AS last_modified;
+    """
+    insert_query = input_query + """
+    INSERT INTO records (id, parent_id, collection_id, data)
+    SELECT input.id, %(parent_id)s, %(collection_id)s, input.data
+      FROM input
+     WHERE NOT EXISTS (SELECT 1
+                         FROM records
+                        WHERE records.id = input.id
+                          AND records.parent_id = %(parent_id)s
+                          AND records.collection_id = %(collection_id)s)
+ RETURNING id, as_epoch(last_modified) AS last_modified;
+    """
+    data = []
+    for record in records:
+        record = dict(record)
+        del record['id']
+        data.append(json.dumps(record))
+    placeholders = dict(ids=[r['id'] for r in records],
+                        data=data,
+                        parent_id=parent_id,
+                        collection_id=collection_id)
+    timestamps = {}
+    with storage.connect() as cursor:
+        for query in (update_query, insert_query):
+            cursor.execute(query, placeholders)
+            timestamps.update((row['id'], row['last_modified'])
+                              for row in cursor.fetchall())
+
+    stored = []
+    for record in records:
+        record = dict(record, last_modified=timestamps[record['id']])
+        stored.append(record)
+    return stored
+
+
+def _import_records_generic(storage, collection_id, parent_id, records):
+    return [storage.update(collection_id=collection_id,
+                           parent_id=parent_id,
+                           object_id=record['id'],
+                           record=record)
+            for record in records]
+
+
+_IMPORT_RECORDS = {
+    postgresql.PostgreSQL: _import_records_postgresql,
+}
+
+
+def import_records(storage, collection_id, parent_id, records):
+    """Create or replace the specified records.
+
+    With the PostgreSQL backend, existing records are updated then new ones
+    are inserted with two statements, in a single transaction. With the
+    other backends, records are stored one by one with ``update()``, and
+    are thus not imported atomically.
+
+    :param storage: the storage backend.
+    :param str collection_id: the resource name (e.g. ``record``).
+    :param str parent_id: the URI of the parent object
+        (e.g. ``/buckets/blog/collections/articles``).
+    :param list records: the records to store, with their ``id``. If several
+        records have the same ``id``, the last one is stored.
+    :returns: the stored records, with their ``last_modified`` timestamp.
+    :rtype: list
+    """
+    unique = OrderedDict((record['id'], record) for record in records)
+    records = list(unique.values())
+    if not records:
+        return []
+    implementation = _IMPORT_RECORDS.get(type(storage),
+                                         _import_records_generic)
+    return implementation(storage, collection_id, parent_id, records)
+
+
+def latest_timestamp(storage, collection_id, parent_id):
+    """Return the timestamp of the latest object (or tombstone) of the
+    specified collection, or ``None`` if it is empty.
+
+    Unlike ``collection_timestamp()``, no timestamp is created for empty
+    collections.
+    """
+    records, _ = storage.get_all(collection_id=collection_id,
+                                 parent_id=parent_id,
+                                 sorting=[Sort('last_modified', -1)],
+                                 limit=1,
+                                 include_deleted=True)
+    if not records:
+        return None
+    return records[0]['last_modified']
@@ -1,5 +1,12 @@
+import mock
+from cliquet.cache import memory as memory_cache
+
 from kinto.authorization import (get_object_type, build_permission_tuple,
-                                 build_permissions_set)
+                                 build_permissions_set, parse_object_uri,
+                                 object_uri, ObjectURI,
+                                 compile_inheritance_tree, granters_cache,
+                                 groupfinder, invalidate_principals,
+                                 AuthorizationPolicy, RouteFactory)
 
 from .support import unittest
 
@@ -27,7 +34,7 @@ class PermissionInheritanceTest(unittest.TestCase):
         self.assertEqual(object_type, 'bucket')
 
     def test_build_perm_set_uri_can_construct_parents_set_uris(self):
-        obj_parts = self.record_uri.split('/')
+        obj_parts = parse_object_uri(self.record_uri)
         # Can build record_uri from obj_parts
         self.assertEqual(
             build_permission_tuple('record', 'write', obj_parts),
@@ -44,19 +51,19 @@ class PermissionInheritanceTest(unittest.TestCase):
             (self.bucket_uri, 'groups:create'))
 
         # Can build group_uri from group obj_parts
-        obj_parts = self.group_uri.split('/')
+        obj_parts = parse_object_uri(self.group_uri)
         self.assertEqual(build_permission_tuple(
             'group', 'read', obj_parts),
             (self.group_uri, 'read'))
 
         # Can build bucket_uri from group obj_parts
-        obj_parts = self.group_uri.split('/')
+        obj_parts = parse_object_uri(self.group_uri)
         self.assertEqual(build_permission_tuple(
             'bucket', 'write', obj_parts),
             (self.bucket_uri, 'write'))
 
     def test_build_permission_tuple_fail_construct_children_set_uris(self):
-        obj_parts = self.bucket_uri.split('/')
+        obj_parts = parse_object_uri(self.bucket_uri)
         # Cannot build record_uri from bucket obj_parts
         self.assertRaises(ValueError,
                           build_permission_tuple,
@@ -67,13 +74,14 @@ class PermissionInheritanceTest(unittest.TestCase):
                           build_permission_tuple,
                           'collection', 'write', obj_parts)
 
-        # Cannot build bucket_uri from empty obj_parts
+        # Cannot build collection_uri from group obj_parts
+        obj_parts = parse_object_uri(self.group_uri)
         self.assertRaises(ValueError,
                           build_permission_tuple,
-                          'collection', 'write', [])
+                          'collection', 'write', obj_parts)
 
     def test_build_permission_tuple_fail_on_wrong_type(self):
-        obj_parts = self.record_uri.split('/')
+        obj_parts = parse_object_uri(self.record_uri)
         self.assertRaises(ValueError,
                           build_permission_tuple,
                           'schema', 'write', obj_parts)
@@ -159,3 +167,214 @@ class PermissionInheritanceTest(unittest.TestCase):
     def test_build_permissions_set_returns_empty_set_if_doesnt_know(self):
         permissions = build_permissions_set('/buckets', 'read')
         self.assertEquals(permissions, set())
+
+    def test_build_permissions_set_of_objects_named_like_endpoints(self):
+        bucket_uri = '/buckets/records'
+        self.assertEquals(
+            build_permissions_set(bucket_uri, 'write'),
+            set([(bucket_uri, 'write')]))
+        collection_uri = '/buckets/records/collections/groups'
+        self.assertEquals(
+            build_permissions_set(collection_uri, 'write'),
+            set([(bucket_uri, 'write'),
+                 (collection_uri, 'write')]))
+
+    def test_build_permissions_set_accepts_a_custom_inheritance_tree(self):
+        tree = {'bucket:read': {'bucket': ['read']}}
+        permissions = build_permissions_set(self.bucket_uri, 'read',
+                                            inheritance_tree=tree)
+        self.assertEquals(permissions, set([(self.bucket_uri, 'read')]))
+
+
+class ObjectURIParsingTest(unittest.TestCase):
+    def test_identifiers_are_extracted_from_uri(self):
+        uri = '/buckets/blog/collections/articles/records/article1'
+        self.assertEqual(parse_object_uri(uri),
+                         ('record', 'blog', 'articles', 'article1'))
+        uri = '/buckets/blog/groups/moderators'
+        self.assertEqual(parse_object_uri(uri),
+                         ('group', 'blog', 'moderators', None))
+
+    def test_type_does_not_depend_on_identifiers(self):
+        self.assertEqual(get_object_type('/buckets/records'), 'bucket')
+        uri = '/buckets/groups/collections/records'
+        self.assertEqual(get_object_type(uri), 'collection')
+        uri = '/buckets/collections/groups/records'
+        self.assertEqual(get_object_type(uri), 'group')
+
+    def test_plural_endpoints_are_parsed_as_their_parent(self):
+        uri = '/buckets/blog/collections/articles/records'
+        self.assertEqual(parse_object_uri(uri),
+                         ('collection', 'blog', 'articles', None))
+
+    def test_unknown_uris_are_not_parsed(self):
+        for uri in ('', '/', '/buckets', '/buckets//collections/articles',
+                    '/buckets/blog/articles', '/buckets/blog/tags/python',
+                    '/buckets/blog/groups/moderators/records',
+                    '/buckets/blog/groups/moderators/records/r1',
+                    '/buckets/blog/collections/articles/comments/c1',
+                    '/buckets/blog/collections/articles/records/r1/tags',
+                    '/bucket/blog'):
+            self.assertIsNone(parse_object_uri(uri))
+
+    def test_object_uri_can_be_built_from_identifiers(self):
+        self.assertEqual(object_uri('bucket', 'blog'), '/buckets/blog')
+        self.assertEqual(object_uri('record', 'blog', 'articles', 'a1'),
+                         '/buckets/blog/collections/articles/records/a1')
+
+    def test_parsed_uri_can_be_built_back(self):
+        uri = '/buckets/blog/collections/articles/records/article1'
+        self.assertEqual(parse_object_uri(uri).build(), uri)
+        self.assertEqual(ObjectURI('group', 'blog', 'mods', None).build(),
+                         '/buckets/blog/groups/mods')
+
+
+class InheritanceTreeCompilationTest(unittest.TestCase):
+    def test_granters_are_flattened_per_bound_permission(self):
+        tree = {'group:read': {'bucket': ['write', 'read'],
+                               'group': ['read']}}
+        self.assertEqual(compile_inheritance_tree(tree),
+                         {'group:read': (('bucket', ('write', 'read')),
+                                         ('group', ('read',)))})
+
+    def test_compilation_fails_on_wrong_type(self):
+        tree = {'record:read': {'schema': ['read']}}
+        self.assertRaises(ValueError, compile_inheritance_tree, tree)
+
+
+class AuthorizationPolicyTest(unittest.TestCase):
+    record_uri = '/buckets/blog/collections/articles/records/article1'
+
+    def setUp(self):
+        self.policy = AuthorizationPolicy()
+        granters_cache.clear()
+
+    def test_bound_permissions_are_the_inherited_ones(self):
+        self.assertEqual(
+            self.policy.get_bound_permissions(self.record_uri, 'read'),
+            build_permissions_set(self.record_uri, 'read'))
+
+    def test_bound_permissions_are_computed_once(self):
+        self.policy.get_bound_permissions(self.record_uri, 'write')
+        self.policy.get_bound_permissions(self.record_uri, 'write')
+        self.policy.get_bound_permissions(self.record_uri, 'read')
+        self.assertEqual(granters_cache.misses, 2)
+        self.assertEqual(granters_cache.hits, 1)
+
+    def test_bound_permissions_cannot_be_altered(self):
+        granters = self.policy.get_bound_permissions(self.record_uri, 'read')
+        self.assertIsInstance(granters, frozenset)
+
+
+class GroupFinderTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = memory_cache.Memory()
+        self.permission = mock.MagicMock()
+        self.permission.user_principals.return_value = {'/buckets/b/groups/g'}
+        self.settings = {'principals_cache_ttl_seconds': 10}
+
+    def new_request(self):
+        request = mock.MagicMock()
+        request.authn_type = 'BasicAuth'
+        request.bound_data = {}
+        request.registry.cache = self.cache
+        request.registry.permission = self.permission
+        request.registry.settings = self.settings
+        return request
+
+    def test_principals_are_read_from_permission_backend(self):
+        principals = groupfinder('bob', self.new_request())
+        self.assertEqual(principals, {'/buckets/b/groups/g'})
+        self.permission.user_principals.assert_called_with('basicauth:bob')
+
+    def test_principals_are_memoized_on_request(self):
+        request = self.new_request()
+        groupfinder('bob', request)
+        self.cache.flush()
+        groupfinder('bob', request)
+        self.assertEqual(self.permission.user_principals.call_count, 1)
+
+    def test_principals_are_shared_among_requests_via_cache(self):
+        groupfinder('bob', self.new_request())
+        principals = groupfinder('bob', self.new_request())
+        self.assertEqual(principals, {'/buckets/b/groups/g'})
+        self.assertEqual(self.permission.user_principals.call_count, 1)
+
+    def test_principals_are_not_shared_if_ttl_is_zero(self):
+        self.settings['principals_cache_ttl_seconds'] = 0
+        groupfinder('bob', self.new_request())
+        groupfinder('bob', self.new_request())
+        self.assertEqual(self.permission.user_principals.call_count, 2)
+        self.assertIsNone(self.cache.get('principals:basicauth:bob:None'))
+
+    def test_invalidated_principals_are_read_again(self):
+        request = self.new_request()
+        groupfinder('bob', request)
+        invalidate_principals(request, ['basicauth:bob'])
+        groupfinder('bob', request)
+        groupfinder('bob', self.new_request())
+        self.assertEqual(self.permission.user_principals.call_count, 2)
+
+    def test_principals_read_before_invalidation_are_not_used(self):
+        def read_and_change_membership(user_id):
+            # Membership changes while a concurrent request reads it.
+            principals = {'/buckets/b/groups/g'}
+            invalidate_principals(self.new_request(), [user_id])
+            return principals
+
+        user_principals = self.permission.user_principals
+        user_principals.side_effect = read_and_change_membership
+        groupfinder('bob', self.new_request())
+        user_principals.side_effect = None
+        user_principals.return_value = set()
+        self.assertEqual(groupfinder('bob', self.new_request()), set())
+
+
+class RouteFactoryTest(unittest.TestCase):
+    def setUp(self):
+        self.request = mock.MagicMock()
+        self.request.registry.settings = {}
+        with mock.patch('cliquet.utils.current_service') as current_service:
+            current_service.return_value = None
+            self.context = RouteFactory(self.request)
+        policy = AuthorizationPolicy()
+        self.get_bound_permissions = policy.get_bound_permissions
+        self.context.get_shared_ids = mock.MagicMock()
+        self.context.get_shared_ids.keywords = {
+            'object_id_match': '/buckets/blog/collections/*'}
+
+    @mock.patch('kinto.authorization.check_permissions')
+    def test_lists_parents_and_shared_objects_are_checked_at_once(
+            self, check_permissions):
+        check_permissions.return_value = {'/buckets/blog/collections/c1'}
+        allowed = self.context.check_permission(
+            'read', ['alice'],
+            get_bound_permissions=self.get_bound_permissions)
+        self.assertFalse(allowed)
+        shared = self.context.fetch_shared_records(
+            'read', ['alice'], self.get_bound_permissions)
+        self.assertEqual(shared, ['c1'])
+        self.assertEqual(check_permissions.call_count, 1)
+        self.assertFalse(self.context.get_shared_ids.called)
+
+    @mock.patch('kinto.authorization.check_permissions')
+    def test_lists_are_allowed_if_granted_on_parents(self, check_permissions):
+        check_permissions.return_value = {'/buckets/blog/collections/*'}
+        allowed = self.context.check_permission(
+            'read', ['alice'],
+            get_bound_permissions=self.get_bound_permissions)
+        self.assertTrue(allowed)
+
+    def test_shared_objects_are_fetched_if_permission_was_not_checked(self):
+        self.context.get_shared_ids.return_value = [
+            '/buckets/blog/collections/c1']
+        shared = self.context.fetch_shared_records(
+            'read', ['alice'], self.get_bound_permissions)
+        self.assertEqual(shared, ['c1'])
+
+    def test_creation_is_checked_on_the_list_only(self):
+        self.context.check_permission(
+            'collection:create', ['alice'],
+            get_bound_permissions=self.get_bound_permissions)
+        self.assertTrue(self.request.registry.permission.check_permission
+                        .called)
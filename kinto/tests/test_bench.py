@@ -0,0 +1,107 @@
+import json
+import os
+import tempfile
+
+import mock
+
+from kinto import bench
+
+from .support import unittest
+
+
+class PercentileTest(unittest.TestCase):
+    def test_returns_the_nearest_rank(self):
+        durations = list(range(1, 101))
+        self.assertEqual(bench.percentile(durations, 50), 50)
+        self.assertEqual(bench.percentile(durations, 99), 99)
+
+    def test_returns_the_only_value(self):
+        self.assertEqual(bench.percentile([3], 99), 3)
+
+
+class RunTest(unittest.TestCase):
+    def test_every_scenario_is_measured(self):
+        results = bench.run(bench.BENCH_SETTINGS, iterations=2)
+        self.assertEqual(list(results['scenarios']), list(bench.SCENARIOS))
+        stats = results['scenarios']['records_list']
+        self.assertEqual(stats['iterations'], 2)
+        self.assertGreater(stats['ops_per_sec'], 0)
+        self.assertLessEqual(stats['p50_ms'], stats['max_ms'])
+        self.assertEqual(results['backends']['storage'],
+                         'cliquet.storage.memory')
+
+    def test_created_objects_are_deleted_once_complete(self):
+        with mock.patch.object(bench.Client, 'delete') as delete:
+            bench.run(bench.BENCH_SETTINGS, ['default_bucket_create'],
+                      iterations=2)
+        deleted = [c[0][0] for c in delete.call_args_list]
+        self.assertEqual(deleted[1], '/buckets/default/collections/bench')
+
+    def test_personal_bucket_is_left_untouched_if_not_benchmarked(self):
+        with mock.patch.object(bench.Client, 'delete') as delete:
+            bench.run(bench.BENCH_SETTINGS, ['records_list'], iterations=2)
+        self.assertEqual(delete.call_count, 1)
+
+    def test_failed_requests_interrupt_the_run(self):
+        class Failing(bench.Scenario):
+            def run(self):
+                self.owner.get('/buckets/unknown')
+
+        with mock.patch.dict(bench.SCENARIOS, {'failing': Failing}):
+            self.assertRaises(bench.BenchError, bench.run,
+                              bench.BENCH_SETTINGS, ['failing'])
+
+    def test_base_scenario_has_no_operation(self):
+        scenario = bench.Scenario(None, None, '/buckets/bench')
+        scenario.prepare()
+        self.assertRaises(NotImplementedError, scenario.run)
+
+
+class CompareTest(unittest.TestCase):
+    def test_changes_of_operations_per_second_are_shown(self):
+        stats = {'p50_ms': 1.0, 'ops_per_sec': 110.0}
+        results = {'scenarios': {'a': stats, 'b': stats}}
+        baseline = {'scenarios': {'a': dict(stats, ops_per_sec=100.0)}}
+        lines = bench.compare(results, baseline)
+        self.assertTrue(lines[1].startswith('a '))
+        self.assertTrue(lines[1].endswith('+10.0%'))
+        self.assertTrue(lines[2].endswith('new'))
+
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        self.args = {'ini': None, 'scenario': ['records_poll'],
+                     'iterations': 1, 'output': None, 'compare': None}
+
+    def test_results_are_written_as_json(self):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            self.addCleanup(os.remove, f.name)
+        self.args['output'] = f.name
+        bench.main(self.args)
+        with open(f.name) as f:
+            results = json.load(f)
+        self.assertIn('records_poll', results['scenarios'])
+
+    @mock.patch('kinto.bench.sys')
+    def test_results_are_compared_with_previous_run(self, sys):
+        with tempfile.NamedTemporaryFile('w', delete=False) as f:
+            self.addCleanup(os.remove, f.name)
+            json.dump({'scenarios': {}}, f)
+        self.args['compare'] = f.name
+        bench.main(self.args)
+        self.assertIn('records_poll', sys.stdout.write.call_args[0][0])
+        self.assertIn('new', sys.stderr.write.call_args[0][0])
+
+    @mock.patch('kinto.bench.get_appsettings')
+    @mock.patch('kinto.bench.run')
+    def test_settings_are_read_from_config_file(self, run, get_appsettings):
+        run.return_value = {'scenarios': {}}
+        self.args['ini'] = 'config/kinto.ini'
+        with mock.patch('kinto.bench.sys'):
+            bench.main(self.args)
+        settings = run.call_args[0][0]
+        self.assertEqual(settings, get_appsettings.return_value)
+
+    def test_unknown_scenarios_are_rejected(self):
+        self.args['scenario'] = ['unknown']
+        self.assertRaises(bench.BenchError, bench.main, self.args)
@@ -3,6 +3,7 @@ from six import text_type
 from uuid import UUID
 
 from cliquet.utils import hmac_digest
+from pyramid.router import Router
 
 from .support import (BaseWebTest, unittest, get_user_headers,
                       MINIMALIST_RECORD)
@@ -151,3 +152,100 @@ class DefaultBucketViewTest(BaseWebTest, unittest.TestCase):
                                wraps=self.storage.get) as patched:
             self.app.post_json('/batch', batch, headers=self.headers)
             self.assertEqual(patched.call_count, 0)
+
+    def test_default_bucket_objects_are_not_created_twice(self):
+        self.app.get(self.collection_url + '/records', headers=self.headers)
+        with mock.patch.object(self.storage, 'create',
+                               wraps=self.storage.create) as patched:
+            self.app.get(self.collection_url + '/records',
+                         headers=self.headers)
+            self.assertEqual(patched.call_count, 0)
+
+    def test_default_bucket_requests_are_not_run_as_subrequests(self):
+        invoke = Router.invoke_subrequest
+        with mock.patch.object(Router, 'invoke_subrequest', autospec=True,
+                               side_effect=invoke) as patched:
+            self.app.get(self.collection_url + '/records',
+                         headers=self.headers)
+            # Only the actual request.
+            self.assertEqual(patched.call_count, 1)
+
+    def test_default_bucket_requests_are_dispatched_to_user_bucket(self):
+        resp = self.app.get(self.bucket_url, headers=self.headers)
+        bucket_id = resp.json['data']['id']
+        self.app.put_json(self.bucket_url + '/groups/admins',
+                          {'data': {'members': [self.principal]}},
+                          headers=self.headers)
+        self.app.get('/buckets/%s/groups/admins' % bucket_id,
+                     headers=self.headers)
+
+    def test_default_bucket_id_is_computed_once_per_user(self):
+        self.app.get(self.bucket_url, headers=self.headers)
+        with mock.patch('kinto.views.buckets.hmac_digest') as patched:
+            self.app.get(self.bucket_url, headers=self.headers)
+            self.assertFalse(patched.called)
+
+    def test_collections_are_created_again_once_bucket_is_deleted(self):
+        self.app.get(self.collection_url, headers=self.headers)
+        self.app.delete(self.bucket_url, headers=self.headers)
+        self.app.get(self.collection_url, headers=self.headers, status=200)
+
+    def test_collection_is_created_again_once_deleted(self):
+        self.app.get(self.collection_url, headers=self.headers)
+        self.app.delete(self.collection_url, headers=self.headers)
+        self.app.get(self.collection_url, headers=self.headers, status=200)
+
+
+class DefaultBucketWithoutCacheTest(BaseWebTest, unittest.TestCase):
+
+    collection_url = '/buckets/default/collections/tasks'
+
+    def get_app_settings(self, extra=None):
+        settings = super(DefaultBucketWithoutCacheTest,
+                         self).get_app_settings(extra)
+        settings['default_bucket_cache_ttl_seconds'] = '0'
+        return settings
+
+    def test_default_bucket_objects_are_created_on_each_request(self):
+        self.app.get(self.collection_url, headers=self.headers)
+        with mock.patch.object(self.storage, 'create',
+                               wraps=self.storage.create) as patched:
+            self.app.get(self.collection_url + '/records',
+                         headers=self.headers)
+            self.assertEqual(patched.call_count, 2)
+
+
+class AsyncDefaultBucketDeletionTest(BaseWebTest, unittest.TestCase):
+
+    collection_url = '/buckets/default/collections/tasks'
+
+    def get_app_settings(self, extra=None):
+        settings = super(AsyncDefaultBucketDeletionTest,
+                         self).get_app_settings(extra)
+        settings['async_deletion_enabled'] = 'true'
+        return settings
+
+    def test_bucket_is_not_created_again_until_purged(self):
+        self.app.post_json(self.collection_url + '/records',
+                           MINIMALIST_RECORD, headers=self.headers)
+        self.app.delete('/buckets/default', headers=self.headers)
+        resp = self.app.get(self.collection_url + '/records',
+                            headers=self.headers, status=503)
+        self.assertIn('Retry-After', resp.headers)
+
+        self.app.app.registry.reaper.run_pending()
+        resp = self.app.get(self.collection_url + '/records',
+                            headers=self.headers)
+        self.assertEqual(resp.json['data'], [])
+
+    def test_collection_is_not_created_again_until_purged(self):
+        self.app.post_json(self.collection_url + '/records',
+                           MINIMALIST_RECORD, headers=self.headers)
+        self.app.delete(self.collection_url, headers=self.headers)
+        self.app.get(self.collection_url + '/records',
+                     headers=self.headers, status=503)
+
+        self.app.app.registry.reaper.run_pending()
+        resp = self.app.get(self.collection_url + '/records',
+                            headers=self.headers)
+        self.assertEqual(resp.json['data'], [])
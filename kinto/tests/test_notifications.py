@@ -0,0 +1,91 @@
+import threading
+import time
+
+from kinto.notifications import NotifierBase
+from kinto.notifications.memory import Memory
+
+from .support import unittest
+
+
+class NotifierBaseTest(unittest.TestCase):
+    def setUp(self):
+        self.notifier = NotifierBase()
+
+    def test_methods_are_not_implemented(self):
+        self.assertRaises(NotImplementedError, self.notifier.flush)
+        self.assertRaises(NotImplementedError, self.notifier.publish,
+                          '/buckets/blog', 42)
+        self.assertRaises(NotImplementedError, self.notifier.wait,
+                          '/buckets/blog')
+
+
+class MemoryNotifierTest(unittest.TestCase):
+    def setUp(self):
+        self.notifier = Memory()
+        self.channel = '/buckets/blog/collections/articles'
+
+    def wait_in_thread(self, **kwargs):
+        results = []
+
+        def wait():
+            results.append(self.notifier.wait(self.channel, **kwargs))
+
+        thread = threading.Thread(target=wait)
+        thread.start()
+        # Let the thread start waiting.
+        while self.channel not in self.notifier._waiting:
+            time.sleep(0.001)
+        return thread, results
+
+    def test_newer_changes_are_returned_immediately(self):
+        self.notifier.publish(self.channel, 42)
+        self.assertEqual(self.notifier.wait(self.channel, since=41), 42)
+
+    def test_latest_change_is_returned(self):
+        self.notifier.publish(self.channel, 43)
+        self.notifier.publish(self.channel, 42)
+        self.assertEqual(self.notifier.wait(self.channel, since=0), 43)
+
+    def test_none_is_returned_if_no_change_before_timeout(self):
+        self.notifier.publish(self.channel, 42)
+        self.assertIsNone(self.notifier.wait(self.channel, since=42,
+                                             timeout=0.01))
+
+    def test_channels_are_isolated(self):
+        self.notifier.publish('/buckets/blog', 42)
+        self.assertIsNone(self.notifier.wait(self.channel, since=0,
+                                             timeout=0))
+
+    def test_waiting_clients_are_woken_up_by_changes(self):
+        self.notifier.publish(self.channel, 42)
+        thread, results = self.wait_in_thread(since=42, timeout=5)
+        self.notifier.publish(self.channel, 43)
+        thread.join()
+        self.assertEqual(results, [43])
+
+    def test_clients_wait_for_next_change_without_since(self):
+        self.notifier.publish(self.channel, 42)
+        thread, results = self.wait_in_thread()
+        self.notifier.publish(self.channel, 43)
+        thread.join()
+        self.assertEqual(results, [43])
+
+    def test_clients_wait_for_first_change_without_since(self):
+        thread, results = self.wait_in_thread()
+        self.notifier.publish(self.channel, 42)
+        thread.join()
+        self.assertEqual(results, [42])
+
+    def test_waiting_clients_are_forgotten_once_done(self):
+        threads = [self.wait_in_thread(timeout=5)[0] for i in range(2)]
+        self.assertEqual(self.notifier._waiting[self.channel][1], 2)
+        self.notifier.publish(self.channel, 42)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.notifier._waiting, {})
+
+    def test_flush_forgets_published_changes(self):
+        self.notifier.publish(self.channel, 42)
+        self.notifier.flush()
+        self.assertIsNone(self.notifier.wait(self.channel, since=0,
+                                             timeout=0))
@@ -0,0 +1,527 @@
+import mock
+from cliquet.permission import memory, postgresql, redis
+
+from kinto.authorization import AuthorizationPolicy
+from kinto.permission import (add_principal_to_users, check_permissions,
+                              delete_children_permissions,
+                              initialize_schema, principal_members,
+                              remove_children_principals, remove_principals,
+                              remove_principal_from_users)
+
+from .support import unittest
+
+
+class MemoryDeleteChildrenPermissionsTest(unittest.TestCase):
+    def setUp(self):
+        self.permission = memory.Memory()
+        for object_id in ('/buckets/blog',
+                          '/buckets/blog/groups/moderators',
+                          '/buckets/blog/collections/articles',
+                          '/buckets/blog/collections/articles/records/a1',
+                          '/buckets/blogs/collections/articles'):
+            self.permission.add_principal_to_ace(object_id, 'write', 'alice')
+
+    def principals(self, object_id):
+        return self.permission.object_permission_principals(object_id,
+                                                            'write')
+
+    def test_deletes_entries_of_children_objects(self):
+        delete_children_permissions(self.permission, '/buckets/blog')
+        self.assertEqual(
+            self.principals('/buckets/blog/groups/moderators'), set())
+        self.assertEqual(
+            self.principals('/buckets/blog/collections/articles'), set())
+        self.assertEqual(
+            self.principals('/buckets/blog/collections/articles/records/a1'),
+            set())
+
+    def test_deletes_a_limited_number_of_entries(self):
+        count = delete_children_permissions(self.permission, '/buckets/blog',
+                                            limit=2)
+        self.assertEqual(count, 2)
+
+    def test_keeps_entries_of_parent_and_other_objects(self):
+        delete_children_permissions(self.permission, '/buckets/blog')
+        self.assertEqual(self.principals('/buckets/blog'), {'alice'})
+        self.assertEqual(
+            self.principals('/buckets/blogs/collections/articles'),
+            {'alice'})
+
+    def test_sub_classes_entries_are_left_untouched(self):
+        class CustomPermission(memory.Memory):
+            pass
+        permission = CustomPermission()
+        permission.add_principal_to_ace('/buckets/blog/groups/moderators',
+                                        'write', 'alice')
+        delete_children_permissions(permission, '/buckets/blog')
+        self.assertEqual(permission.object_permission_principals(
+            '/buckets/blog/groups/moderators', 'write'), {'alice'})
+
+
+class RedisDeleteChildrenPermissionsTest(unittest.TestCase):
+    def setUp(self):
+        self.permission = redis.Redis.__new__(redis.Redis)
+        self.permission._client = mock.MagicMock()
+
+    def test_deletes_matching_keys(self):
+        client = self.permission._client
+        client.scan_iter.return_value = iter(['a', 'b'])
+        delete_children_permissions(self.permission, '/buckets/blog')
+        client.scan_iter.assert_called_with(
+            match='permission:/buckets/blog/*')
+        client.delete.assert_called_with('a', 'b')
+
+    def test_does_nothing_if_no_key_matches(self):
+        client = self.permission._client
+        client.scan_iter.return_value = iter([])
+        delete_children_permissions(self.permission, '/buckets/blog')
+        self.assertFalse(client.delete.called)
+
+
+class PostgreSQLDeleteChildrenPermissionsTest(unittest.TestCase):
+    def setUp(self):
+        self.permission = postgresql.PostgreSQL.__new__(postgresql.PostgreSQL)
+        self.cursor = mock.MagicMock()
+        self.permission.connect = mock.MagicMock()
+        connect = self.permission.connect.return_value
+        connect.__enter__.return_value = self.cursor
+
+    def test_deletes_entries_by_prefix(self):
+        delete_children_permissions(self.permission, '/buckets/my_blog')
+        query, placeholders = self.cursor.execute.call_args[0]
+        self.assertIn('FROM access_control_entries', query)
+        self.assertEqual(placeholders, dict(prefix='/buckets/my\\_blog/%'))
+
+    def test_deletes_a_limited_number_of_entries(self):
+        self.cursor.rowcount = 10
+        count = delete_children_permissions(self.permission, '/buckets/blog',
+                                            limit=10)
+        self.assertEqual(count, 10)
+        query, placeholders = self.cursor.execute.call_args[0]
+        self.assertIn('LIMIT', query)
+        self.assertEqual(placeholders['limit'], 10)
+
+
+class MemoryPrincipalToUsersTest(unittest.TestCase):
+    def setUp(self):
+        self.permission = memory.Memory()
+        self.permission.add_user_principal('alice', '/buckets/blog/groups/a')
+
+    def test_principal_is_added_to_every_user(self):
+        add_principal_to_users(self.permission, ['alice', 'bob'],
+                               '/buckets/blog/groups/b')
+        self.assertEqual(self.permission.user_principals('alice'),
+                         {'/buckets/blog/groups/a', '/buckets/blog/groups/b'})
+        self.assertEqual(self.permission.user_principals('bob'),
+                         {'/buckets/blog/groups/b'})
+
+    def test_principal_is_removed_from_every_user(self):
+        add_principal_to_users(self.permission, ['alice', 'bob'],
+                               '/buckets/blog/groups/b')
+        remove_principal_from_users(self.permission, ['alice', 'bob'],
+                                    '/buckets/blog/groups/b')
+        self.assertEqual(self.permission.user_principals('alice'),
+                         {'/buckets/blog/groups/a'})
+        self.assertEqual(self.permission.user_principals('bob'), set())
+
+    def test_members_of_principal_are_indexed(self):
+        add_principal_to_users(self.permission, ['alice', 'bob'], 'group')
+        remove_principal_from_users(self.permission, ['bob'], 'group')
+        self.assertEqual(
+            self.permission._store['members:principal:group'], {'alice'})
+        remove_principal_from_users(self.permission, ['alice'], 'group')
+        self.assertNotIn('members:principal:group', self.permission._store)
+
+    def test_users_without_principals_are_deleted(self):
+        remove_principal_from_users(self.permission, ['alice', 'bob'],
+                                    '/buckets/blog/groups/a')
+        self.assertNotIn('user:alice', self.permission._store)
+
+    def test_sub_classes_use_the_permission_api(self):
+        class CustomPermission(memory.Memory):
+            pass
+        permission = CustomPermission()
+        with mock.patch.object(permission, 'add_user_principal') as add:
+            add_principal_to_users(permission, ['alice'], 'group')
+            add.assert_called_with('alice', 'group')
+        with mock.patch.object(permission, 'remove_user_principal') as rm:
+            remove_principal_from_users(permission, ['alice'], 'group')
+            rm.assert_called_with('alice', 'group')
+
+    def test_nothing_is_done_without_users(self):
+        with mock.patch.object(self.permission, '_store') as store:
+            add_principal_to_users(self.permission, set(), 'group')
+            remove_principal_from_users(self.permission, set(), 'group')
+            self.assertFalse(store.method_calls)
+
+
+class RedisPrincipalToUsersTest(unittest.TestCase):
+    def setUp(self):
+        self.permission = redis.Redis.__new__(redis.Redis)
+        self.permission._client = mock.MagicMock()
+        pipeline = self.permission._client.pipeline.return_value
+        self.pipe = pipeline.__enter__.return_value
+
+    def test_principal_is_added_in_a_single_pipeline(self):
+        add_principal_to_users(self.permission, ['alice', 'bob'], 'group')
+        self.pipe.sadd.assert_any_call('user:alice', 'group')
+        self.pipe.sadd.assert_any_call('user:bob', 'group')
+        self.pipe.sadd.assert_any_call('members:principal:group',
+                                       'alice', 'bob')
+        self.assertEqual(self.pipe.execute.call_count, 1)
+
+    def test_principal_is_removed_in_a_single_pipeline(self):
+        remove_principal_from_users(self.permission, ['alice', 'bob'],
+                                    'group')
+        self.pipe.srem.assert_any_call('user:alice', 'group')
+        self.pipe.srem.assert_any_call('user:bob', 'group')
+        self.pipe.srem.assert_any_call('members:principal:group',
+                                       'alice', 'bob')
+        self.assertEqual(self.pipe.execute.call_count, 1)
+
+
+class PostgreSQLPrincipalToUsersTest(unittest.TestCase):
+    def setUp(self):
+        self.permission = postgresql.PostgreSQL.__new__(postgresql.PostgreSQL)
+        self.cursor = mock.MagicMock()
+        self.permission.connect = mock.MagicMock()
+        connect = self.permission.connect.return_value
+        connect.__enter__.return_value = self.cursor
+
+    def test_principal_is_added_in_a_single_statement(self):
+        add_principal_to_users(self.permission, ['alice', 'bob'], 'group')
+        self.assertEqual(self.cursor.execute.call_count, 1)
+        query, placeholders = self.cursor.execute.call_args[0]
+        self.assertIn('INSERT INTO user_principals', query)
+        self.assertEqual(placeholders, dict(user_ids=['alice', 'bob'],
+                                            principal='group'))
+
+    def test_principal_is_removed_in_a_single_statement(self):
+        remove_principal_from_users(self.permission, ['alice', 'bob'],
+                                    'group')
+        self.assertEqual(self.cursor.execute.call_count, 1)
+        query, placeholders = self.cursor.execute.call_args[0]
+        self.assertIn('DELETE FROM user_principals', query)
+        self.assertEqual(placeholders, dict(user_ids=('alice', 'bob'),
+                                            principal='group'))
+
+
+class MemoryRemovePrincipalsTest(unittest.TestCase):
+    def setUp(self):
+        self.permission = memory.Memory()
+        add_principal_to_users(self.permission, ['alice', 'bob'], 'group1')
+        add_principal_to_users(self.permission, ['alice'], 'group2')
+        add_principal_to_users(self.permission, ['carl'], 'group3')
+
+    def test_principals_are_removed_from_their_members(self):
+        remove_principals(self.permission, ['group1', 'group2'])
+        self.assertEqual(self.permission.user_principals('alice'), set())
+        self.assertEqual(self.permission.user_principals('bob'), set())
+        self.assertEqual(self.permission.user_principals('carl'), {'group3'})
+
+    def test_members_index_of_principals_is_deleted(self):
+        remove_principals(self.permission, ['group1'])
+        self.assertNotIn('members:principal:group1', self.permission._store)
+
+    def test_members_of_removed_principals_are_returned(self):
+        members = remove_principals(self.permission, ['group1', 'group2'])
+        self.assertEqual(members, {'alice', 'bob'})
+
+    def test_members_index_is_kept_when_group_permissions_are_deleted(self):
+        self.permission.delete_object_permissions('group1')
+        members = remove_principals(self.permission, ['group1'])
+        self.assertEqual(members, {'alice', 'bob'})
+
+    def test_nothing_is_done_without_principals(self):
+        self.assertEqual(remove_principals(self.permission, []), set())
+
+    def test_members_of_principals_are_read_from_index(self):
+        self.assertEqual(principal_members(self.permission, 'group1'),
+                         {'alice', 'bob'})
+        self.assertEqual(principal_members(self.permission, 'unknown'),
+                         set())
+
+    def test_sub_classes_users_are_left_untouched(self):
+        class CustomPermission(memory.Memory):
+            pass
+        permission = CustomPermission()
+        permission.add_user_principal('alice', 'group1')
+        self.assertEqual(remove_principals(permission, ['group1']), set())
+        self.assertEqual(permission.user_principals('alice'), {'group1'})
+        self.assertEqual(principal_members(permission, 'group1'), set())
+
+    def test_principals_below_an_object_are_removed(self):
+        add_principal_to_users(self.permission, ['alice'],
+                               '/buckets/blog/groups/admins')
+        add_principal_to_users(self.permission, ['bob'],
+                               '/buckets/blog2/groups/admins')
+        members = remove_children_principals(self.permission,
+                                             '/buckets/blog')
+        self.assertEqual(members, {'alice'})
+        self.assertEqual(self.permission.user_principals('alice'),
+                         {'group1', 'group2'})
+        self.assertEqual(self.permission.user_principals('bob'),
+                         {'group1', '/buckets/blog2/groups/admins'})
+
+    def test_sub_classes_principals_below_an_object_are_left_untouched(self):
+        class CustomPermission(memory.Memory):
+            pass
+        permission = CustomPermission()
+        permission.add_user_principal('alice', '/buckets/blog/groups/a')
+        members = remove_children_principals(permission, '/buckets/blog')
+        self.assertEqual(members, set())
+
+
+class RedisRemovePrincipalsTest(unittest.TestCase):
+    def setUp(self):
+        self.permission = redis.Redis.__new__(redis.Redis)
+        self.permission._client = mock.MagicMock()
+        pipeline = self.permission._client.pipeline.return_value
+        self.pipe = pipeline.__enter__.return_value
+        self.pipe.execute.side_effect = [[{b'alice', b'bob'}, {b'alice'}],
+                                         []]
+
+    def test_members_are_read_and_updated_in_two_pipelines(self):
+        remove_principals(self.permission, ['group1', 'group2'])
+        self.pipe.smembers.assert_any_call('members:principal:group1')
+        self.pipe.smembers.assert_any_call('members:principal:group2')
+        self.pipe.srem.assert_any_call('user:alice', 'group1')
+        self.pipe.srem.assert_any_call('user:bob', 'group1')
+        self.pipe.srem.assert_any_call('user:alice', 'group2')
+        self.pipe.delete.assert_called_with('members:principal:group1',
+                                            'members:principal:group2')
+        self.assertEqual(self.pipe.execute.call_count, 2)
+
+    def test_members_of_removed_principals_are_returned(self):
+        members = remove_principals(self.permission, ['group1', 'group2'])
+        self.assertEqual(members, {'alice', 'bob'})
+
+    def test_principals_below_an_object_are_scanned_from_index(self):
+        client = self.permission._client
+        client.scan_iter.return_value = [
+            b'members:principal:/buckets/blog/groups/g1',
+            b'members:principal:/buckets/blog/groups/g2']
+        members = remove_children_principals(self.permission,
+                                             '/buckets/blog')
+        self.assertEqual(members, {'alice', 'bob'})
+        client.scan_iter.assert_called_with(
+            match='members:principal:/buckets/blog/*')
+        self.pipe.srem.assert_any_call('user:bob', '/buckets/blog/groups/g1')
+
+    def test_nothing_is_done_without_principals_below_an_object(self):
+        self.permission._client.scan_iter.return_value = []
+        members = remove_children_principals(self.permission,
+                                             '/buckets/blog')
+        self.assertEqual(members, set())
+        self.assertFalse(self.pipe.execute.called)
+
+    def test_members_index_is_built_with_schema(self):
+        client = self.permission._client
+        client.scan_iter.return_value = [b'user:alice']
+        client.smembers.return_value = {b'group1'}
+        self.pipe.execute.side_effect = None
+        initialize_schema(self.permission)
+        client.scan_iter.assert_called_with(match='user:*')
+        self.pipe.sadd.assert_called_with('members:principal:group1',
+                                          'alice')
+
+    def test_members_of_principals_are_read_from_index(self):
+        client = self.permission._client
+        client.smembers.return_value = {b'alice'}
+        self.assertEqual(principal_members(self.permission, 'group1'),
+                         {'alice'})
+        client.smembers.assert_called_with('members:principal:group1')
+
+
+class PostgreSQLRemovePrincipalsTest(unittest.TestCase):
+    def setUp(self):
+        self.permission = postgresql.PostgreSQL.__new__(postgresql.PostgreSQL)
+        self.cursor = mock.MagicMock()
+        self.permission.connect = mock.MagicMock()
+        connect = self.permission.connect.return_value
+        connect.__enter__.return_value = self.cursor
+
+    def test_principals_are_removed_in_a_single_statement(self):
+        self.cursor.fetchall.return_value = [{'user_id': 'alice'},
+                                             {'user_id': 'alice'},
+                                             {'user_id': 'bob'}]
+        members = remove_principals(self.permission, ['group1', 'group2'])
+        self.assertEqual(members, {'alice', 'bob'})
+        self.assertEqual(self.cursor.execute.call_count, 1)
+        query, placeholders = self.cursor.execute.call_args[0]
+        self.assertIn('DELETE FROM user_principals', query)
+        self.assertEqual(placeholders,
+                         dict(principals=('group1', 'group2')))
+
+    def test_members_of_principals_are_read_from_index(self):
+        self.cursor.fetchall.return_value = [{'user_id': 'alice'}]
+        members = principal_members(self.permission, 'group1')
+        self.assertEqual(members, {'alice'})
+        query, placeholders = self.cursor.execute.call_args[0]
+        self.assertIn('WHERE principal = %(principal)s', query)
+        self.assertEqual(placeholders, dict(principal='group1'))
+
+    def test_principals_below_an_object_are_removed_by_prefix(self):
+        self.cursor.fetchall.return_value = [{'user_id': 'alice'}]
+        members = remove_children_principals(self.permission,
+                                             '/buckets/my_blog')
+        self.assertEqual(members, {'alice'})
+        query, placeholders = self.cursor.execute.call_args[0]
+        self.assertIn('WHERE principal LIKE %(prefix)s', query)
+        self.assertEqual(placeholders,
+                         dict(prefix='/buckets/my\\_blog/%'))
+
+    def test_principals_index_is_created_with_schema(self):
+        initialize_schema(self.permission)
+        query, = self.cursor.execute.call_args[0]
+        self.assertIn('ON user_principals (principal)', query)
+
+    def test_no_schema_is_created_with_other_backends(self):
+        permission = mock.MagicMock()
+        initialize_schema(permission)
+        self.assertFalse(permission.connect.called)
+
+
+class CheckPermissionsTest(unittest.TestCase):
+    records = '/buckets/blog/collections/articles/records/*'
+
+    def setUp(self):
+        self.permission = memory.Memory()
+        policy = AuthorizationPolicy()
+        self.get_bound_permissions = policy.get_bound_permissions
+        self.permission.add_principal_to_ace('/buckets/blog', 'read', 'bob')
+        for record_id in ('a1', 'a2'):
+            self.permission.add_principal_to_ace(
+                '/buckets/blog/collections/articles/records/%s' % record_id,
+                'read', 'alice')
+        self.permission.add_principal_to_ace(
+            '/buckets/blog/collections/articles/records/a3', 'write', 'carl')
+
+    def check(self, object_uris, principals, permission='read'):
+        return check_permissions(self.permission, object_uris, permission,
+                                 principals, self.get_bound_permissions)
+
+    def test_objects_are_permitted_if_inherited_from_parents(self):
+        uri = '/buckets/blog/collections/articles/records/a1'
+        self.assertEqual(self.check([uri, self.records], ['bob']),
+                         {uri, self.records})
+
+    def test_objects_are_permitted_if_granted_on_themselves(self):
+        uris = ['/buckets/blog/collections/articles/records/a1',
+                '/buckets/blog/collections/articles/records/a3']
+        self.assertEqual(self.check(uris, ['alice']), {uris[0]})
+        self.assertEqual(self.check(uris, ['carl']), {uris[1]})
+
+    def test_shared_objects_of_lists_are_returned(self):
+        self.assertEqual(self.check([self.records], ['alice', 'carl']), {
+            '/buckets/blog/collections/articles/records/a1',
+            '/buckets/blog/collections/articles/records/a2',
+            '/buckets/blog/collections/articles/records/a3'})
+
+    def test_objects_further_below_lists_are_not_returned(self):
+        self.permission.add_principal_to_ace('/buckets/blog/collections/c',
+                                             'read', 'alice')
+        self.assertEqual(self.check(['/buckets/*'], ['alice']), set())
+
+    def test_nothing_is_permitted_to_other_principals(self):
+        self.assertEqual(self.check([self.records], ['eve']), set())
+
+    def test_nothing_is_permitted_without_granters(self):
+        self.assertEqual(self.check(['/buckets'], ['bob']), set())
+
+    def test_sub_classes_use_the_permission_api(self):
+        class CustomPermission(memory.Memory):
+            pass
+        permission = CustomPermission()
+        permission._store = self.permission._store
+        uri = '/buckets/blog/collections/articles/records/a1'
+        permitted = check_permissions(permission, [uri, self.records],
+                                      'read', ['alice'],
+                                      self.get_bound_permissions)
+        self.assertEqual(permitted, {
+            uri, '/buckets/blog/collections/articles/records/a2'})
+
+
+class RedisCheckPermissionsTest(unittest.TestCase):
+    def setUp(self):
+        self.permission = redis.Redis.__new__(redis.Redis)
+        self.permission._client = mock.MagicMock()
+        pipeline = self.permission._client.pipeline.return_value
+        self.pipe = pipeline.__enter__.return_value
+        policy = AuthorizationPolicy()
+        self.get_bound_permissions = policy.get_bound_permissions
+
+    def test_aces_are_read_in_a_single_pipeline(self):
+        store = {
+            'permission:/buckets/blog/collections/c1:read': {b'bob'},
+            'permission:/buckets/blog/collections/c2:read': {b'alice'},
+            'permission:/buckets/blog/collections/c2/records/r:read': {
+                b'alice'},
+        }
+
+        def scan_iter(match):
+            prefix = match.split('*')[0]
+            suffix = match.split('*')[1]
+            return iter([k.encode('utf-8') for k in store
+                         if k.startswith(prefix) and k.endswith(suffix)])
+
+        keys = []
+        self.permission._client.scan_iter.side_effect = scan_iter
+        self.pipe.smembers.side_effect = keys.append
+        self.pipe.execute.side_effect = lambda: [store.get(k, set())
+                                                 for k in keys]
+        permitted = check_permissions(self.permission,
+                                      ['/buckets/blog/collections/*'],
+                                      'read', ['alice'],
+                                      self.get_bound_permissions)
+        self.assertEqual(permitted, {'/buckets/blog/collections/c2'})
+        self.assertEqual(self.pipe.execute.call_count, 1)
+        self.assertIn('permission:/buckets/blog:write', keys)
+
+
+class PostgreSQLCheckPermissionsTest(unittest.TestCase):
+    def setUp(self):
+        self.permission = postgresql.PostgreSQL.__new__(postgresql.PostgreSQL)
+        self.cursor = mock.MagicMock()
+        self.permission.connect = mock.MagicMock()
+        connect = self.permission.connect.return_value
+        connect.__enter__.return_value = self.cursor
+        policy = AuthorizationPolicy()
+        self.get_bound_permissions = policy.get_bound_permissions
+
+    def check(self, object_uris):
+        return check_permissions(self.permission, object_uris, 'read',
+                                 ['alice'], self.get_bound_permissions)
+
+    def test_objects_are_checked_in_a_single_query(self):
+        self.cursor.fetchall.return_value = [
+            {'object_id': '/buckets/blog/collections/c2',
+             'permission': 'read'}]
+        permitted = self.check(['/buckets/blog/collections/c1',
+                                '/buckets/blog/collections/c2'])
+        self.assertEqual(permitted, {'/buckets/blog/collections/c2'})
+        self.assertEqual(self.cursor.execute.call_count, 1)
+        query, placeholders = self.cursor.execute.call_args[0]
+        self.assertIn('(object_id, permission) IN %(exact)s', query)
+        self.assertIn(('/buckets/blog/collections/c1', 'write'),
+                      placeholders['exact'])
+        self.assertEqual(placeholders['principals'], ('alice',))
+
+    def test_shared_objects_of_lists_are_matched_by_prefix(self):
+        self.cursor.fetchall.return_value = [
+            {'object_id': '/buckets/b_1/collections/c', 'permission': 'read'},
+            {'object_id': '/buckets/b_1/collections/c/records/r',
+             'permission': 'read'},
+            {'object_id': '/buckets/b_10', 'permission': 'read'}]
+        permitted = self.check(['/buckets/b_1/collections/*'])
+        self.assertEqual(permitted, {'/buckets/b_1/collections/c'})
+        query, placeholders = self.cursor.execute.call_args[0]
+        self.assertIn('object_id LIKE %(pattern_0)s', query)
+        self.assertEqual(placeholders['pattern_0'],
+                         '/buckets/b\\_1/collections/%')
+
+    def test_lists_without_parents_are_matched_by_prefix_only(self):
+        self.cursor.fetchall.return_value = []
+        self.check(['/buckets/*'])
+        query, placeholders = self.cursor.execute.call_args[0]
+        self.assertNotIn('%(exact)s', query)
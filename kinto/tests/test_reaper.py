@@ -0,0 +1,139 @@
+import threading
+
+import mock
+from cliquet.permission import memory as memory_permission
+from cliquet.storage import memory as memory_storage
+
+from kinto.reaper import Reaper, PURGE_COLLECTION_ID, reap
+
+from .support import unittest
+
+
+class ReaperTest(unittest.TestCase):
+    def setUp(self):
+        self.storage = memory_storage.Memory()
+        self.permission = memory_permission.Memory()
+        self.reaper = Reaper(self.storage, self.permission, batch_size=2)
+
+        for i in range(3):
+            collection_uri = '/buckets/blog/collections/c%s' % i
+            self.storage.create(collection_id='collection',
+                                parent_id='/buckets/blog',
+                                record={'id': 'c%s' % i})
+            self.storage.create(collection_id='record',
+                                parent_id=collection_uri,
+                                record={'id': 'r1'})
+            self.permission.add_principal_to_ace(collection_uri,
+                                                 'write', 'alice')
+        self.schedule('/buckets/blog')
+
+    def schedule(self, uri):
+        self.storage.update(collection_id=PURGE_COLLECTION_ID,
+                            parent_id='',
+                            object_id=uri,
+                            record={})
+
+    def count_collections(self):
+        records, _ = self.storage.get_all(collection_id='collection',
+                                          parent_id='/buckets/blog')
+        return len(records)
+
+    def test_children_are_deleted_in_batches(self):
+        # Objects are deleted by parent, hence a batch of 3 collections.
+        self.assertEqual(self.reaper.purge_batch('/buckets/blog'), 3)
+        self.assertEqual(self.count_collections(), 0)
+        self.assertEqual(self.reaper.purge_batch('/buckets/blog'), 2)
+
+    def test_progress_is_logged(self):
+        with mock.patch('kinto.reaper.logger') as logger:
+            self.reaper.purge('/buckets/blog')
+        progress = [c[0][2] for c in logger.info.call_args_list]
+        self.assertEqual(progress, [3, 5, 6, 8, 9, 9])
+
+    def test_scheduled_purge_is_never_written_by_the_reaper(self):
+        with mock.patch.object(self.storage, 'update') as update:
+            self.reaper.purge('/buckets/blog')
+        self.assertFalse(update.called)
+
+    def test_purge_completed_by_another_reaper_does_not_fail(self):
+        self.storage.delete(collection_id=PURGE_COLLECTION_ID,
+                            parent_id='',
+                            object_id='/buckets/blog')
+        self.reaper.purge_batch('/buckets/blog')
+        while self.reaper.purge_batch('/buckets/blog'):
+            pass
+        self.assertEqual(self.reaper.pending(), [])
+
+    def test_purges_are_run_one_at_a_time(self):
+        self.reaper._lock.acquire()
+        thread = threading.Thread(target=self.reaper.purge,
+                                  args=('/buckets/blog',))
+        thread.start()
+        thread.join(0.1)
+        self.assertEqual(self.count_collections(), 3)
+        self.reaper._lock.release()
+        thread.join()
+        self.assertEqual(self.count_collections(), 0)
+
+    def test_permissions_are_deleted_once_objects_are_gone(self):
+        self.reaper.purge('/buckets/blog')
+        principals = self.permission.object_permission_principals(
+            '/buckets/blog/collections/c1', 'write')
+        self.assertEqual(principals, set())
+
+    def test_scheduled_purge_is_deleted_once_complete(self):
+        self.reaper.purge('/buckets/blog')
+        self.assertEqual(self.reaper.pending(), [])
+
+    def test_purge_can_be_resumed_by_another_reaper(self):
+        self.reaper.purge_batch('/buckets/blog')
+        other = Reaper(self.storage, self.permission, batch_size=2)
+        other.run_pending()
+        self.assertEqual(self.count_collections(), 0)
+        self.assertEqual(other.pending(), [])
+
+    def test_purge_completed_in_the_interim_is_ignored(self):
+        self.storage.delete(collection_id=PURGE_COLLECTION_ID,
+                            parent_id='',
+                            object_id='/buckets/blog')
+        self.reaper.purge('/buckets/blog')
+        self.assertEqual(self.count_collections(), 3)
+
+    def test_pending_purges_are_processed_oldest_first(self):
+        self.schedule('/buckets/other')
+        uris = [purge['id'] for purge in self.reaper.pending()]
+        self.assertEqual(uris, ['/buckets/blog', '/buckets/other'])
+
+    def test_failures_are_logged_and_do_not_stop_the_run(self):
+        self.schedule('/buckets/other')
+        with mock.patch.object(self.reaper, 'purge',
+                               side_effect=ValueError) as purge:
+            with mock.patch('kinto.reaper.logger') as logger:
+                self.reaper.run_pending()
+        self.assertEqual(purge.call_count, 2)
+        self.assertTrue(logger.exception.called)
+
+    def test_background_thread_processes_pending_purges(self):
+        self.reaper.start(interval=60)
+        self.reaper.stop()
+        self.assertEqual(self.reaper.pending(), [])
+        self.assertEqual(self.count_collections(), 0)
+
+    def test_stopping_a_reaper_not_started_does_nothing(self):
+        self.reaper.stop()
+
+
+class ReapTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = mock.MagicMock()
+        self.registry.settings = {'async_deletion_enabled': 'true',
+                                  'async_deletion_interval_seconds': 60}
+
+    def test_reaper_is_run_until_interrupted(self):
+        self.registry.reaper.run.side_effect = KeyboardInterrupt
+        reap(self.registry)
+        self.registry.reaper.run.assert_called_with(60)
+
+    def test_async_deletion_must_be_enabled(self):
+        self.registry.settings['async_deletion_enabled'] = 'false'
+        self.assertRaises(ValueError, reap, self.registry)
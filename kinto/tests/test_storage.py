@@ -0,0 +1,284 @@
+import mock
+from cliquet.storage import memory, postgresql
+
+from kinto.storage import (like_prefix, delete_children, import_records,
+                           iter_records)
+
+from .support import unittest
+
+
+class LikePrefixTest(unittest.TestCase):
+    def test_matches_uris_below_the_specified_one(self):
+        self.assertEqual(like_prefix('/buckets/blog'), '/buckets/blog/%')
+
+    def test_escapes_like_wildcards(self):
+        self.assertEqual(like_prefix('/buckets/my_blog'),
+                         '/buckets/my\\_blog/%')
+        self.assertEqual(like_prefix('/buckets/100%'),
+                         '/buckets/100\\%/%')
+        self.assertEqual(like_prefix('/buckets/a\\b'),
+                         '/buckets/a\\\\b/%')
+
+
+class DeleteChildrenTest(object):
+    def setUp(self):
+        self.storage = self.get_storage()
+        self.create('group', '/buckets/blog', 'moderators')
+        self.create('collection', '/buckets/blog', 'articles')
+        self.create('collection', '/buckets/blog', 'drafts')
+        self.create('record', '/buckets/blog/collections/articles', 'a1')
+        self.create('record', '/buckets/blog/collections/articles', 'a2')
+        self.create('record', '/buckets/blog/collections/drafts', 'd1')
+        self.storage.delete(collection_id='record',
+                            parent_id='/buckets/blog/collections/drafts',
+                            object_id='d1')
+        # Another bucket which shares the same prefix.
+        self.create('collection', '/buckets/blogs', 'articles')
+        self.create('record', '/buckets/blogs/collections/articles', 'a1')
+
+    def create(self, collection_id, parent_id, object_id):
+        self.storage.create(collection_id=collection_id,
+                            parent_id=parent_id,
+                            record={'id': object_id})
+
+    def count(self, collection_id, parent_id, include_deleted=False):
+        records, _ = self.storage.get_all(collection_id=collection_id,
+                                          parent_id=parent_id,
+                                          include_deleted=include_deleted)
+        return len(records)
+
+    def test_deletes_every_children_of_a_bucket(self):
+        count = delete_children(self.storage, '/buckets/blog')
+        # 5 objects and 1 tombstone.
+        self.assertEqual(count, 6)
+        self.assertEqual(self.count('group', '/buckets/blog'), 0)
+        self.assertEqual(self.count('collection', '/buckets/blog'), 0)
+        self.assertEqual(
+            self.count('record', '/buckets/blog/collections/articles'), 0)
+
+    def test_deletes_tombstones_of_children(self):
+        delete_children(self.storage, '/buckets/blog')
+        parent_id = '/buckets/blog/collections/drafts'
+        self.assertEqual(self.count('record', parent_id,
+                                    include_deleted=True), 0)
+
+    def test_deletes_records_of_a_collection_only(self):
+        delete_children(self.storage, '/buckets/blog/collections/articles')
+        self.assertEqual(
+            self.count('record', '/buckets/blog/collections/articles'), 0)
+        self.assertEqual(self.count('collection', '/buckets/blog'), 2)
+
+    def test_can_delete_children_in_batches(self):
+        count = delete_children(self.storage, '/buckets/blog', limit=1)
+        total = count
+        while count > 0:
+            count = delete_children(self.storage, '/buckets/blog', limit=1)
+            total += count
+        self.assertEqual(total, 6)
+        self.assertEqual(self.count('collection', '/buckets/blog'), 0)
+
+    def test_does_not_delete_objects_of_other_buckets(self):
+        delete_children(self.storage, '/buckets/blog')
+        self.assertEqual(self.count('collection', '/buckets/blogs'), 1)
+        self.assertEqual(
+            self.count('record', '/buckets/blogs/collections/articles'), 1)
+
+
+class MemoryDeleteChildrenTest(DeleteChildrenTest, unittest.TestCase):
+    def get_storage(self):
+        return memory.Memory()
+
+    def test_children_are_deleted_by_parent_in_batches(self):
+        count = delete_children(self.storage, '/buckets/blog', limit=1)
+        self.assertLess(count, 6)
+
+
+class GenericDeleteChildrenTest(DeleteChildrenTest, unittest.TestCase):
+    def get_storage(self):
+        # Sub-classes of backends are only used through the storage API.
+        class CustomStorage(memory.Memory):
+            pass
+        return CustomStorage()
+
+
+class PostgreSQLDeleteChildrenTest(unittest.TestCase):
+    def setUp(self):
+        self.storage = postgresql.PostgreSQL.__new__(postgresql.PostgreSQL)
+        self.cursor = mock.MagicMock()
+        self.cursor.fetchone.return_value = {'count': 42}
+        self.storage.connect = mock.MagicMock()
+        connect = self.storage.connect.return_value
+        connect.__enter__.return_value = self.cursor
+
+    def test_deletes_records_and_tombstones_in_one_statement(self):
+        count = delete_children(self.storage, '/buckets/blog')
+        self.assertEqual(count, 42)
+        self.assertEqual(self.cursor.execute.call_count, 1)
+        query, placeholders = self.cursor.execute.call_args[0]
+        self.assertIn('FROM deleted', query)
+        self.assertIn('FROM records', query)
+        self.assertEqual(placeholders, dict(parent_id='/buckets/blog',
+                                            prefix='/buckets/blog/%'))
+
+    def test_deletes_a_limited_number_of_rows_per_table(self):
+        delete_children(self.storage, '/buckets/blog', limit=100)
+        query, placeholders = self.cursor.execute.call_args[0]
+        self.assertIn('ctid IN (SELECT ctid FROM deleted', query)
+        self.assertIn('ctid IN (SELECT ctid FROM records', query)
+        self.assertEqual(placeholders['limit'], 100)
+
+
+class IterRecordsTest(object):
+    parent_id = '/buckets/blog/collections/articles'
+
+    def setUp(self):
+        self.storage = self.get_storage()
+        for i in range(5):
+            self.storage.create(collection_id='record',
+                                parent_id=self.parent_id,
+                                record={'title': 'article %s' % i})
+        self.storage.create(collection_id='record',
+                            parent_id='/buckets/blog/collections/drafts',
+                            record={'title': 'draft'})
+
+    def test_returns_every_record_by_batches(self):
+        batches = list(iter_records(self.storage, 'record', self.parent_id,
+                                    batch_size=2))
+        self.assertEqual([len(b) for b in batches], [2, 2, 1])
+
+    def test_returns_records_from_the_newest(self):
+        records = [r for batch in iter_records(self.storage, 'record',
+                                               self.parent_id)
+                   for r in batch]
+        titles = ['article %s' % i for i in range(4, -1, -1)]
+        self.assertEqual([r['title'] for r in records], titles)
+
+    def test_returns_nothing_if_collection_is_empty(self):
+        batches = list(iter_records(self.storage, 'record', '/buckets/b'))
+        self.assertEqual(batches, [])
+
+
+class MemoryIterRecordsTest(IterRecordsTest, unittest.TestCase):
+    def get_storage(self):
+        return memory.Memory()
+
+
+class GenericIterRecordsTest(IterRecordsTest, unittest.TestCase):
+    def get_storage(self):
+        class CustomStorage(memory.Memory):
+            pass
+        return CustomStorage()
+
+    def test_last_page_is_not_fetched_if_batch_is_incomplete(self):
+        with mock.patch.object(self.storage, 'get_all',
+                               wraps=self.storage.get_all) as get_all:
+            list(iter_records(self.storage, 'record', self.parent_id,
+                              batch_size=2))
+        self.assertEqual(get_all.call_count, 3)
+
+
+class PostgreSQLIterRecordsTest(unittest.TestCase):
+    def setUp(self):
+        self.storage = postgresql.PostgreSQL.__new__(postgresql.PostgreSQL)
+        cursor = mock.MagicMock()
+        self.storage.connect = mock.MagicMock()
+        connect = self.storage.connect.return_value
+        connect.__enter__.return_value = cursor
+        self.server_cursor = cursor.connection.cursor.return_value
+        self.server_cursor.fetchmany.side_effect = [
+            [('a', 2, {'title': 'a'}), ('b', 1, {'title': 'b'})],
+            [],
+        ]
+
+    def test_records_are_fetched_from_a_server_side_cursor(self):
+        batches = list(iter_records(self.storage, 'record', '/buckets/b',
+                                    batch_size=2))
+        self.assertEqual(batches, [[
+            {'id': 'a', 'last_modified': 2, 'title': 'a'},
+            {'id': 'b', 'last_modified': 1, 'title': 'b'},
+        ]])
+        self.assertEqual(self.server_cursor.execute.call_count, 1)
+        self.server_cursor.fetchmany.assert_called_with(2)
+        self.assertTrue(self.server_cursor.close.called)
+
+
+class ImportRecordsTest(object):
+    parent_id = '/buckets/blog/collections/articles'
+
+    def setUp(self):
+        self.storage = self.get_storage()
+        self.existing = self.storage.create(collection_id='record',
+                                            parent_id=self.parent_id,
+                                            record={'title': 'existing'})
+
+    def get_records(self):
+        records, _ = self.storage.get_all(collection_id='record',
+                                          parent_id=self.parent_id)
+        return dict((r['id'], r) for r in records)
+
+    def test_records_are_created_or_replaced(self):
+        stored = import_records(self.storage, 'record', self.parent_id, [
+            {'id': self.existing['id'], 'title': 'replaced'},
+            {'id': 'new', 'title': 'created'},
+        ])
+        self.assertEqual(len(stored), 2)
+        records = self.get_records()
+        self.assertEqual(records[self.existing['id']]['title'], 'replaced')
+        self.assertEqual(records['new']['title'], 'created')
+
+    def test_stored_records_have_their_timestamp(self):
+        stored = import_records(self.storage, 'record', self.parent_id,
+                                [{'id': 'new', 'title': 'created'}])
+        records = self.get_records()
+        self.assertEqual(stored[0]['last_modified'],
+                         records['new']['last_modified'])
+
+    def test_last_record_is_stored_if_ids_are_duplicated(self):
+        stored = import_records(self.storage, 'record', self.parent_id, [
+            {'id': 'new', 'title': 'first'},
+            {'id': 'new', 'title': 'last'},
+        ])
+        self.assertEqual(len(stored), 1)
+        self.assertEqual(self.get_records()['new']['title'], 'last')
+
+    def test_nothing_is_stored_if_list_is_empty(self):
+        self.assertEqual(import_records(self.storage, 'record',
+                                        self.parent_id, []), [])
+
+
+class MemoryImportRecordsTest(ImportRecordsTest, unittest.TestCase):
+    def get_storage(self):
+        return memory.Memory()
+
+
+class PostgreSQLImportRecordsTest(unittest.TestCase):
+    def setUp(self):
+        self.storage = postgresql.PostgreSQL.__new__(postgresql.PostgreSQL)
+        self.cursor = mock.MagicMock()
+        self.cursor.fetchall.return_value = [{'id': 'a', 'last_modified': 2},
+                                             {'id': 'b', 'last_modified': 3}]
+        self.storage.connect = mock.MagicMock()
+        connect = self.storage.connect.return_value
+        connect.__enter__.return_value = self.cursor
+
+    def test_records_are_updated_then_inserted_in_one_transaction(self):
+        self.cursor.fetchall.side_effect = [[{'id': 'a', 'last_modified': 2}],
+                                            [{'id': 'b', 'last_modified': 3}]]
+        stored = import_records(self.storage, 'record', '/buckets/b', [
+            {'id': 'a', 'title': 'a'},
+            {'id': 'b', 'title': 'b'},
+        ])
+        self.assertEqual(self.storage.connect.call_count, 1)
+        self.assertEqual(self.cursor.execute.call_count, 2)
+        (update, placeholders), (insert, _) = [
+            c[0] for c in self.cursor.execute.call_args_list]
+        self.assertIn('UPDATE records', update)
+        self.assertNotIn('INSERT INTO records', update)
+        self.assertIn('INSERT INTO records', insert)
+        self.assertEqual(placeholders['ids'], ['a', 'b'])
+        self.assertEqual(placeholders['data'],
+                         ['{"title":"a"}', '{"title":"b"}'])
+        self.assertEqual(stored, [
+            {'id': 'a', 'title': 'a', 'last_modified': 2},
+            {'id': 'b', 'title': 'b', 'last_modified': 3},
+        ])
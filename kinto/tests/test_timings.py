@@ -0,0 +1,170 @@
+import mock
+
+from kinto import timings
+from kinto.timings import PhasesStats, RequestTimings, statsd_hook, timed
+
+from .support import (BaseWebTest, unittest, get_user_headers,
+                      MINIMALIST_BUCKET, MINIMALIST_COLLECTION,
+                      MINIMALIST_RECORD, USER_PRINCIPAL)
+
+
+received = []
+
+
+def receive_timings(request, phases):
+    received.append(phases)
+
+
+def phases_of(response):
+    header = response.headers['Server-Timing']
+    return [value.split(';')[0] for value in header.split(', ')]
+
+
+class TimedTest(unittest.TestCase):
+    def setUp(self):
+        self.request = mock.MagicMock()
+        self.request.bound_data = {timings.TIMINGS_KEY: RequestTimings()}
+
+    def test_durations_are_summed_by_phase(self):
+        with timed(self.request, 'lookup'):
+            pass
+        first = self.request.bound_data['timings'].phases['lookup']
+        with timed(self.request, 'lookup'):
+            pass
+        phases = self.request.bound_data['timings'].phases
+        self.assertEqual(list(phases.keys()), ['lookup'])
+        self.assertGreater(phases['lookup'], first)
+
+    def test_nothing_is_timed_if_disabled(self):
+        self.request.registry.timings = None
+        self.assertIs(timed(self.request, 'lookup'), timings._NOT_TIMED)
+        with timed(self.request, 'lookup'):
+            pass
+        self.assertEqual(self.request.bound_data['timings'].phases, {})
+
+    def test_nothing_is_timed_if_request_was_not_started(self):
+        self.request.bound_data = {}
+        self.assertIs(timed(self.request, 'lookup'), timings._NOT_TIMED)
+
+    def test_header_lists_durations_in_milliseconds(self):
+        request_timings = RequestTimings()
+        request_timings.add('groupfinder', 0.0012)
+        request_timings.add('total', 0.5)
+        self.assertEqual(request_timings.header(),
+                         'groupfinder;dur=1.200, total;dur=500.000')
+
+
+class PhasesStatsTest(unittest.TestCase):
+    def test_durations_are_aggregated_in_histograms(self):
+        stats = PhasesStats()
+        stats.add({'groupfinder': 0.0003, 'total': 0.002})
+        stats.add({'total': 0.004})
+        stats.add({'total': 60})
+        phases = stats.as_dict()['phases']
+        self.assertEqual(list(phases.keys()), ['groupfinder', 'total'])
+        self.assertEqual(phases['groupfinder']['count'], 1)
+        self.assertEqual(phases['groupfinder']['histogram_ms']['0.5'], 1)
+        total = phases['total']
+        self.assertEqual(total['count'], 3)
+        self.assertEqual(total['mean_ms'], 20002.0)
+        self.assertEqual(total['max_ms'], 60000.0)
+        self.assertEqual(total['histogram_ms']['2.5'], 1)
+        self.assertEqual(total['histogram_ms']['5'], 1)
+        self.assertEqual(total['histogram_ms']['+Inf'], 1)
+        self.assertEqual(sum(total['histogram_ms'].values()), 3)
+
+
+class StatsdHookTest(unittest.TestCase):
+    def setUp(self):
+        self.request = mock.MagicMock()
+
+    def test_durations_are_sent_in_milliseconds(self):
+        statsd_hook(self.request, {'groupfinder': 0.002})
+        statsd = self.request.registry.statsd
+        statsd.timer.assert_called_with('timings.groupfinder')
+        self.assertEqual(statsd.timer.return_value.ms, 2.0)
+        self.assertTrue(statsd.timer.return_value.send.called)
+
+    def test_nothing_is_sent_if_statsd_is_disabled(self):
+        self.request.registry.statsd = None
+        statsd_hook(self.request, {'groupfinder': 0.002})
+
+
+class TimingsDisabledTest(BaseWebTest, unittest.TestCase):
+    def test_no_header_is_returned(self):
+        resp = self.app.get('/', headers=self.headers)
+        self.assertNotIn('Server-Timing', resp.headers)
+
+    def test_stats_endpoint_is_not_served(self):
+        self.app.get('/__stats__', headers=self.headers, status=404)
+
+
+class TimingsTest(BaseWebTest, unittest.TestCase):
+
+    records_url = '/buckets/beers/collections/barley/records'
+
+    def get_app_settings(self, extra=None):
+        settings = super(TimingsTest, self).get_app_settings(extra)
+        settings['timings_enabled'] = 'True'
+        settings['timings_hook'] = 'kinto.tests.test_timings.receive_timings'
+        settings['stats_endpoint_principals'] = USER_PRINCIPAL
+        return settings
+
+    def setUp(self):
+        super(TimingsTest, self).setUp()
+        self.app.put_json('/buckets/beers', MINIMALIST_BUCKET,
+                          headers=self.headers)
+        self.app.put_json('/buckets/beers/collections/barley',
+                          MINIMALIST_COLLECTION,
+                          headers=self.headers)
+        del received[:]
+
+    def test_phases_of_default_bucket_are_timed(self):
+        resp = self.app.post_json('/buckets/default/collections/tasks/records',
+                                  MINIMALIST_RECORD,
+                                  headers=self.headers)
+        self.assertEqual(phases_of(resp), ['groupfinder',
+                                           'default_bucket_id',
+                                           'create_bucket',
+                                           'create_collection',
+                                           'permissions',
+                                           'collection_lookup',
+                                           'schema_validation',
+                                           'total'])
+
+    def test_phases_of_batch_subrequests_are_summed(self):
+        request = {'method': 'POST', 'path': self.records_url,
+                   'body': MINIMALIST_RECORD}
+        resp = self.app.post_json('/batch', {'requests': [request] * 3},
+                                  headers=self.headers)
+        self.assertIn('collection_lookup', phases_of(resp))
+        self.assertEqual(len(received), 1)
+
+    def test_timings_are_passed_to_the_hook(self):
+        self.app.get(self.records_url, headers=self.headers)
+        self.assertEqual(list(received[0].keys()), ['groupfinder',
+                                                    'permissions',
+                                                    'collection_lookup',
+                                                    'total'])
+
+    def test_error_responses_are_timed(self):
+        resp = self.app.get('/buckets/unknown/collections/barley/records',
+                            headers=self.headers, status=403)
+        self.assertIn('total', phases_of(resp))
+
+    def test_stats_endpoint_returns_aggregated_histograms(self):
+        self.app.get(self.records_url, headers=self.headers)
+        self.app.get(self.records_url, headers=self.headers)
+        resp = self.app.get('/__stats__', headers=self.headers)
+        phases = resp.json['phases']
+        self.assertIn('since', resp.json)
+        self.assertEqual(phases['collection_lookup']['count'], 2)
+        histogram = phases['collection_lookup']['histogram_ms']
+        self.assertEqual(sum(histogram.values()), 2)
+
+    def test_stats_endpoint_requires_authentication(self):
+        self.app.get('/__stats__', status=401)
+
+    def test_stats_endpoint_is_restricted_to_listed_principals(self):
+        self.app.get('/__stats__', headers=get_user_headers('alice'),
+                     status=403)
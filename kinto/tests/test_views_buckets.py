@@ -1,3 +1,4 @@
+import mock
 from pyramid.security import Authenticated
 
 from .support import (BaseWebTest, unittest, get_user_headers,
@@ -34,6 +35,16 @@ class BucketViewTest(BaseWebTest, unittest.TestCase):
                                  headers=self.headers)
         self.assertEqual(resp.json['data']['id'], 'alexis_beers')
 
+    def test_buckets_can_be_named_like_endpoints(self):
+        self.app.put_json('/buckets/records', MINIMALIST_BUCKET,
+                          headers=self.headers)
+        self.app.get('/buckets/records', headers=self.headers)
+        self.app.put_json('/buckets/records/collections/groups',
+                          MINIMALIST_COLLECTION,
+                          headers=self.headers)
+        self.app.get('/buckets/records/collections/groups/records',
+                     headers=self.headers)
+
     def test_nobody_can_list_buckets_by_default(self):
         self.app.get(self.collection_url,
                      headers=get_user_headers('alice'),
@@ -86,6 +97,24 @@ class BucketCreationTest(BaseWebTest, unittest.TestCase):
         self.assertEqual(r.json['data']['id'], bucket)
 
 
+class TimeOrderedBucketCreationTest(BaseWebTest, unittest.TestCase):
+    def get_app_settings(self, extra=None):
+        settings = super(TimeOrderedBucketCreationTest,
+                         self).get_app_settings(extra)
+        settings['name_generator'] = 'kinto.views.TimeOrderedNameGenerator'
+        return settings
+
+    def test_buckets_names_are_ordered_by_creation(self):
+        ids = [self.app.post_json('/buckets', MINIMALIST_BUCKET,
+                                  headers=self.headers).json['data']['id']
+               for _ in range(3)]
+        self.assertEqual(ids, sorted(ids))
+
+    def test_buckets_can_still_be_put_with_simple_name(self):
+        self.app.put_json('/buckets/beers', MINIMALIST_BUCKET,
+                          headers=self.headers, status=201)
+
+
 class BucketReadPermissionTest(BaseWebTest, unittest.TestCase):
 
     collection_url = '/buckets'
@@ -179,3 +208,147 @@ class BucketDeletionTest(BaseWebTest, unittest.TestCase):
         resp = self.app.get('%s/records?_since=0' % self.collection_url,
                             headers=self.headers)
         self.assertEqual(len(resp.json['data']), 0)
+
+    def test_members_of_groups_lose_their_principals(self):
+        self.assertEqual(self.permission.user_principals('fxa:user'), set())
+
+    def test_permissions_of_children_are_deleted_too(self):
+        self.assertEqual(self.permission.object_permission_principals(
+            self.record_url, 'write'), set())
+        self.assertEqual(self.permission.object_permission_principals(
+            self.group_url, 'write'), set())
+        self.assertEqual(self.permission.object_permission_principals(
+            self.collection_url, 'write'), set())
+
+
+class AsyncBucketDeletionTest(BaseWebTest, unittest.TestCase):
+
+    bucket_url = '/buckets/beers'
+    collection_url = '/buckets/beers/collections/barley'
+    group_url = '/buckets/beers/groups/moderators'
+
+    def setUp(self):
+        self.app.put_json(self.bucket_url, MINIMALIST_BUCKET,
+                          headers=self.headers)
+        self.app.put_json(self.group_url, MINIMALIST_GROUP,
+                          headers=self.headers)
+        self.app.put_json(self.collection_url, MINIMALIST_COLLECTION,
+                          headers=self.headers)
+        r = self.app.post_json(self.collection_url + '/records',
+                               MINIMALIST_RECORD,
+                               headers=self.headers)
+        self.record_url = self.collection_url + '/records/%s' % (
+            r.json['data']['id'])
+        self.app.delete(self.bucket_url, headers=self.headers)
+
+    def get_app_settings(self, extra=None):
+        settings = super(AsyncBucketDeletionTest, self).get_app_settings(
+            extra)
+        settings['async_deletion_enabled'] = 'true'
+        return settings
+
+    def count_collections(self):
+        records, _ = self.storage.get_all(collection_id='collection',
+                                          parent_id=self.bucket_url)
+        return len(records)
+
+    def test_children_are_not_deleted_immediately(self):
+        self.assertEqual(self.count_collections(), 1)
+
+    def test_members_of_groups_lose_their_principals_immediately(self):
+        self.assertEqual(self.permission.user_principals('fxa:user'), set())
+
+    def test_children_are_not_found_while_being_purged(self):
+        self.app.get(self.group_url, headers=self.headers, status=404)
+        self.app.get(self.collection_url, headers=self.headers, status=404)
+        self.app.get(self.collection_url + '/records', headers=self.headers,
+                     status=404)
+        self.app.get(self.record_url, headers=self.headers, status=404)
+
+    def test_reaper_thread_is_not_started_by_default(self):
+        self.assertIsNone(self.app.app.registry.reaper._thread)
+
+    def test_reaper_thread_is_started_if_enabled(self):
+        settings = self.get_app_settings({
+            'async_deletion_reaper_enabled': 'true'})
+        with mock.patch('kinto.reaper.Reaper.start') as start:
+            self._get_test_app(settings)
+        start.assert_called_with(60)
+
+    def test_children_are_deleted_by_the_reaper(self):
+        self.app.app.registry.reaper.run_pending()
+        self.assertEqual(self.count_collections(), 0)
+
+    def test_bucket_is_not_created_again_while_being_purged(self):
+        resp = self.app.put_json(self.bucket_url, MINIMALIST_BUCKET,
+                                 headers=self.headers, status=503)
+        self.assertIn('Retry-After', resp.headers)
+        self.assertEqual(self.count_collections(), 1)
+
+    def test_bucket_is_created_again_once_purged(self):
+        self.app.app.registry.reaper.run_pending()
+        self.app.put_json(self.bucket_url, MINIMALIST_BUCKET,
+                          headers=self.headers)
+        self.app.get(self.group_url, headers=self.headers, status=404)
+
+    def test_reaper_is_woken_up_when_bucket_is_created_again(self):
+        reaper = self.app.app.registry.reaper
+        with mock.patch.object(reaper, 'wake') as wake:
+            self.app.put_json(self.bucket_url, MINIMALIST_BUCKET,
+                              headers=self.headers, status=503)
+        self.assertTrue(wake.called)
+
+    def test_collection_is_not_created_again_while_being_purged(self):
+        self.app.app.registry.reaper.run_pending()
+        self.app.put_json(self.bucket_url, MINIMALIST_BUCKET,
+                          headers=self.headers)
+        self.app.put_json(self.collection_url, MINIMALIST_COLLECTION,
+                          headers=self.headers)
+        self.app.post_json(self.collection_url + '/records',
+                           MINIMALIST_RECORD, headers=self.headers)
+        self.app.delete(self.collection_url, headers=self.headers)
+        self.app.get(self.collection_url + '/records', headers=self.headers,
+                     status=404)
+        self.app.put_json(self.collection_url, MINIMALIST_COLLECTION,
+                          headers=self.headers, status=503)
+
+        self.app.app.registry.reaper.run_pending()
+        self.app.put_json(self.collection_url, MINIMALIST_COLLECTION,
+                          headers=self.headers)
+        resp = self.app.get(self.collection_url + '/records',
+                            headers=self.headers)
+        self.assertEqual(resp.json['data'], [])
+
+    def test_children_of_bucket_created_again_are_kept_by_the_reaper(self):
+        reaper = self.app.app.registry.reaper
+        # Another reaper lists the purges, and completes them before the
+        # bucket is created again.
+        snapshot = reaper.pending()
+        reaper.run_pending()
+        self.app.put_json(self.bucket_url, MINIMALIST_BUCKET,
+                          headers=self.headers)
+        self.app.put_json(self.collection_url, MINIMALIST_COLLECTION,
+                          headers=self.headers)
+        with mock.patch.object(reaper, 'pending', return_value=snapshot):
+            reaper.run_pending()
+        self.assertEqual(self.count_collections(), 1)
+        self.app.get(self.collection_url, headers=self.headers)
+
+    def test_scheduled_purges_are_read_from_cache(self):
+        self.app.get(self.collection_url, headers=self.headers, status=404)
+        storage = self.app.app.registry.storage
+        with mock.patch.object(storage, 'get_all',
+                               wraps=storage.get_all) as get_all:
+            self.app.get(self.group_url, headers=self.headers, status=404)
+        purges_reads = [c for c in get_all.call_args_list
+                        if c[1].get('collection_id') == 'purge']
+        self.assertEqual(purges_reads, [])
+
+    def test_cached_purges_are_invalidated_once_complete(self):
+        self.app.get(self.group_url, headers=self.headers, status=404)
+        self.app.app.registry.reaper.run_pending()
+        self.app.put_json(self.bucket_url, MINIMALIST_BUCKET,
+                          headers=self.headers)
+        self.app.put_json(self.group_url, MINIMALIST_GROUP,
+                          headers=self.headers)
+        self.app.get(self.group_url, headers=self.headers)
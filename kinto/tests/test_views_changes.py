@@ -0,0 +1,214 @@
+import threading
+import time
+
+import mock
+
+from .support import (BaseWebTest, unittest, get_user_headers,
+                      MINIMALIST_BUCKET, MINIMALIST_COLLECTION,
+                      MINIMALIST_GROUP, MINIMALIST_RECORD)
+
+
+class ChangesViewTest(BaseWebTest, unittest.TestCase):
+
+    bucket_url = '/buckets/beers'
+    collection_url = '/buckets/beers/collections/barley'
+
+    def get_app_settings(self, extra=None):
+        if extra is None:
+            extra = {}
+        extra.setdefault('notifications_enabled', 'true')
+        return super(ChangesViewTest, self).get_app_settings(extra)
+
+    def setUp(self):
+        super(ChangesViewTest, self).setUp()
+        self.timestamp = self.create_collection(self.app)
+
+    def create_collection(self, app):
+        app.put_json(self.bucket_url, MINIMALIST_BUCKET, headers=self.headers)
+        resp = app.put_json(self.collection_url, MINIMALIST_COLLECTION,
+                            headers=self.headers)
+        return resp.json['data']['last_modified']
+
+    def tearDown(self):
+        super(ChangesViewTest, self).tearDown()
+        self.app.app.registry.notifier.flush()
+
+    def get_changes(self, url, since, timeout=0, **kwargs):
+        url = '%s/changes?_since=%s&_timeout=%s' % (url, since, timeout)
+        return self.app.get(url, headers=self.headers, **kwargs)
+
+    def test_returns_404_if_not_enabled_in_configuration(self):
+        app = self._get_test_app({'notifications_enabled': 'false'})
+        app.get(self.collection_url + '/changes', headers=self.headers,
+                status=404)
+
+    def test_returns_304_if_no_change_before_timeout(self):
+        self.get_changes(self.collection_url, self.timestamp, status=304)
+
+    def test_returns_timestamp_of_latest_change(self):
+        resp = self.app.post_json(self.collection_url + '/records',
+                                  MINIMALIST_RECORD,
+                                  headers=self.headers)
+        timestamp = resp.json['data']['last_modified']
+        resp = self.get_changes(self.collection_url, self.timestamp)
+        self.assertEqual(resp.json['data'], {'last_modified': timestamp})
+        self.assertEqual(resp.headers['ETag'], '"%s"' % timestamp)
+
+    def test_collections_are_notified_of_their_changes(self):
+        self.app.patch_json(self.collection_url, {'data': {'a': 1}},
+                            headers=self.headers)
+        self.get_changes(self.collection_url, self.timestamp)
+
+    def test_buckets_are_notified_of_their_children_changes(self):
+        self.get_changes(self.bucket_url, self.timestamp - 1)
+        resp = self.app.put_json(self.bucket_url + '/groups/admins',
+                                 MINIMALIST_GROUP,
+                                 headers=self.headers)
+        timestamp = resp.json['data']['last_modified']
+        resp = self.get_changes(self.bucket_url, self.timestamp)
+        self.assertEqual(resp.json['data'], {'last_modified': timestamp})
+        resp = self.app.post_json(self.collection_url + '/records',
+                                  MINIMALIST_RECORD,
+                                  headers=self.headers)
+        self.get_changes(self.bucket_url, timestamp)
+
+    def test_deletions_are_notified(self):
+        resp = self.app.post_json(self.collection_url + '/records',
+                                  MINIMALIST_RECORD,
+                                  headers=self.headers)
+        timestamp = resp.json['data']['last_modified']
+        self.app.delete(self.collection_url + '/records',
+                        headers=self.headers)
+        self.get_changes(self.collection_url, timestamp)
+        resp = self.app.delete(self.bucket_url, headers=self.headers)
+        timestamp = resp.json['data']['last_modified']
+        notifier = self.app.app.registry.notifier
+        self.assertEqual(notifier.wait(self.bucket_url, since=0), timestamp)
+
+    def test_empty_deletions_are_not_notified(self):
+        self.app.delete(self.collection_url + '/records',
+                        headers=self.headers)
+        self.get_changes(self.collection_url, self.timestamp, status=304)
+
+    def test_reads_are_not_notified(self):
+        self.app.get(self.collection_url + '/records', headers=self.headers)
+        self.get_changes(self.collection_url, self.timestamp, status=304)
+
+    def test_stored_changes_are_returned_without_notification(self):
+        # e.g. written by another process, or before a restart.
+        self.app.app.registry.notifier.flush()
+        record = self.storage.create(collection_id='record',
+                                     parent_id=self.collection_url,
+                                     record={})
+        timestamp = record['last_modified']
+        since = self.timestamp - 1
+        resp = self.get_changes(self.collection_url, since)
+        self.assertEqual(resp.json['data'], {'last_modified': timestamp})
+        self.assertEqual(resp.headers['ETag'], '"%s"' % timestamp)
+        resp = self.get_changes(self.bucket_url, since)
+        self.assertEqual(resp.json['data'], {'last_modified': timestamp})
+
+    def test_stored_changes_are_read_from_cache(self):
+        self.get_changes(self.bucket_url, self.timestamp - 1)
+        with mock.patch.object(self.storage, 'get_all',
+                               wraps=self.storage.get_all) as get_all:
+            self.get_changes(self.bucket_url, self.timestamp - 1)
+        self.assertFalse(get_all.called)
+
+    def test_cached_stored_changes_are_invalidated_by_notifications(self):
+        self.get_changes(self.bucket_url, self.timestamp - 1)
+        resp = self.app.post_json(self.collection_url + '/records',
+                                  MINIMALIST_RECORD,
+                                  headers=self.headers)
+        timestamp = resp.json['data']['last_modified']
+        # e.g. published in another process.
+        self.app.app.registry.notifier.flush()
+        resp = self.get_changes(self.bucket_url, self.timestamp)
+        self.assertEqual(resp.json['data'], {'last_modified': timestamp})
+
+    def test_stored_changes_are_not_cached_if_ttl_is_zero(self):
+        app = self._get_test_app({'notifications_cache_ttl_seconds': '0'})
+        self.create_collection(app)
+        url = '%s/changes?_since=0&_timeout=0' % self.bucket_url
+        app.get(url, headers=self.headers)
+        cache = app.app.registry.cache
+        self.assertIsNone(cache.get('changes:version:/buckets/beers'))
+        self.assertIsNone(cache.get('changes:/buckets/beers:None'))
+
+    def test_empty_buckets_have_no_stored_changes(self):
+        resp = self.app.put_json('/buckets/sodas', MINIMALIST_BUCKET,
+                                 headers=self.headers)
+        timestamp = resp.json['data']['last_modified']
+        self.get_changes('/buckets/sodas', timestamp, status=304)
+
+    def test_waiting_clients_are_woken_up_by_changes(self):
+        responses = []
+
+        def wait():
+            responses.append(self.get_changes(self.collection_url,
+                                              self.timestamp, timeout=5))
+
+        thread = threading.Thread(target=wait)
+        thread.start()
+        notifier = self.app.app.registry.notifier
+        while not notifier._waiting:
+            time.sleep(0.001)
+        self.app.post_json(self.collection_url + '/records',
+                           MINIMALIST_RECORD,
+                           headers=self.headers)
+        thread.join()
+        self.assertEqual(responses[0].status_code, 200)
+
+    def test_clients_do_not_wait_once_every_slot_is_taken(self):
+        app = self._get_test_app({'notifications_max_waiting': 0})
+        url = self.collection_url + '/changes?_since=%s&_timeout=5' % (
+            self.create_collection(app))
+        before = time.time()
+        app.get(url, headers=self.headers, status=304)
+        self.assertLess(time.time() - before, 5)
+
+    def test_timeout_is_capped_by_settings(self):
+        app = self._get_test_app({'notifications_timeout_seconds': 0})
+        url = self.collection_url + '/changes?_since=%s&_timeout=5' % (
+            self.create_collection(app))
+        before = time.time()
+        app.get(url, headers=self.headers, status=304)
+        self.assertLess(time.time() - before, 5)
+
+    def test_invalid_parameters_raise_400(self):
+        url = self.collection_url + '/changes'
+        for querystring in ('_since=abc', '_since=-1', '_timeout=1.5'):
+            self.app.get(url + '?' + querystring, headers=self.headers,
+                         status=400)
+
+    def test_read_permission_is_required(self):
+        url = self.collection_url + '/changes?_timeout=0'
+        self.app.get(url, headers=get_user_headers('alice'), status=403)
+        self.app.get(self.bucket_url + '/changes?_timeout=0',
+                     headers=get_user_headers('alice'), status=403)
+
+    def test_unknown_collection_raises_404(self):
+        url = self.bucket_url + '/collections/pills/changes?_timeout=0'
+        self.app.get(url, headers=self.headers, status=404)
+
+    def test_personal_bucket_changes_can_be_awaited(self):
+        url = '/buckets/default/collections/tasks'
+        resp = self.app.post_json(url + '/records', MINIMALIST_RECORD,
+                                  headers=self.headers)
+        timestamp = resp.json['data']['last_modified']
+        resp = self.get_changes(url, timestamp - 1)
+        self.assertEqual(resp.json['data'], {'last_modified': timestamp})
+
+    def test_flush_forgets_changes(self):
+        app = self._get_test_app({'flush_endpoint_enabled': 'true'})
+        timestamp = self.create_collection(app)
+        app.post('/__flush__', status=202)
+        self.create_collection(app)
+        url = self.collection_url + '/changes?_since=%s&_timeout=0' % (
+            timestamp)
+        resp = app.get(url, headers=self.headers)
+        # Only the collection created after the flush is known.
+        self.assertGreater(resp.json['data']['last_modified'], timestamp)
+        notifier = app.app.registry.notifier
+        self.assertEqual(sorted(notifier._timestamps.keys()),
+                         [self.bucket_url, self.collection_url])
@@ -107,3 +107,7 @@ class CollectionDeletionTest(BaseWebTest, unittest.TestCase):
         resp = self.app.get('%s/records?_since=0' % self.collection_url,
                             headers=self.headers)
         self.assertEqual(len(resp.json['data']), 0)
+
+    def test_permissions_of_records_are_deleted_too(self):
+        self.assertEqual(self.permission.object_permission_principals(
+            self.record_url, 'write'), set())
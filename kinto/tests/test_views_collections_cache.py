@@ -1,7 +1,54 @@
+import mock
+
+from kinto.views.records import build_cache_expires_table, get_cache_expires
+
 from .support import (BaseWebTest, unittest, MINIMALIST_BUCKET,
                       MINIMALIST_COLLECTION, MINIMALIST_RECORD)
 
 
+class CacheExpiresTableTest(unittest.TestCase):
+    def build(self, **settings):
+        return build_cache_expires_table(dict(
+            ('%s_record_cache_expires_seconds' % name, value)
+            for name, value in settings.items()))
+
+    def test_unknown_bucket_has_no_value(self):
+        table = self.build(blog=30)
+        self.assertIsNone(get_cache_expires(table, 'app', 'articles'))
+
+    def test_bucket_value_applies_to_every_collection(self):
+        table = self.build(blog=30)
+        self.assertEqual(get_cache_expires(table, 'blog', 'articles'), 30)
+        self.assertEqual(get_cache_expires(table, 'blog', 'comments'), 30)
+
+    def test_collection_value_has_precedence_over_bucket_value(self):
+        table = self.build(blog=30, blog_articles=60)
+        self.assertEqual(get_cache_expires(table, 'blog', 'articles'), 60)
+        self.assertEqual(get_cache_expires(table, 'blog', 'comments'), 30)
+
+    def test_identifiers_can_contain_underscores(self):
+        table = self.build(my_blog_articles=60, my_blog=30)
+        self.assertEqual(get_cache_expires(table, 'my', 'blog_articles'), 60)
+        self.assertEqual(get_cache_expires(table, 'my_blog', 'articles'), 60)
+        self.assertEqual(get_cache_expires(table, 'my_blog', 'comments'), 30)
+        self.assertEqual(get_cache_expires(table, 'my_blog_articles', 'c'),
+                         60)
+        self.assertIsNone(get_cache_expires(table, 'my', 'comments'))
+
+    def test_values_are_parsed_as_integers(self):
+        table = self.build(blog='30')
+        self.assertEqual(get_cache_expires(table, 'blog', 'articles'), 30)
+
+    def test_prefixed_and_unrelated_settings_are_ignored(self):
+        table = build_cache_expires_table({
+            'kinto.blog_record_cache_expires_seconds': 30,
+            'record_cache_expires_seconds': 10,
+            '_record_cache_expires_seconds': 10,
+            'blog_collection_cache_expires_seconds': 10,
+        })
+        self.assertEqual(table, {})
+
+
 class GlobalSettingsTest(BaseWebTest, unittest.TestCase):
     def get_app_settings(self, extra=None):
         settings = super(GlobalSettingsTest, self).get_app_settings(extra)
@@ -27,6 +74,13 @@ class GlobalSettingsTest(BaseWebTest, unittest.TestCase):
         self.assertIn('Expires', r.headers)
         self.assertEqual(r.headers['Cache-Control'], 'max-age=3600')
 
+    def test_expires_and_cache_control_headers_are_set_without_changes(self):
+        url = '/buckets/default/collections/cached/records?_since=%s' % (
+            self.record['last_modified'])
+        r = self.app.get(url, headers=self.headers)
+        self.assertIn('Expires', r.headers)
+        self.assertEqual(r.headers['Cache-Control'], 'max-age=3600')
+
 
 class SpecificSettingsTest(BaseWebTest, unittest.TestCase):
     def get_app_settings(self, extra=None):
@@ -72,6 +126,44 @@ class SpecificSettingsTest(BaseWebTest, unittest.TestCase):
         record_url = collection_url + '/%s' % self.app_record['id']
         self.assertHasCache(record_url, 60)
 
+    def test_settings_are_not_read_on_requests(self):
+        settings = self.app.app.registry.settings
+        with mock.patch.object(settings, 'get',
+                               wraps=settings.get) as mocked:
+            self.assertHasCache('/buckets/blog/collections/cached/records',
+                                30)
+        read = [args[0] for args, _ in mocked.call_args_list]
+        self.assertFalse([key for key in read
+                          if key.endswith('_record_cache_expires_seconds')])
+
+
+class PrefixedSpecificSettingsTest(BaseWebTest, unittest.TestCase):
+    def get_app_settings(self, extra=None):
+        settings = super(PrefixedSpecificSettingsTest,
+                         self).get_app_settings(extra)
+        settings['cliquet.blog_record_cache_expires_seconds'] = 30
+        settings['blog_articles_record_cache_expires_seconds'] = 60
+        return settings
+
+    def setUp(self):
+        super(PrefixedSpecificSettingsTest, self).setUp()
+        self.app.put_json('/buckets/blog', MINIMALIST_BUCKET,
+                          headers=self.headers)
+        for collection_id in ('articles', 'comments'):
+            self.app.put_json('/buckets/blog/collections/%s' % collection_id,
+                              MINIMALIST_COLLECTION,
+                              headers=self.headers)
+
+    def test_bucket_settings_can_have_any_prefix(self):
+        r = self.app.get('/buckets/blog/collections/comments/records',
+                         headers=self.headers)
+        self.assertEqual(r.headers['Cache-Control'], 'max-age=30')
+
+    def test_collection_settings_have_precedence_over_bucket_settings(self):
+        r = self.app.get('/buckets/blog/collections/articles/records',
+                         headers=self.headers)
+        self.assertEqual(r.headers['Cache-Control'], 'max-age=60')
+
 
 class CollectionExpiresTest(BaseWebTest, unittest.TestCase):
     def setUp(self):
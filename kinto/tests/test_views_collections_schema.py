@@ -1,3 +1,6 @@
+import mock
+from jsonschema.validators import validator_for as validator_for_impl
+
 from .support import BaseWebTest, unittest
 
 
@@ -130,6 +133,88 @@ class RecordsValidationTest(BaseWebTestWithSchema, unittest.TestCase):
         self.assertIn("'title' is a required property", resp.json['message'])
         self.assertEqual(resp.json['details'][0]['name'], 'title')
 
+    def test_schema_is_compiled_once_per_collection_version(self):
+        validator_for = 'kinto.views.records.validators.validator_for'
+        with mock.patch(validator_for, wraps=validator_for_impl) as patched:
+            for i in range(3):
+                self.app.post_json(RECORDS_URL,
+                                   {'data': VALID_RECORD},
+                                   headers=self.headers)
+            self.assertEqual(patched.call_count, 1)
+
+    def test_new_schema_is_used_once_collection_is_updated(self):
+        newschema = SCHEMA.copy()
+        newschema['required'] = ['body']
+        self.app.put_json(COLLECTION_URL,
+                          {'data': {'schema': newschema}},
+                          headers=self.headers)
+        self.app.post_json(RECORDS_URL,
+                           {'data': {'title': 'Without body'}},
+                           headers=self.headers,
+                           status=400)
+
+    def test_every_invalid_field_is_reported(self):
+        resp = self.app.post_json(RECORDS_URL,
+                                  {'data': {'body': 42}},
+                                  headers=self.headers,
+                                  status=400)
+        fields = sorted(e['name'] for e in resp.json['details'])
+        self.assertEqual(fields, ['body', 'title'])
+
+    def test_invalid_fields_without_name_are_reported(self):
+        newschema = SCHEMA.copy()
+        newschema['maxProperties'] = 1
+        self.app.put_json(COLLECTION_URL,
+                          {'data': {'schema': newschema}},
+                          headers=self.headers)
+        resp = self.app.post_json(RECORDS_URL,
+                                  {'data': VALID_RECORD},
+                                  headers=self.headers,
+                                  status=400)
+        self.assertIsNone(resp.json['details'][0]['name'])
+
+    def test_fields_required_several_times_are_reported(self):
+        newschema = {'type': 'object',
+                     'allOf': [{'required': ['title']},
+                               {'required': ['title']}]}
+        self.app.put_json(COLLECTION_URL,
+                          {'data': {'schema': newschema}},
+                          headers=self.headers)
+        resp = self.app.post_json(RECORDS_URL,
+                                  {'data': {}},
+                                  headers=self.headers,
+                                  status=400)
+        fields = [e['name'] for e in resp.json['details']]
+        self.assertEqual(fields, ['title', 'title'])
+
+    def test_schema_is_not_altered_by_validation_errors(self):
+        for i in range(2):
+            self.app.post_json(RECORDS_URL,
+                               {'data': {'body': '<h1>Without title</h1>'}},
+                               headers=self.headers,
+                               status=400)
+
+    def test_records_of_a_batch_are_validated_with_a_single_lookup(self):
+        self.app.put_json('/buckets/blog', headers=self.headers)
+        self.app.put_json('/buckets/blog/collections/articles',
+                          {'data': {'schema': SCHEMA}},
+                          headers=self.headers)
+        records_url = '/buckets/blog/collections/articles/records'
+        records = [VALID_RECORD, {'body': 'Without title'}, VALID_RECORD,
+                   {'title': 42}]
+        batch = {'defaults': {'method': 'POST', 'path': records_url},
+                 'requests': [{'body': {'data': r}} for r in records]}
+        validator_for = 'kinto.views.records.validators.validator_for'
+        with mock.patch(validator_for, wraps=validator_for_impl) as patched:
+            with mock.patch.object(self.storage, 'get',
+                                   wraps=self.storage.get) as get:
+                resp = self.app.post_json('/batch', batch,
+                                          headers=self.headers)
+                self.assertEqual(get.call_count, 1)
+            self.assertEqual(patched.call_count, 1)
+        statuses = [r['status'] for r in resp.json['responses']]
+        self.assertEqual(statuses, [201, 400, 201, 400])
+
     def test_records_of_other_bucket_are_not_impacted(self):
         self.app.put_json('/buckets/blog', headers=self.headers)
         self.app.put_json('/buckets/blog/collections/articles',
@@ -0,0 +1,71 @@
+import json
+
+from pyramid.security import Authenticated
+
+from .support import (BaseWebTest, unittest, get_user_headers,
+                      MINIMALIST_BUCKET, MINIMALIST_COLLECTION,
+                      MINIMALIST_RECORD)
+
+
+class ExportViewTest(BaseWebTest, unittest.TestCase):
+
+    collection_url = '/buckets/beers/collections/barley'
+    export_url = '/buckets/beers/collections/barley/export'
+
+    def get_app_settings(self, extra=None):
+        settings = super(ExportViewTest, self).get_app_settings(extra)
+        settings['export_batch_size'] = 2
+        return settings
+
+    def setUp(self):
+        super(ExportViewTest, self).setUp()
+        self.app.put_json('/buckets/beers', MINIMALIST_BUCKET,
+                          headers=self.headers)
+        self.app.put_json(self.collection_url, MINIMALIST_COLLECTION,
+                          headers=self.headers)
+        self.records = []
+        for _ in range(5):
+            resp = self.app.post_json(self.collection_url + '/records',
+                                      MINIMALIST_RECORD,
+                                      headers=self.headers)
+            self.records.insert(0, resp.json['data'])
+
+    def test_returns_every_record_as_a_json_list(self):
+        resp = self.app.get(self.export_url, headers=self.headers)
+        self.assertEqual(resp.content_type, 'application/json')
+        self.assertEqual(resp.json['data'], self.records)
+
+    def test_returns_one_record_per_line_if_ndjson_is_accepted(self):
+        headers = self.headers.copy()
+        headers['Accept'] = 'application/x-ndjson'
+        resp = self.app.get(self.export_url, headers=headers)
+        self.assertEqual(resp.content_type, 'application/x-ndjson')
+        lines = resp.body.decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.records)
+
+    def test_returns_an_empty_list_if_collection_has_no_records(self):
+        self.app.delete(self.collection_url + '/records',
+                        headers=self.headers)
+        resp = self.app.get(self.export_url, headers=self.headers)
+        self.assertEqual(resp.json['data'], [])
+
+    def test_etag_is_the_collection_timestamp(self):
+        resp = self.app.get(self.export_url, headers=self.headers)
+        timestamp = self.records[0]['last_modified']
+        self.assertEqual(resp.headers['ETag'], '"%s"' % timestamp)
+
+    def test_returns_404_if_collection_does_not_exist(self):
+        self.app.get('/buckets/beers/collections/unknown/export',
+                     headers=self.headers, status=404)
+
+    def test_read_permission_on_collection_is_required(self):
+        self.app.get(self.export_url, headers=get_user_headers('alice'),
+                     status=403)
+
+    def test_read_permission_can_be_inherited_from_bucket(self):
+        self.app.patch_json('/buckets/beers',
+                            {'permissions': {'read': [Authenticated]}},
+                            headers=self.headers)
+        resp = self.app.get(self.export_url,
+                            headers=get_user_headers('alice'))
+        self.assertEqual(len(resp.json['data']), 5)
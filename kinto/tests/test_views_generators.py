@@ -0,0 +1,60 @@
+import mock
+
+from kinto.views import NameGenerator, TimeOrderedNameGenerator
+
+from .support import unittest
+
+
+class NameGeneratorTest(unittest.TestCase):
+    def setUp(self):
+        self.generator = NameGenerator()
+
+    def test_names_have_eight_characters(self):
+        self.assertEqual(len(self.generator()), 8)
+
+    def test_names_match_the_generator(self):
+        for _ in range(1000):
+            self.assertTrue(self.generator.match(self.generator()))
+
+    def test_names_can_contain_every_character_of_the_alphabet(self):
+        letters = set(''.join(self.generator() for _ in range(1000)))
+        self.assertEqual(letters, set(NameGenerator.alphabet))
+
+    def test_names_start_with_a_letter_or_digit(self):
+        # Bytes 62 and 63 are drawn as ``-`` and ``_``.
+        draws = [b'>' * 8, b'?', b'a']
+        with mock.patch('kinto.views.os.urandom', side_effect=draws):
+            name = self.generator()
+        self.assertEqual(name, 'H-------')
+
+    def test_names_are_unique(self):
+        names = [self.generator() for _ in range(10000)]
+        self.assertEqual(len(set(names)), len(names))
+
+
+class TimeOrderedNameGeneratorTest(unittest.TestCase):
+    def setUp(self):
+        self.generator = TimeOrderedNameGenerator()
+
+    def test_names_match_the_generator(self):
+        name = self.generator()
+        self.assertEqual(len(name), 17)
+        self.assertTrue(self.generator.match(name))
+
+    def test_names_start_with_the_current_time(self):
+        with mock.patch('kinto.views.msec_time', return_value=36 ** 2):
+            name = TimeOrderedNameGenerator()()
+        self.assertEqual(name[:9], '000000100')
+
+    def test_names_are_increasing(self):
+        names = [self.generator() for _ in range(10000)]
+        self.assertEqual(names, sorted(names))
+        self.assertEqual(len(set(names)), len(names))
+
+    def test_names_are_increasing_when_clock_goes_backwards(self):
+        with mock.patch('kinto.views.msec_time', return_value=2000):
+            first = self.generator()
+        with mock.patch('kinto.views.msec_time', return_value=1000):
+            second = self.generator()
+        self.assertGreater(second, first)
+        self.assertEqual(first[:9], second[:9])
@@ -1,5 +1,7 @@
-from .support import (BaseWebTest, unittest, MINIMALIST_BUCKET,
-                      MINIMALIST_GROUP)
+import mock
+
+from .support import (BaseWebTest, unittest, get_user_headers,
+                      MINIMALIST_BUCKET, MINIMALIST_GROUP)
 
 
 class GroupViewTest(BaseWebTest, unittest.TestCase):
@@ -107,6 +109,14 @@ class GroupManagementTest(BaseWebTest, unittest.TestCase):
         self.assertEquals(self.permission.user_principals('natim'), set())
         self.assertEquals(self.permission.user_principals('alexis'), set())
 
+    def test_groups_are_not_fetched_on_groups_deletion(self):
+        self.create_group('beers', 'moderators', ['natim'])
+        with mock.patch.object(self.storage, 'get_all',
+                               wraps=self.storage.get_all) as get_all:
+            self.app.delete('/buckets/beers/groups', headers=self.headers)
+        # Only the remaining groups are read, for their nested members.
+        self.assertEqual(get_all.call_count, 2)
+
     def test_group_is_added_to_user_principals_when_added_to_members(self):
         self.create_group('beers', 'moderators', ['natim', 'mat'])
 
@@ -150,6 +160,187 @@ class GroupManagementTest(BaseWebTest, unittest.TestCase):
         self.assertEquals(self.permission.user_principals('mat'),
                           {group_url})
 
+    def test_members_principals_are_invalidated_on_membership_change(self):
+        self.app.get('/buckets/beers', headers=self.headers)
+        cache_key = 'principals:%s:None' % self.principal
+        self.assertEqual(self.cache.get(cache_key), [])
+        self.create_group('beers', 'moderators', [self.principal])
+        self.app.get('/buckets/beers', headers=self.headers)
+        version = self.cache.get('principals:version:%s' % self.principal)
+        cache_key = 'principals:%s:%s' % (self.principal, version)
+        self.assertEqual(self.cache.get(cache_key), [self.group_url])
+
+    def test_members_principals_are_invalidated_on_group_deletion(self):
+        version_key = 'principals:version:natim'
+        self.create_group('beers', 'moderators', ['natim'])
+        self.cache.set(version_key, 'former')
+        self.app.delete(self.group_url, headers=self.headers)
+        self.assertNotEqual(self.cache.get(version_key), 'former')
+
+    def test_members_principals_are_invalidated_on_groups_deletion(self):
+        version_key = 'principals:version:natim'
+        self.create_group('beers', 'moderators', ['natim'])
+        self.cache.set(version_key, 'former')
+        self.app.delete('/buckets/beers/groups', headers=self.headers)
+        self.assertNotEqual(self.cache.get(version_key), 'former')
+
+
+class NestedGroupsTest(BaseWebTest, unittest.TestCase):
+
+    def setUp(self):
+        super(NestedGroupsTest, self).setUp()
+        self.create_bucket('beers')
+
+    def group_url(self, group_id, bucket_id='beers'):
+        return '/buckets/%s/groups/%s' % (bucket_id, group_id)
+
+    def test_members_of_nested_groups_have_parent_principals(self):
+        self.create_group('beers', 'brewers', ['natim'])
+        self.create_group('beers', 'staff', [self.group_url('brewers')])
+        self.assertEqual(self.permission.user_principals('natim'),
+                         {self.group_url('brewers'), self.group_url('staff')})
+
+    def test_members_of_deeply_nested_groups_have_every_principal(self):
+        self.create_group('beers', 'g0', ['natim'])
+        for i in range(1, 5):
+            self.create_group('beers', 'g%s' % i,
+                              [self.group_url('g%s' % (i - 1))])
+        expected = set(self.group_url('g%s' % i) for i in range(5))
+        self.assertEqual(self.permission.user_principals('natim'), expected)
+
+    def test_members_added_to_nested_groups_have_parent_principals(self):
+        self.create_group('beers', 'brewers', ['natim'])
+        self.create_group('beers', 'staff', [self.group_url('brewers')])
+        self.app.put_json(self.group_url('brewers'),
+                          {'data': {'members': ['natim', 'alexis']}},
+                          headers=self.headers)
+        self.assertEqual(self.permission.user_principals('alexis'),
+                         {self.group_url('brewers'), self.group_url('staff')})
+
+    def test_members_removed_from_nested_groups_lose_parent_principals(self):
+        self.create_group('beers', 'brewers', ['natim', 'alexis'])
+        self.create_group('beers', 'staff', [self.group_url('brewers')])
+        self.app.put_json(self.group_url('brewers'),
+                          {'data': {'members': ['alexis']}},
+                          headers=self.headers)
+        self.assertEqual(self.permission.user_principals('natim'), set())
+
+    def test_groups_can_be_nested_before_being_created(self):
+        self.create_group('beers', 'staff', [self.group_url('brewers')])
+        self.create_group('beers', 'brewers', ['natim'])
+        self.assertEqual(self.permission.user_principals('natim'),
+                         {self.group_url('brewers'), self.group_url('staff')})
+
+    def test_removed_nested_groups_members_lose_parent_principals(self):
+        self.create_group('beers', 'brewers', ['natim'])
+        self.create_group('beers', 'staff',
+                          [self.group_url('brewers'), 'alexis'])
+        self.app.put_json(self.group_url('staff'),
+                          {'data': {'members': ['alexis']}},
+                          headers=self.headers)
+        self.assertEqual(self.permission.user_principals('natim'),
+                         {self.group_url('brewers')})
+        self.assertEqual(self.permission.user_principals('alexis'),
+                         {self.group_url('staff')})
+
+    def test_principals_are_kept_if_still_inherited_from_other_groups(self):
+        self.create_group('beers', 'brewers', ['natim'])
+        self.create_group('beers', 'tasters', ['natim'])
+        self.create_group('beers', 'staff', [self.group_url('brewers'),
+                                             self.group_url('tasters')])
+        self.app.put_json(self.group_url('staff'),
+                          {'data': {'members': [self.group_url('tasters')]}},
+                          headers=self.headers)
+        self.assertIn(self.group_url('staff'),
+                      self.permission.user_principals('natim'))
+
+    def test_members_of_deleted_nested_groups_lose_parent_principals(self):
+        self.create_group('beers', 'brewers', ['natim'])
+        self.create_group('beers', 'staff', [self.group_url('brewers')])
+        self.app.delete(self.group_url('brewers'), headers=self.headers)
+        self.assertEqual(self.permission.user_principals('natim'), set())
+
+    def test_recreated_nested_groups_members_get_parent_principals(self):
+        self.create_group('beers', 'brewers', ['natim'])
+        self.create_group('beers', 'staff', [self.group_url('brewers')])
+        self.app.delete(self.group_url('brewers'), headers=self.headers)
+        self.app.put_json(self.group_url('brewers'),
+                          {'data': {'members': ['natim']}},
+                          headers=self.headers)
+        self.assertEqual(self.permission.user_principals('natim'),
+                         {self.group_url('brewers'), self.group_url('staff')})
+
+    def test_members_of_deleted_groups_lose_remaining_parents_principals(self):
+        self.create_group('beers', 'brewers', ['natim'])
+        self.create_group('beers', 'staff', [self.group_url('brewers'),
+                                             'alexis'])
+        self.app.delete('/buckets/beers/groups?id=brewers',
+                        headers=self.headers)
+        self.assertEqual(self.permission.user_principals('natim'), set())
+        self.assertEqual(self.permission.user_principals('alexis'),
+                         {self.group_url('staff')})
+
+    def test_recreated_deleted_groups_members_get_parent_principals(self):
+        self.create_group('beers', 'brewers', ['natim'])
+        self.create_group('beers', 'staff', [self.group_url('brewers')])
+        self.app.delete('/buckets/beers/groups?id=brewers',
+                        headers=self.headers)
+        self.app.put_json(self.group_url('brewers'),
+                          {'data': {'members': ['natim']}},
+                          headers=self.headers)
+        self.assertEqual(self.permission.user_principals('natim'),
+                         {self.group_url('brewers'), self.group_url('staff')})
+
+    def test_deleted_parent_groups_are_removed_from_nested_members(self):
+        self.create_group('beers', 'brewers', ['natim'])
+        self.create_group('beers', 'staff', [self.group_url('brewers')])
+        self.app.delete(self.group_url('staff'), headers=self.headers)
+        self.assertEqual(self.permission.user_principals('natim'),
+                         {self.group_url('brewers')})
+
+    def test_groups_cannot_contain_themselves(self):
+        resp = self.app.put_json(
+            self.group_url('staff'),
+            {'data': {'members': [self.group_url('staff')]}},
+            headers=self.headers, status=400)
+        self.assertEqual(resp.json['details'][0]['name'], 'members')
+
+    def test_groups_cannot_contain_their_parents(self):
+        self.create_group('beers', 'brewers', ['natim'])
+        self.create_group('beers', 'staff', [self.group_url('brewers')])
+        self.app.put_json(
+            self.group_url('brewers'),
+            {'data': {'members': ['natim', self.group_url('staff')]}},
+            headers=self.headers, status=400)
+
+    def test_groups_of_other_buckets_are_not_nested(self):
+        self.create_bucket('sodas')
+        self.create_group('sodas', 'brewers', ['natim'])
+        self.create_group('beers', 'staff',
+                          [self.group_url('brewers', 'sodas')])
+        self.assertEqual(self.permission.user_principals('natim'),
+                         {self.group_url('brewers', 'sodas')})
+
+    def test_members_of_nested_groups_get_parent_permissions(self):
+        natim = get_user_headers('natim')
+        resp = self.app.get('/', headers=natim)
+        userid = resp.json['userid']
+        self.create_group('beers', 'brewers', [userid])
+        self.create_group('beers', 'staff', [self.group_url('brewers')])
+        self.app.get('/buckets/beers', headers=natim, status=403)
+        self.app.patch_json('/buckets/beers',
+                            {'permissions': {
+                                'read': [self.group_url('staff')]}},
+                            headers=self.headers)
+        self.app.get('/buckets/beers', headers=natim, status=200)
+
+    def test_members_principals_are_invalidated_on_nested_change(self):
+        version_key = 'principals:version:natim'
+        self.create_group('beers', 'brewers', ['natim'])
+        self.cache.set(version_key, 'former')
+        self.create_group('beers', 'staff', [self.group_url('brewers')])
+        self.assertNotEqual(self.cache.get(version_key), 'former')
+
 
 class InvalidGroupTest(BaseWebTest, unittest.TestCase):
 
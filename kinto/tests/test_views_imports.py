@@ -0,0 +1,147 @@
+import json
+
+import mock
+
+from .support import (BaseWebTest, unittest, get_user_headers,
+                      MINIMALIST_BUCKET, MINIMALIST_COLLECTION)
+from .test_views_collections_schema import SCHEMA, VALID_RECORD
+
+
+RECORD_ID = '7f7a4a6e-7bd5-4f2d-8a63-6cf5d2e1b1a7'
+
+
+class ImportViewTest(BaseWebTest, unittest.TestCase):
+
+    collection_url = '/buckets/beers/collections/barley'
+    import_url = '/buckets/beers/collections/barley/import'
+
+    def get_app_settings(self, extra=None):
+        settings = super(ImportViewTest, self).get_app_settings(extra)
+        settings['import_batch_size'] = 2
+        return settings
+
+    def setUp(self):
+        super(ImportViewTest, self).setUp()
+        self.app.put_json('/buckets/beers', MINIMALIST_BUCKET,
+                          headers=self.headers)
+        resp = self.app.put_json(self.collection_url, MINIMALIST_COLLECTION,
+                                 headers=self.headers)
+        self.collection = resp.json['data']
+
+    def post_records(self, *lines, **kwargs):
+        body = '\n'.join(line if isinstance(line, str) else json.dumps(line)
+                         for line in lines)
+        headers = kwargs.pop('headers', self.headers).copy()
+        headers['Content-Type'] = 'application/x-ndjson'
+        return self.app.post(self.import_url, body.encode('utf-8'),
+                             headers=headers, **kwargs)
+
+    def get_records(self):
+        resp = self.app.get(self.collection_url + '/records',
+                            headers=self.headers)
+        return resp.json['data']
+
+    def test_records_are_created(self):
+        self.post_records({'a': 1}, {'a': 2}, {'a': 3})
+        records = self.get_records()
+        self.assertEqual(sorted(r['a'] for r in records), [1, 2, 3])
+
+    def test_records_are_replaced_if_they_exist(self):
+        self.post_records({'id': RECORD_ID, 'a': 1})
+        self.post_records({'id': RECORD_ID, 'b': 2})
+        records = self.get_records()
+        self.assertEqual(len(records), 1)
+        self.assertNotIn('a', records[0])
+
+    def test_timestamps_are_assigned_by_the_server(self):
+        self.post_records({'id': RECORD_ID, 'last_modified': 42})
+        records = self.get_records()
+        self.assertNotEqual(records[0]['last_modified'], 42)
+
+    def test_exported_records_can_be_imported(self):
+        self.post_records({'a': 1}, {'a': 2})
+        export = self.app.get(self.collection_url + '/export',
+                              headers=self.headers).json['data']
+        self.app.delete(self.collection_url + '/records',
+                        headers=self.headers)
+        self.post_records(*export)
+        records = self.get_records()
+        self.assertEqual(sorted(r['id'] for r in records),
+                         sorted(r['id'] for r in export))
+
+    def test_results_are_reported_by_chunk(self):
+        resp = self.post_records({'a': 1}, '', {'a': 2}, {'a': 3})
+        self.assertEqual(resp.json['data'], [
+            {'lines': [1, 3], 'imported': 2, 'errors': []},
+            {'lines': [4, 4], 'imported': 1, 'errors': []},
+        ])
+
+    def test_invalid_lines_are_reported_and_skipped(self):
+        resp = self.post_records('{"a":', '[1]', {'id': 'a b'}, {'a': 1})
+        self.assertEqual(resp.json['data'], [
+            {'lines': [1, 2], 'imported': 0, 'errors': [
+                {'line': 1, 'name': None, 'description': 'Invalid JSON'},
+                {'line': 2, 'name': None,
+                 'description': 'Records must be JSON objects'},
+            ]},
+            {'lines': [3, 4], 'imported': 1, 'errors': [
+                {'line': 3, 'name': 'id', 'description': 'Invalid record id'},
+            ]},
+        ])
+        self.assertEqual(len(self.get_records()), 1)
+
+    def test_returns_an_empty_list_if_body_is_empty(self):
+        resp = self.post_records()
+        self.assertEqual(resp.json['data'], [])
+
+    def test_returns_404_if_collection_does_not_exist(self):
+        self.app.post('/buckets/beers/collections/unknown/import', b'',
+                      headers=self.headers, status=404)
+
+    def test_write_permission_on_collection_is_required(self):
+        self.post_records({'a': 1}, headers=get_user_headers('alice'),
+                          status=403)
+
+    def test_changes_are_notified_once(self):
+        with mock.patch('kinto.views.imports.notify_changes') as notify:
+            self.post_records({'a': 1}, {'a': 2}, {'a': 3})
+        self.assertEqual(notify.call_count, 1)
+        (_, result, channels), _ = notify.call_args
+        latest = max(r['last_modified'] for r in self.get_records())
+        self.assertEqual(result, {'last_modified': latest})
+        self.assertEqual(channels, ['/buckets/beers', self.collection_url])
+
+
+class SchemaImportViewTest(ImportViewTest):
+
+    def get_app_settings(self, extra=None):
+        settings = super(SchemaImportViewTest, self).get_app_settings(extra)
+        settings['experimental_collection_schema_validation'] = 'True'
+        return settings
+
+    def setUp(self):
+        super(SchemaImportViewTest, self).setUp()
+        resp = self.app.put_json(self.collection_url,
+                                 {'data': {'schema': SCHEMA}},
+                                 headers=self.headers)
+        self.collection = resp.json['data']
+
+    def post_records(self, *lines, **kwargs):
+        # Make the records of the base tests valid.
+        lines = [dict(VALID_RECORD, **r) if isinstance(r, dict) else r
+                 for r in lines]
+        return super(SchemaImportViewTest, self).post_records(*lines,
+                                                              **kwargs)
+
+    def test_records_invalid_against_schema_are_reported(self):
+        resp = self.post_records('{"title": 42}')
+        self.assertEqual(resp.json['data'][0]['errors'], [
+            {'line': 1, 'name': 'title',
+             'description': "42 is not of type 'string'"},
+        ])
+
+    def test_records_receive_the_schema_as_attribute(self):
+        self.post_records({'a': 1})
+        records = self.get_records()
+        self.assertEqual(records[0]['schema'],
+                         self.collection['last_modified'])
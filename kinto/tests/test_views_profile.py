@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import Counter
+
+import mock
+
+from kinto.views import profile
+
+from .support import (BaseWebTest, unittest, get_user_headers,
+                      MINIMALIST_BUCKET, MINIMALIST_COLLECTION,
+                      MINIMALIST_RECORD, USER_PRINCIPAL)
+
+
+class ProfileViewTest(BaseWebTest, unittest.TestCase):
+
+    records_url = '/buckets/beers/collections/barley/records'
+
+    def get_app_settings(self, extra=None):
+        if extra is None:
+            extra = {}
+        extra.setdefault('profile_endpoint_enabled', True)
+        extra.setdefault('profile_max_duration_seconds', 2)
+        extra.setdefault('profile_endpoint_principals', USER_PRINCIPAL)
+        settings = super(ProfileViewTest, self).get_app_settings(extra)
+        return settings
+
+    def setUp(self):
+        super(ProfileViewTest, self).setUp()
+        self.app.put_json('/buckets/beers', MINIMALIST_BUCKET,
+                          headers=self.headers)
+        self.app.put_json('/buckets/beers/collections/barley',
+                          MINIMALIST_COLLECTION,
+                          headers=self.headers)
+        resp = self.app.post_json(self.records_url, MINIMALIST_RECORD,
+                                  headers=self.headers)
+        self.record_url = '%s/%s' % (self.records_url, resp.json['data']['id'])
+
+    def profile(self, **kwargs):
+        """Profile the app while another thread reads a record, whose
+        collection lookup is slowed down.
+        """
+        done = threading.Event()
+
+        def slow_lookup(*args, **kwargs):
+            time.sleep(0.01)
+            return {'last_modified': 123}
+
+        def read_records():
+            while not done.is_set():
+                self.app.get(self.record_url, headers=self.headers)
+
+        with mock.patch('kinto.views.records.get_parent_collection',
+                        side_effect=slow_lookup):
+            reader = threading.Thread(target=read_records)
+            reader.start()
+            try:
+                return self.app.get('/__profile__?_duration=0.3',
+                                    headers=self.headers, **kwargs)
+            finally:
+                done.set()
+                reader.join()
+
+    def test_returns_404_if_not_enabled_in_configuration(self):
+        extra = {'profile_endpoint_enabled': False}
+        app = self._get_test_app(settings=extra)
+        app.get('/__profile__', headers=self.headers, status=404)
+
+    def test_samples_are_aggregated_by_resource_method(self):
+        resp = self.profile()
+        self.assertEqual(resp.json['duration'], 0.3)
+        self.assertGreater(resp.json['samples'], 10)
+        views = dict((v['view'], v) for v in resp.json['views'])
+        self.assertGreater(views['Record.__init__']['percent'], 50)
+        stack = resp.json['stacks'][0]['stack']
+        self.assertIn('pyramid.router:', stack)
+        self.assertIn('slow_lookup', stack)
+
+    def test_stacks_can_be_collapsed_for_flame_graphs(self):
+        self.headers['Accept'] = 'text/plain'
+        resp = self.profile()
+        self.assertEqual(resp.content_type, 'text/plain')
+        lines = resp.text.splitlines()
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertGreater(int(count), 0)
+        self.assertTrue(any(line.startswith('Record.__init__;')
+                            for line in lines))
+
+    def test_profile_requests_are_not_sampled(self):
+        resp = self.app.get('/__profile__?_duration=0.05',
+                            headers=self.headers)
+        self.assertEqual(resp.json['views'], [])
+        self.assertEqual(resp.json['stacks'], [])
+
+    def test_duration_defaults_to_the_maximum_if_lower(self):
+        with mock.patch.object(profile, 'sample_stacks',
+                               return_value=(0, Counter())) as sampled:
+            self.app.get('/__profile__', headers=self.headers)
+        sampled.assert_called_with(2.0)
+
+    def test_duration_cannot_exceed_the_maximum(self):
+        self.app.get('/__profile__?_duration=3', headers=self.headers,
+                     status=400)
+
+    def test_duration_must_be_a_positive_number(self):
+        for duration in ('0', 'abc', 'true'):
+            self.app.get('/__profile__?_duration=%s' % duration,
+                         headers=self.headers, status=400)
+
+    def test_authentication_is_required(self):
+        self.app.get('/__profile__', status=401)
+
+    def test_anonymous_requests_are_rejected_whatever_the_settings(self):
+        app = self._get_test_app(
+            {'profile_endpoint_principals': 'system.Everyone'})
+        app.get('/__profile__', status=401)
+
+    def test_only_listed_principals_are_allowed(self):
+        self.app.get('/__profile__', headers=get_user_headers('alice'),
+                     status=403)
+
+    def test_nobody_is_allowed_by_default(self):
+        app = self._get_test_app({'profile_endpoint_principals': ''})
+        app.get('/__profile__', headers=self.headers, status=403)
+
+    def test_profiles_cannot_run_concurrently(self):
+        with profile._running:
+            resp = self.app.get('/__profile__', headers=self.headers,
+                                status=409)
+        self.assertEqual(resp.json['message'],
+                         'A profile is already running.')
+        self.app.get('/__profile__?_duration=0.05', headers=self.headers)
+
+
+class ViewLabelTest(unittest.TestCase):
+    def frame(self, module, name, instance=None):
+        frame = mock.MagicMock()
+        frame.f_globals = {'__name__': module}
+        frame.f_code.co_qualname = name
+        frame.f_code.co_name = name.split('.')[-1]
+        frame.f_code.co_argcount = 0
+        frame.f_code.co_varnames = ()
+        if instance is not None:
+            frame.f_code.co_argcount = 1
+            frame.f_code.co_varnames = ('self',)
+            frame.f_locals = {'self': instance}
+        return frame
+
+    def test_kinto_views_functions_are_used_outside_resources(self):
+        frames = [self.frame('pyramid.router', 'Router.__call__'),
+                  self.frame('kinto.views.imports', 'import_post'),
+                  self.frame('kinto.views.imports', 'parse_record')]
+        self.assertEqual(profile.view_label(frames),
+                         'kinto.views.imports:import_post')
+
+    def test_other_stacks_have_no_view(self):
+        frames = [self.frame('pyramid.router', 'Router.__call__',
+                             instance=object())]
+        self.assertIsNone(profile.view_label(frames))
@@ -2,7 +2,8 @@ import json
 import mock
 
 from cliquet.utils import decode_header
-from .support import (BaseWebTest, unittest, MINIMALIST_RECORD,
+from .support import (BaseWebTest, unittest, get_user_headers,
+                      MINIMALIST_RECORD,
                       MINIMALIST_GROUP, MINIMALIST_BUCKET,
                       MINIMALIST_COLLECTION)
 
@@ -45,11 +46,93 @@ class RecordsViewTest(BaseWebTest, unittest.TestCase):
                        'body': MINIMALIST_RECORD}
             batch['requests'].append(request)
 
+        # Not in cache yet.
+        self.cache.flush()
+        self.app.app.registry.collections_cache.clear()
+
         with mock.patch.object(self.storage, 'get',
                                wraps=self.storage.get) as patched:
             self.app.post_json('/batch', batch, headers=self.headers)
             self.assertEqual(patched.call_count, 1)
 
+    def test_parent_collection_is_not_fetched_once_in_cache(self):
+        with mock.patch.object(self.storage, 'get',
+                               wraps=self.storage.get) as patched:
+            self.app.get(self.record_url, headers=self.headers)
+            self.app.get(self.collection_url, headers=self.headers)
+            # Only the record is fetched.
+            self.assertEqual(patched.call_count, 1)
+
+    def test_parent_collection_is_fetched_from_cache_backend(self):
+        self.app.app.registry.collections_cache.clear()
+        with mock.patch.object(self.storage, 'get',
+                               wraps=self.storage.get) as patched:
+            self.app.get(self.collection_url, headers=self.headers)
+            self.assertEqual(patched.call_count, 0)
+
+    def test_parent_collection_is_forgotten_when_bucket_is_deleted(self):
+        batch = {'requests': [
+            {'method': 'GET', 'path': self.collection_url},
+            {'method': 'DELETE', 'path': '/buckets/beers'},
+            {'method': 'PUT', 'path': '/buckets/beers'},
+            {'method': 'GET', 'path': self.collection_url},
+        ]}
+        resp = self.app.post_json('/batch', batch, headers=self.headers)
+        self.assertEqual(resp.json['responses'][3]['status'], 404)
+
+    def test_parent_collection_changes_are_taken_into_account(self):
+        self.app.patch_json('/buckets/beers/collections/barley',
+                            {'data': {'cache_expires': 10}},
+                            headers=self.headers)
+        resp = self.app.get(self.collection_url, headers=self.headers)
+        self.assertIn('max-age=10', resp.headers['Cache-Control'])
+
+    def test_parent_collection_deletion_is_taken_into_account(self):
+        self.app.delete('/buckets/beers/collections/barley',
+                        headers=self.headers)
+        self.app.get(self.collection_url, headers=self.headers, status=404)
+
+    def test_parent_bucket_deletion_is_taken_into_account(self):
+        self.app.delete('/buckets/beers', headers=self.headers)
+        self.app.put_json('/buckets/beers', MINIMALIST_BUCKET,
+                          headers=self.headers)
+        self.app.get(self.collection_url, headers=self.headers, status=404)
+
+    def test_outdated_parent_collection_is_not_kept_in_cache(self):
+        self.app.get(self.collection_url, headers=self.headers)
+        version = self.cache.get('collections:version:beers')
+        key = 'collections:beers:%s' % version
+        outdated = self.cache.get(key)
+        self.app.patch_json('/buckets/beers/collections/barley',
+                            {'data': {'cache_expires': 10}},
+                            headers=self.headers)
+        # Written back by a request which fetched it before the change.
+        self.cache.set(key, outdated, 3600)
+        self.app.app.registry.collections_cache.clear()
+        resp = self.app.get(self.collection_url, headers=self.headers)
+        self.assertIn('max-age=10', resp.headers['Cache-Control'])
+
+    def test_cached_parent_collection_lookup_does_not_use_storage(self):
+        self.app.get(self.collection_url, headers=self.headers)
+        self.app.app.registry.collections_cache.clear()
+        with mock.patch.object(self.storage, 'collection_timestamp',
+                               wraps=self.storage.collection_timestamp) as ts:
+            self.app.get(self.collection_url, headers=self.headers)
+        collections_reads = [c for c in ts.call_args_list
+                             if c[1].get('collection_id') == 'collection']
+        self.assertEqual(collections_reads, [])
+
+    def test_parent_collection_changes_are_taken_into_account_in_batch(self):
+        batch = {'requests': [
+            {'method': 'GET', 'path': self.collection_url},
+            {'method': 'PATCH', 'path': '/buckets/beers/collections/barley',
+             'body': {'data': {'cache_expires': 10}}},
+            {'method': 'GET', 'path': self.collection_url},
+        ]}
+        resp = self.app.post_json('/batch', batch, headers=self.headers)
+        headers = resp.json['responses'][2]['headers']
+        self.assertIn('max-age=10', headers['Cache-Control'])
+
     def test_individual_collections_can_be_deleted(self):
         resp = self.app.get(self.collection_url, headers=self.headers)
         self.assertEqual(len(resp.json['data']), 1)
@@ -182,3 +265,212 @@ class RecordsViewTest(BaseWebTest, unittest.TestCase):
         new_timestamp = int(
             decode_header(json.loads(collection_resp.headers['ETag'])))
         assert old_timestamp < new_timestamp
+
+
+class RecordsWithoutCollectionsCacheTest(BaseWebTest, unittest.TestCase):
+
+    collection_url = '/buckets/beers/collections/barley/records'
+
+    def setUp(self):
+        super(RecordsWithoutCollectionsCacheTest, self).setUp()
+        self.app.put_json('/buckets/beers', MINIMALIST_BUCKET,
+                          headers=self.headers)
+        self.app.put_json('/buckets/beers/collections/barley',
+                          MINIMALIST_COLLECTION,
+                          headers=self.headers)
+
+    def get_app_settings(self, extra=None):
+        settings = super(RecordsWithoutCollectionsCacheTest,
+                         self).get_app_settings(extra)
+        settings['collections_cache_ttl_seconds'] = '0'
+        return settings
+
+    def test_parent_collection_is_fetched_on_each_request(self):
+        with mock.patch.object(self.storage, 'get',
+                               wraps=self.storage.get) as patched:
+            self.app.get(self.collection_url, headers=self.headers)
+            self.app.get(self.collection_url, headers=self.headers)
+            self.assertEqual(patched.call_count, 2)
+
+
+class RecordsResponseCacheTest(BaseWebTest, unittest.TestCase):
+
+    collection_url = '/buckets/beers/collections/barley/records'
+
+    def get_app_settings(self, extra=None):
+        settings = super(RecordsResponseCacheTest,
+                         self).get_app_settings(extra)
+        settings['records_cache_ttl_seconds'] = 30
+        return settings
+
+    def setUp(self):
+        super(RecordsResponseCacheTest, self).setUp()
+        self.app.put_json('/buckets/beers', MINIMALIST_BUCKET,
+                          headers=self.headers)
+        self.app.put_json('/buckets/beers/collections/barley',
+                          MINIMALIST_COLLECTION,
+                          headers=self.headers)
+        for i in range(3):
+            self.app.post_json(self.collection_url, MINIMALIST_RECORD,
+                               headers=self.headers)
+
+    def test_records_are_not_fetched_from_storage_once_in_cache(self):
+        resp = self.app.get(self.collection_url, headers=self.headers)
+        with mock.patch.object(self.storage, 'get_all',
+                               wraps=self.storage.get_all) as patched:
+            cached = self.app.get(self.collection_url, headers=self.headers)
+            self.assertEqual(patched.call_count, 0)
+        self.assertEqual(cached.json, resp.json)
+        self.assertEqual(cached.headers['ETag'], resp.headers['ETag'])
+        self.assertEqual(cached.headers['Total-Records'], '3')
+
+    def test_records_are_fetched_from_storage_when_collection_changes(self):
+        self.app.get(self.collection_url, headers=self.headers)
+        self.app.post_json(self.collection_url, MINIMALIST_RECORD,
+                           headers=self.headers)
+        resp = self.app.get(self.collection_url, headers=self.headers)
+        self.assertEqual(len(resp.json['data']), 4)
+
+    def test_querystrings_are_cached_separately(self):
+        self.app.get(self.collection_url, headers=self.headers)
+        resp = self.app.get(self.collection_url + '?_limit=1',
+                            headers=self.headers)
+        self.assertEqual(len(resp.json['data']), 1)
+        cached = self.app.get(self.collection_url + '?_limit=1',
+                              headers=self.headers)
+        self.assertEqual(cached.headers['Next-Page'],
+                         resp.headers['Next-Page'])
+
+    def test_querystrings_are_normalized(self):
+        self.app.get(self.collection_url + '?_limit=1&_sort=name',
+                     headers=self.headers)
+        with mock.patch.object(self.storage, 'get_all',
+                               wraps=self.storage.get_all) as patched:
+            self.app.get(self.collection_url + '?_sort=name&_limit=1',
+                         headers=self.headers)
+            self.assertEqual(patched.call_count, 0)
+
+    def test_not_modified_is_returned_from_cache(self):
+        resp = self.app.get(self.collection_url, headers=self.headers)
+        headers = self.headers.copy()
+        headers['If-None-Match'] = resp.headers['ETag']
+        self.app.get(self.collection_url, headers=headers, status=304)
+
+    def test_collection_can_be_deleted_and_created_again(self):
+        self.app.get(self.collection_url, headers=self.headers)
+        self.app.delete('/buckets/beers/collections/barley',
+                        headers=self.headers)
+        self.app.put_json('/buckets/beers/collections/barley',
+                          MINIMALIST_COLLECTION,
+                          headers=self.headers)
+        resp = self.app.get(self.collection_url, headers=self.headers)
+        self.assertEqual(resp.json['data'], [])
+
+    def test_partial_lists_are_cached_per_shared_records(self):
+        resp = self.app.post_json(self.collection_url, MINIMALIST_RECORD,
+                                  headers=self.headers)
+        record_url = self.collection_url + '/' + resp.json['data']['id']
+        alice_headers = self.headers.copy()
+        alice_headers.update(**get_user_headers('alice'))
+        resp = self.app.get('/', headers=alice_headers)
+        alice_principal = resp.json['userid']
+        self.app.patch_json(record_url,
+                            {'permissions': {'read': [alice_principal]}},
+                            headers=self.headers)
+
+        self.app.get(self.collection_url, headers=self.headers)
+        resp = self.app.get(self.collection_url, headers=alice_headers)
+        self.assertEqual(len(resp.json['data']), 1)
+
+        # Collection permissions changes do not affect its timestamp.
+        self.app.patch_json('/buckets/beers/collections/barley',
+                            {'permissions': {'read': [alice_principal]}},
+                            headers=self.headers)
+        resp = self.app.get(self.collection_url, headers=alice_headers)
+        self.assertEqual(len(resp.json['data']), 4)
+
+
+class RecordsPollTest(BaseWebTest, unittest.TestCase):
+
+    collection_url = '/buckets/beers/collections/barley/records'
+
+    def setUp(self):
+        super(RecordsPollTest, self).setUp()
+        self.app.put_json('/buckets/beers', MINIMALIST_BUCKET,
+                          headers=self.headers)
+        self.app.put_json('/buckets/beers/collections/barley',
+                          {'data': {'cache_expires': 10}},
+                          headers=self.headers)
+        resp = self.app.post_json(self.collection_url, MINIMALIST_RECORD,
+                                  headers=self.headers)
+        self.timestamp = resp.json['data']['last_modified']
+        self.since_url = self.collection_url + '?_since=%s' % self.timestamp
+        self.poll_headers = self.headers.copy()
+        self.poll_headers['If-None-Match'] = '"%s"' % self.timestamp
+
+    def assertNotInstantiated(self, url, headers, status=200):
+        with mock.patch('kinto.views.records.Record.__init__') as patched:
+            resp = self.app.get(url, headers=headers, status=status)
+            self.assertFalse(patched.called)
+        return resp
+
+    def test_not_modified_is_returned_without_resource(self):
+        resp = self.assertNotInstantiated(self.collection_url,
+                                          self.poll_headers, status=304)
+        self.assertEqual(resp.headers['ETag'], '"%s"' % self.timestamp)
+        self.assertIn('Last-Modified', resp.headers)
+
+    def test_empty_changes_are_returned_without_resource(self):
+        resp = self.assertNotInstantiated(self.since_url + '&_sort=-title',
+                                          self.headers)
+        self.assertEqual(resp.json, {'data': []})
+        self.assertEqual(resp.headers['Total-Records'], '0')
+        self.assertEqual(resp.headers['ETag'], '"%s"' % self.timestamp)
+        self.assertEqual(resp.headers['Cache-Control'], 'max-age=10')
+
+    def test_empty_changes_are_the_same_as_resource_ones(self):
+        fast = self.app.get(self.since_url, headers=self.headers)
+        # Any other parameter is handled by the resource.
+        slow = self.app.get(self.since_url + '&_limit=5',
+                            headers=self.headers)
+        self.assertEqual(fast.body, slow.body)
+        for header in ('Content-Type', 'ETag', 'Last-Modified',
+                       'Total-Records', 'Cache-Control'):
+            self.assertEqual(fast.headers[header], slow.headers[header])
+
+    def test_changes_are_returned_by_resource(self):
+        url = self.collection_url + '?_since=%s' % (self.timestamp - 1)
+        resp = self.app.get(url, headers=self.headers)
+        self.assertEqual(len(resp.json['data']), 1)
+
+    def test_modified_collection_is_returned_by_resource(self):
+        headers = self.headers.copy()
+        headers['If-None-Match'] = '"%s"' % (self.timestamp - 1)
+        resp = self.app.get(self.collection_url, headers=headers)
+        self.assertEqual(len(resp.json['data']), 1)
+
+    def test_invalid_values_are_reported_by_resource(self):
+        headers = self.headers.copy()
+        headers['If-None-Match'] = 'abc'
+        self.app.get(self.collection_url, headers=headers, status=400)
+        self.app.get(self.collection_url + '?_since=abc',
+                     headers=self.headers, status=400)
+
+    def test_preconditions_are_checked_by_resource(self):
+        headers = self.headers.copy()
+        headers['If-Match'] = '"%s"' % (self.timestamp - 1)
+        self.app.get(self.since_url, headers=headers, status=412)
+
+    def test_permissions_are_checked(self):
+        headers = self.poll_headers.copy()
+        headers.update(**get_user_headers('alice'))
+        self.app.get(self.collection_url, headers=headers, status=403)
+
+    def test_unknown_collection_raises_404(self):
+        url = self.collection_url.replace('barley', 'pills')
+        self.app.get(url, headers=self.poll_headers, status=404)
+
+    def test_deleted_collection_raises_404(self):
+        self.app.delete('/buckets/beers/collections/barley',
+                        headers=self.headers)
+        self.app.get(self.since_url, headers=self.headers, status=404)
@@ -0,0 +1,160 @@
+"""Timing of the phases of requests.
+
+Once enabled with the ``timings_enabled`` setting, the durations of the
+instrumented phases of each request (along with its batch subrequests) are:
+
+* returned in the ``Server-Timing`` response header;
+* aggregated in histograms, served on the ``/__stats__`` endpoint;
+* passed to the ``timings_hook`` callable (which sends them to statsd by
+  default).
+
+When disabled, :func:`timed` returns a shared no-op context manager.
+"""
+import bisect
+import threading
+import timeit
+from collections import OrderedDict
+
+from cliquet.utils import encode_header, msec_time
+
+
+# Key of the request timings in the request bound data (i.e. shared with
+# batch subrequests).
+TIMINGS_KEY = 'timings'
+
+# Upper bounds of the histograms buckets, in milliseconds.
+HISTOGRAM_BOUNDS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500,
+                    1000, 2500, 5000, 10000)
+
+_timer = timeit.default_timer
+
+
+class RequestTimings(object):
+    """Durations of the phases of a request, in seconds, in the order they
+    were first run.
+    """
+    def __init__(self):
+        self.started = _timer()
+        self.phases = OrderedDict()
+
+    def add(self, phase, duration):
+        self.phases[phase] = self.phases.get(phase, 0) + duration
+
+    def header(self):
+        """Return the value of the ``Server-Timing`` header."""
+        return ', '.join('%s;dur=%.3f' % (phase, duration * 1000)
+                         for phase, duration in self.phases.items())
+
+
+class _Phase(object):
+    __slots__ = ('timings', 'phase', 'started')
+
+    def __init__(self, timings, phase):
+        self.timings = timings
+        self.phase = phase
+
+    def __enter__(self):
+        self.started = _timer()
+
+    def __exit__(self, *exc_info):
+        self.timings.add(self.phase, _timer() - self.started)
+
+
+class _NotTimed(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NOT_TIMED = _NotTimed()
+
+
+def timed(request, phase):
+    """Return a context manager which adds its duration to the specified
+    phase of the request, if timings are enabled.
+
+    Durations of the phases run several times (e.g. in batch subrequests)
+    are summed.
+    """
+    if request.registry.timings is None:
+        return _NOT_TIMED
+    timings = request.bound_data.get(TIMINGS_KEY)
+    if timings is None:
+        return _NOT_TIMED
+    return _Phase(timings, phase)
+
+
+class PhasesStats(object):
+    """Histograms of the phases durations, aggregated over the requests
+    since the process started.
+    """
+    def __init__(self):
+        self.since = msec_time()
+        self._lock = threading.Lock()
+        self._phases = {}
+
+    def add(self, phases):
+        """Aggregate the phases durations (in seconds) of a request."""
+        with self._lock:
+            for phase, duration in phases.items():
+                milliseconds = duration * 1000
+                stats = self._phases.get(phase)
+                if stats is None:
+                    buckets = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+                    stats = self._phases[phase] = [0, 0.0, 0.0, buckets]
+                stats[0] += 1
+                stats[1] += milliseconds
+                stats[2] = max(stats[2], milliseconds)
+                index = bisect.bisect_left(HISTOGRAM_BOUNDS, milliseconds)
+                stats[3][index] += 1
+
+    def as_dict(self):
+        """Return the count, mean, maximum and histogram of each phase
+        duration, in milliseconds.
+        """
+        bounds = ['%s' % bound for bound in HISTOGRAM_BOUNDS] + ['+Inf']
+        phases = OrderedDict()
+        with self._lock:
+            for phase in sorted(self._phases):
+                count, total, maximum, buckets = self._phases[phase]
+                phases[phase] = OrderedDict([
+                    ('count', count),
+                    ('mean_ms', round(total / count, 3)),
+                    ('max_ms', round(maximum, 3)),
+                    ('histogram_ms', OrderedDict(zip(bounds, buckets))),
+                ])
+        return OrderedDict([('since', self.since), ('phases', phases)])
+
+
+def statsd_hook(request, phases):
+    """Send the phases durations of the request to statsd, if enabled."""
+    statsd = request.registry.statsd
+    if statsd is None:
+        return
+    for phase, duration in phases.items():
+        # The durations are already measured: send them as is.
+        timer = statsd.timer('timings.%s' % phase)
+        timer.ms = duration * 1000
+        timer.send()
+
+
+def timings_tween_factory(handler, registry):
+    """Pyramid tween which times the whole request (along with the
+    authentication and its batch subrequests), and reports its phases
+    durations once responded.
+    """
+    def timings_tween(request):
+        timings = RequestTimings()
+        request.bound_data[TIMINGS_KEY] = timings
+        response = handler(request)
+        timings.add('total', _timer() - timings.started)
+        response.headers['Server-Timing'] = encode_header(timings.header())
+        registry.timings.add(timings.phases)
+        registry.timings_hook(request, timings.phases)
+        return response
+
+    return timings_tween
@@ -1,20 +1,88 @@
-import random
+import binascii
+import os
 import string
+import threading
 
+from cliquet import resource
 from cliquet.storage import generators, exceptions
+from cliquet.utils import msec_time
 from pyramid import httpexceptions
 
+from kinto.authorization import RouteFactory
+
+
+# Key of the default buckets known to exist in the cache backend. The ids of
+# their collections known to exist are stored as value.
+DEFAULT_BUCKET_CACHE_KEY = 'default_bucket:%s'
+
+
+class ProtectedViewSet(resource.ProtectedResource.default_viewset):
+    """Serve the resources with the *Kinto* route factory."""
+    def get_service_arguments(self):
+        args = super(ProtectedViewSet, self).get_service_arguments()
+        args['factory'] = RouteFactory
+        return args
+
 
 class NameGenerator(generators.Generator):
+    """Random names of 8 letters, digits, ``-`` and ``_``, starting with a
+    letter or digit (example: ``'Tb3k_n-Q'``).
+    """
+    # 64 characters: every random byte is drawn uniformly with 6 bits.
+    alphabet = string.ascii_letters + string.digits + '-_'
+    length = 8
+
     def __call__(self):
-        ascii_letters = ('abcdefghijklmopqrstuvwxyz'
-                         'ABCDEFGHIJKLMOPQRSTUVWXYZ')
-        alphabet = ascii_letters + string.digits + '-_'
-        letters = [random.choice(ascii_letters + string.digits)]
-        letters += [random.choice(alphabet) for x in range(7)]
+        alphabet = self.alphabet
+        letters = [alphabet[b & 63]
+                   for b in bytearray(os.urandom(self.length))]
+        # Names start with a letter or a digit.
+        while letters[0] in '-_':
+            letters[0] = alphabet[bytearray(os.urandom(1))[0] & 63]
         return ''.join(letters)
 
 
+class TimeOrderedNameGenerator(NameGenerator):
+    """Names starting with the current time in milliseconds, followed by a
+    random part, so that new objects are appended at the end of the storage
+    indexes (example: ``'0mgwp3s5d7x2a3kqh'``).
+
+    Names are made of lowercase letters and digits, whose order is the same
+    in every collation. Within a process, names are strictly increasing:
+    the random part of the previous name is incremented when the clock did
+    not move forward.
+    """
+    alphabet = string.digits + string.ascii_lowercase
+    time_length = 9
+    length = 8
+
+    def __init__(self, *args, **kwargs):
+        self._lock = threading.Lock()
+        self._last = (0, 0)
+        super(TimeOrderedNameGenerator, self).__init__(*args, **kwargs)
+
+    def _encode(self, value, length):
+        base = len(self.alphabet)
+        letters = []
+        for _ in range(length):
+            value, digit = divmod(value, base)
+            letters.append(self.alphabet[digit])
+        return ''.join(reversed(letters))
+
+    def __call__(self):
+        now = msec_time()
+        # Leave room for increments in the random part.
+        limit = len(self.alphabet) ** self.length // 2
+        random_part = int(binascii.hexlify(os.urandom(8)), 16) % limit
+        with self._lock:
+            last_time, last_random = self._last
+            if now <= last_time:
+                now, random_part = last_time, last_random + 1
+            self._last = (now, random_part)
+        return (self._encode(now, self.time_length) +
+                self._encode(random_part, self.length))
+
+
 def object_exists_or_404(request, collection_id, object_id, parent_id=''):
     storage = request.registry.storage
     try:
@@ -24,3 +92,10 @@ def object_exists_or_404(request, collection_id, object_id, parent_id=''):
     except exceptions.RecordNotFoundError:
         # XXX: We gave up putting details about parent id here (See #53).
         raise httpexceptions.HTTPNotFound()
+
+
+def forget_default_bucket(request, bucket_id):
+    """Drop the default bucket objects known to exist, when the bucket
+    or one of its collections is deleted.
+    """
+    request.registry.cache.delete(DEFAULT_BUCKET_CACHE_KEY % bucket_id)
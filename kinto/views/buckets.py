@@ -1,17 +1,26 @@
 from six import text_type
 from uuid import UUID
 
-from pyramid.httpexceptions import HTTPForbidden, HTTPException
+from pyramid.events import NewRequest, subscriber
+from pyramid.httpexceptions import HTTPForbidden
 from pyramid.security import NO_PERMISSION_REQUIRED
 from pyramid.view import view_config
 
 from cliquet import resource
-from cliquet.utils import hmac_digest, build_request, reapply_cors
+from repoze.lru import LRUCache
+from cliquet.utils import hmac_digest
 from cliquet.storage import exceptions as storage_exceptions
 
-from kinto.authorization import RouteFactory
-from kinto.views import NameGenerator
-from kinto.views.collections import Collection
+from kinto.authorization import (RouteFactory, invalidate_principals,
+                                 object_uri)
+from kinto.notifications import notify_changes
+from kinto.permission import remove_children_principals
+from kinto.reaper import purge_children, raise_503_if_purging
+from kinto.timings import timed
+from kinto.views import (ProtectedViewSet, DEFAULT_BUCKET_CACHE_KEY,
+                         forget_default_bucket)
+from kinto.views.collections import (Collection,
+                                     invalidate_collections_metadata)
 
 
 @resource.register(name='bucket',
@@ -19,47 +28,94 @@ from kinto.views.collections import Collection
                    collection_path='/buckets',
                    record_path='/buckets/{{id}}')
 class Bucket(resource.ProtectedResource):
+    default_viewset = ProtectedViewSet
     permissions = ('read', 'write', 'collection:create', 'group:create')
 
     def __init__(self, *args, **kwargs):
         super(Bucket, self).__init__(*args, **kwargs)
-        self.collection.id_generator = NameGenerator()
+        self.collection.id_generator = self.request.registry.name_generator
 
     def get_parent_id(self, request):
         # Buckets are not isolated by user, unlike Cliquet resources.
         return ''
 
+    def postprocess(self, result):
+        if isinstance(result, dict):
+            bucket_uri = object_uri('bucket', result[self.collection.id_field])
+            notify_changes(self.request, result, [bucket_uri])
+        return super(Bucket, self).postprocess(result)
+
     def delete(self):
         result = super(Bucket, self).delete()
+        bucket_uri = object_uri('bucket', self.record_id)
+
+        # Remove the principals of its groups from all their members at
+        # once, even if the groups are purged later.
+        permission = self.request.registry.permission
+        members = remove_children_principals(permission, bucket_uri)
+        invalidate_principals(self.request, members)
 
-        # Delete groups.
-        storage = self.collection.storage
-        parent_id = '/buckets/%s' % self.record_id
-        storage.delete_all(collection_id='group',
-                           parent_id=parent_id,
-                           with_deleted=False)
-        storage.purge_deleted(collection_id='group',
-                              parent_id=parent_id)
-
-        # Delete collections.
-        deleted = storage.delete_all(collection_id='collection',
-                                     parent_id=parent_id,
-                                     with_deleted=False)
-        storage.purge_deleted(collection_id='collection',
-                              parent_id=parent_id)
-
-        # Delete records.
-        id_field = self.collection.id_field
-        for collection in deleted:
-            parent_id = '/buckets/%s/collections/%s' % (self.record_id,
-                                                        collection[id_field])
-            storage.delete_all(collection_id='record',
-                               parent_id=parent_id,
-                               with_deleted=False)
-            storage.purge_deleted(collection_id='record', parent_id=parent_id)
+        # Delete groups, collections and records, along with their
+        # permissions, at once.
+        purge_children(self.request, bucket_uri)
+        forget_default_bucket(self.request, self.record_id)
+        invalidate_collections_metadata(self.request, self.record_id)
 
         return result
 
+    def process_record(self, new, old=None):
+        new = super(Bucket, self).process_record(new, old)
+
+        # Children of a former bucket with the same id must be gone first.
+        bucket_id = new.get(self.collection.id_field)
+        if bucket_id is not None:
+            raise_503_if_purging(self.request, object_uri('bucket', bucket_id))
+
+        return new
+
+
+# Number of users whose default bucket id is kept in memory.
+BUCKET_IDS_CACHE_SIZE = 10000
+
+# Default buckets ids only depend on the user id and the HMAC secret. They
+# can thus be shared among requests and workers threads.
+bucket_ids_cache = LRUCache(BUCKET_IDS_CACHE_SIZE)
+
+
+def default_bucket_id(request):
+    """Return the user unguessable bucket_id UUID, built from their user id.
+    """
+    hmac_secret = request.registry.settings['userid_hmac_secret']
+    key = (hmac_secret, request.prefixed_userid)
+    bucket_id = bucket_ids_cache.get(key)
+    if bucket_id is None:
+        digest = hmac_digest(hmac_secret, request.prefixed_userid)
+        bucket_id = text_type(UUID(digest[:32]))
+        bucket_ids_cache.put(key, bucket_id)
+    return bucket_id
+
+
+def get_known_collections(request, bucket_id):
+    """Return the ids of the collections known to exist in the specified
+    default bucket, or ``None`` if the bucket is not known to exist.
+    """
+    known = request.bound_data.setdefault('known_objects', {})
+    if bucket_id not in known:
+        cache = request.registry.cache
+        known[bucket_id] = cache.get(DEFAULT_BUCKET_CACHE_KEY % bucket_id)
+    return known[bucket_id]
+
+
+def set_known_collections(request, bucket_id, collections):
+    """Remember that the default bucket and its specified collections exist,
+    for ``default_bucket_cache_ttl_seconds``.
+    """
+    request.bound_data.setdefault('known_objects', {})[bucket_id] = collections
+    ttl = int(request.registry.settings['default_bucket_cache_ttl_seconds'])
+    if ttl > 0:
+        cache = request.registry.cache
+        cache.set(DEFAULT_BUCKET_CACHE_KEY % bucket_id, collections, ttl)
+
 
 def create_bucket(request, bucket_id):
     """Create a bucket if it doesn't exists."""
@@ -74,6 +130,12 @@ def create_bucket(request, bucket_id):
     if bucket_id in already_created:
         return
 
+    # Do nothing if the bucket was already created before.
+    if get_known_collections(request, bucket_id) is not None:
+        return
+
+    raise_503_if_purging(request, object_uri('bucket', bucket_id))
+
     # Fake context to instantiate a Bucket resource.
     context = RouteFactory(request)
     context.get_permission_object_id = lambda r, i: '/buckets/%s' % bucket_id
@@ -84,6 +146,7 @@ def create_bucket(request, bucket_id):
         bucket = e.record
     finally:
         already_created[bucket_id] = bucket
+    set_known_collections(request, bucket_id, [])
 
 
 def create_collection(request, bucket_id):
@@ -106,6 +169,13 @@ def create_collection(request, bucket_id):
     if collection_put:
         return
 
+    # Do nothing if the collection was already created before.
+    known_collections = get_known_collections(request, bucket_id) or []
+    if collection_id in known_collections:
+        return
+
+    raise_503_if_purging(request, collection_uri)
+
     # Fake context to instantiate a Collection resource.
     context = RouteFactory(request)
     context.get_permission_object_id = lambda r, i: collection_uri
@@ -122,47 +192,55 @@ def create_collection(request, bucket_id):
     finally:
         already_created[collection_uri] = collection
     request.matchdict = backup
+    set_known_collections(request, bucket_id,
+                          known_collections + [collection_id])
+
+
+@subscriber(NewRequest)
+def resolve_default_bucket(event):
+    """Rewrite the requests on ``/buckets/default`` to the user bucket, once
+    created, so that they are dispatched directly to the buckets, groups,
+    collections and records views.
+    """
+    request = event.request
+    route_prefix = request.registry.route_prefix
+    default_path = '/%s/buckets/default' % route_prefix
+    path = request.path_info
+    if not path.startswith(default_path):
+        return
+    subpath = path[len(default_path):]
+    if subpath and not subpath.startswith('/'):
+        return  # e.g. ``/buckets/default-1234``
+
+    if request.method.lower() == 'options':
+        # CORS preflight requests are not authenticated, and do not involve
+        # any actual bucket.
+        bucket_id = 'unknown'
+    elif getattr(request, 'prefixed_userid', None) is None:
+        return  # Rejected by the ``default_bucket`` view.
+    else:
+        with timed(request, 'default_bucket_id'):
+            bucket_id = default_bucket_id(request)
+        # Same as matched by ``default_bucket_collection`` route, until the
+        # actual route is matched.
+        request.matchdict = {'subpath': subpath.lstrip('/')}
+
+        # Make sure bucket exists
+        with timed(request, 'create_bucket'):
+            create_bucket(request, bucket_id)
+
+        # Make sure the collection exists
+        with timed(request, 'create_collection'):
+            create_collection(request, bucket_id)
+
+    request.path_info = '/%s/buckets/%s%s' % (route_prefix, bucket_id, subpath)
 
 
 @view_config(route_name='default_bucket', permission=NO_PERMISSION_REQUIRED)
 @view_config(route_name='default_bucket_collection',
              permission=NO_PERMISSION_REQUIRED)
 def default_bucket(request):
-    if request.method.lower() == 'options':
-        path = request.path.replace('default', 'unknown')
-        subrequest = build_request(request, {
-            'method': 'OPTIONS',
-            'path': path
-        })
-        return request.invoke_subrequest(subrequest)
-
-    if getattr(request, 'prefixed_userid', None) is None:
-        raise HTTPForbidden  # Pass through the forbidden_view_config
-
-    settings = request.registry.settings
-    hmac_secret = settings['userid_hmac_secret']
-    # Build the user unguessable bucket_id UUID from its user_id
-    digest = hmac_digest(hmac_secret, request.prefixed_userid)
-    bucket_id = text_type(UUID(digest[:32]))
-    path = request.path.replace('/buckets/default', '/buckets/%s' % bucket_id)
-    querystring = request.url[(request.url.index(request.path) +
-                               len(request.path)):]
-
-    # Make sure bucket exists
-    create_bucket(request, bucket_id)
-
-    # Make sure the collection exists
-    create_collection(request, bucket_id)
-
-    subrequest = build_request(request, {
-        'method': request.method,
-        'path': path + querystring,
-        'body': request.body
-    })
-    subrequest.bound_data = request.bound_data
-
-    try:
-        response = request.invoke_subrequest(subrequest)
-    except HTTPException as error:
-        response = reapply_cors(subrequest, error)
-    return response
+    """Requests of authenticated users are rewritten to their bucket by
+    :func:`resolve_default_bucket`.
+    """
+    raise HTTPForbidden  # Pass through the forbidden_view_config
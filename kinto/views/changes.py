@@ -0,0 +1,150 @@
+from cliquet.errors import raise_invalid
+from cliquet.utils import encode_header, native_value
+from cornice import Service
+from pyramid import httpexceptions
+
+from kinto.authorization import RouteFactory, object_uri
+from kinto.notifications import (STORED_CHANGES_CACHE_KEY,
+                                 STORED_CHANGES_VERSION_KEY)
+from kinto.storage import latest_timestamp
+from kinto.views.records import get_parent_collection
+
+
+class ChangesRouteFactory(RouteFactory):
+    """Require the ``read`` permission on the bucket or collection whose
+    changes are awaited.
+    """
+    def __init__(self, request):
+        super(ChangesRouteFactory, self).__init__(request)
+        bucket_id = request.matchdict['bucket_id']
+        collection_id = request.matchdict.get('collection_id')
+        if collection_id is None:
+            self.permission_object_id = object_uri('bucket', bucket_id)
+        else:
+            self.permission_object_id = object_uri('collection', bucket_id,
+                                                   collection_id)
+        self.required_permission = 'read'
+
+
+bucket_changes = Service(name='bucket-changes',
+                         description='Wait for changes in a bucket',
+                         path='/buckets/{bucket_id}/changes',
+                         factory=ChangesRouteFactory)
+
+collection_changes = Service(name='collection-changes',
+                             description='Wait for changes in a collection',
+                             path=('/buckets/{bucket_id}/collections/'
+                                   '{collection_id}/changes'),
+                             factory=ChangesRouteFactory)
+
+
+def _extract_seconds(request, param):
+    value = request.GET.get(param)
+    if value is None:
+        return None
+    value = native_value(value)
+    if not isinstance(value, int) or value < 0:
+        raise_invalid(request,
+                      location='querystring',
+                      name=param,
+                      description='Invalid value for %s' % param)
+    return value
+
+
+def _stored_timestamp(request, collection=None):
+    """Return the timestamp of the latest change stored in the bucket, or in
+    the specified collection.
+
+    It is kept in the cache backend for ``notifications_cache_ttl_seconds``,
+    along with the version of the channel read before it, which is bumped
+    by :func:`kinto.notifications.notify_changes`.
+    """
+    cache = request.registry.cache
+    ttl = int(request.registry.settings['notifications_cache_ttl_seconds'])
+    if ttl <= 0:
+        return _read_stored_timestamp(request, collection)
+
+    channel = request.context.permission_object_id
+    version = cache.get(STORED_CHANGES_VERSION_KEY % channel)
+    cache_key = STORED_CHANGES_CACHE_KEY % (channel, version)
+    cached = cache.get(cache_key)
+    if cached is None:
+        cached = {'last_modified': _read_stored_timestamp(request,
+                                                          collection)}
+        cache.set(cache_key, cached, ttl)
+    return cached['last_modified']
+
+
+def _read_stored_timestamp(request, collection=None):
+    storage = request.registry.storage
+    bucket_id = request.matchdict['bucket_id']
+    bucket_uri = object_uri('bucket', bucket_id)
+    if collection is not None:
+        collections = [collection]
+        timestamps = [collection['last_modified']]
+    else:
+        collections, _ = storage.get_all(collection_id='collection',
+                                         parent_id=bucket_uri)
+        timestamps = [latest_timestamp(storage, resource, bucket_uri)
+                      for resource in ('collection', 'group')]
+    for collection in collections:
+        collection_uri = object_uri('collection', bucket_id, collection['id'])
+        timestamps.append(latest_timestamp(storage, 'record', collection_uri))
+    timestamps = [timestamp for timestamp in timestamps
+                  if timestamp is not None]
+    return max(timestamps) if timestamps else None
+
+
+@bucket_changes.get(permission='read')
+@collection_changes.get(permission='read')
+def changes_get(request):
+    """Wait until a change newer than ``_since`` is made in the bucket or
+    collection, for ``_timeout`` seconds at most, and return its timestamp.
+
+    Return ``304 Not Modified`` if no change was made in the interim.
+    """
+    settings = request.registry.settings
+    since = _extract_seconds(request, '_since')
+    timeout = _extract_seconds(request, '_timeout')
+    max_timeout = int(settings['notifications_timeout_seconds'])
+    if timeout is None or timeout > max_timeout:
+        timeout = max_timeout
+
+    collection = None
+    collection_id = request.matchdict.get('collection_id')
+    if collection_id is not None:
+        # Raise 404 if the collection does not exist.
+        collection = get_parent_collection(request,
+                                           request.matchdict['bucket_id'],
+                                           collection_id)
+
+    # Changes made before the notifier was aware of them (e.g. by another
+    # process, or before a restart) are returned without waiting.
+    if since is not None:
+        timestamp = _stored_timestamp(request, collection)
+        if timestamp is not None and timestamp > since:
+            request.response.headers['ETag'] = encode_header(
+                '"%s"' % timestamp)
+            return {'data': {'last_modified': timestamp}}
+
+    # Waiting clients hold a server thread: once every slot is taken,
+    # requests are answered immediately, like polls.
+    slots = request.registry.notifications_slots
+    waiting = slots.acquire(False)
+    if not waiting:
+        timeout = 0
+
+    notifier = request.registry.notifier
+    try:
+        timestamp = notifier.wait(request.context.permission_object_id,
+                                  since=since,
+                                  timeout=timeout)
+    finally:
+        if waiting:
+            slots.release()
+
+    if timestamp is None:
+        raise httpexceptions.HTTPNotModified()
+
+    request.response.headers['ETag'] = encode_header('"%s"' % timestamp)
+    return {'data': {'last_modified': timestamp}}
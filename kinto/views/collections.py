@@ -1,9 +1,105 @@
+import uuid
+
 import colander
 import jsonschema
 from cliquet import resource
 from jsonschema import exceptions as jsonschema_exceptions
 
-from kinto.views import NameGenerator
+from kinto.authorization import object_uri
+from kinto.notifications import notify_changes
+from kinto.reaper import (purge_children, raise_404_if_purging,
+                          raise_503_if_purging)
+from kinto.views import (ProtectedViewSet, forget_default_bucket,
+                         object_exists_or_404)
+
+
+# Keys of the metadata of the collections of a bucket in the cache backend,
+# stored for the current version of the bucket collections.
+COLLECTIONS_CACHE_KEY = 'collections:%s:%s'
+COLLECTIONS_VERSION_KEY = 'collections:version:%s'
+
+# Collection fields involved in records handling.
+COLLECTION_METADATA_FIELDS = ('id', 'last_modified', 'schema', 'cache_expires')
+
+# Number of buckets whose collections metadata is kept in process memory.
+COLLECTIONS_MEMORY_CACHE_SIZE = 1000
+
+
+def get_collection_metadata(request, bucket_id, collection_id):
+    """Return the metadata of the specified collection, or raise a 404 error
+    if it does not exist.
+
+    Metadata are kept in the cache backend for
+    ``collections_cache_ttl_seconds``, and in process memory for
+    ``collections_memory_ttl_seconds``.
+
+    Cache backend entries are stored along with the version of the bucket
+    collections, read before fetching them (see
+    :func:`invalidate_collections_metadata`): a request which fetched an
+    outdated collection cannot keep it in cache after it was modified.
+    """
+    bucket_uri = object_uri('bucket', bucket_id)
+    ttl = int(request.registry.settings['collections_cache_ttl_seconds'])
+    if ttl <= 0:
+        return object_exists_or_404(request,
+                                    collection_id='collection',
+                                    parent_id=bucket_uri,
+                                    object_id=collection_id)
+
+    memory = request.registry.collections_cache
+    cache = request.registry.cache
+    entry = memory.get(bucket_id)
+    if entry is None:
+        version = cache.get(COLLECTIONS_VERSION_KEY % bucket_id)
+        entry = cache.get(COLLECTIONS_CACHE_KEY % (bucket_id, version))
+        if entry is None:
+            entry = {'version': version, 'collections': {}}
+        memory.put(bucket_id, entry)
+
+    collections = entry['collections']
+    if collection_id not in collections:
+        collection = object_exists_or_404(request,
+                                          collection_id='collection',
+                                          parent_id=bucket_uri,
+                                          object_id=collection_id)
+        metadata = dict((field, collection[field])
+                        for field in COLLECTION_METADATA_FIELDS
+                        if field in collection)
+        collections = dict(collections)
+        collections[collection_id] = metadata
+        version = entry['version']
+        entry = {'version': version, 'collections': collections}
+        cache.set(COLLECTIONS_CACHE_KEY % (bucket_id, version), entry, ttl)
+        memory.put(bucket_id, entry)
+
+    return collections[collection_id]
+
+
+def invalidate_collections_metadata(request, bucket_id, collection_id=None):
+    """Drop the metadata of the collections of the specified bucket, once
+    one of them (or the bucket itself) was modified or deleted.
+
+    The version of the bucket collections is bumped in the cache backend,
+    instead of deleting their cached metadata: metadata read by concurrent
+    requests before the change can still be cached, but under their former
+    version.
+    """
+    request.registry.collections_cache.invalidate(bucket_id)
+    ttl = int(request.registry.settings['collections_cache_ttl_seconds'])
+    if ttl > 0:
+        # Outlive the entries cached for the former version.
+        request.registry.cache.set(COLLECTIONS_VERSION_KEY % bucket_id,
+                                   uuid.uuid4().hex, ttl * 2)
+
+    # Also drop them from the current request (and batch).
+    memoized = request.bound_data.get('collections', {})
+    if collection_id is not None:
+        uri = object_uri('collection', bucket_id, collection_id)
+        memoized.pop(uri, None)
+    else:
+        prefix = object_uri('bucket', bucket_id) + '/'
+        for uri in [uri for uri in memoized if uri.startswith(prefix)]:
+            memoized.pop(uri)
 
 
 class JSONSchemaMapping(colander.SchemaNode):
@@ -38,28 +134,61 @@ class CollectionSchema(resource.ResourceSchema):
                    collection_path='/buckets/{{bucket_id}}/collections',
                    record_path='/buckets/{{bucket_id}}/collections/{{id}}')
 class Collection(resource.ProtectedResource):
+    default_viewset = ProtectedViewSet
     mapping = CollectionSchema()
     permissions = ('read', 'write', 'record:create')
 
-    def __init__(self, *args, **kwargs):
-        super(Collection, self).__init__(*args, **kwargs)
-        self.collection.id_generator = NameGenerator()
+    def __init__(self, request, *args, **kwargs):
+        self.bucket_id = request.matchdict['bucket_id']
+        super(Collection, self).__init__(request, *args, **kwargs)
+        self.collection.id_generator = self.request.registry.name_generator
+
+        raise_404_if_purging(self.request,
+                             object_uri('bucket', self.bucket_id))
 
     def get_parent_id(self, request):
-        bucket_id = request.matchdict['bucket_id']
-        parent_id = '/buckets/%s' % bucket_id
-        return parent_id
+        return object_uri('bucket', request.matchdict['bucket_id'])
+
+    def postprocess(self, result):
+        if isinstance(result, dict):
+            collection_uri = object_uri('collection', self.bucket_id,
+                                        result[self.collection.id_field])
+            notify_changes(self.request, result,
+                           [self.collection.parent_id, collection_uri])
+        return super(Collection, self).postprocess(result)
+
+    def put(self):
+        result = super(Collection, self).put()
+        invalidate_collections_metadata(self.request, self.bucket_id,
+                                        self.record_id)
+        return result
+
+    def patch(self):
+        result = super(Collection, self).patch()
+        invalidate_collections_metadata(self.request, self.bucket_id,
+                                        self.record_id)
+        return result
 
     def delete(self):
         result = super(Collection, self).delete()
+        invalidate_collections_metadata(self.request, self.bucket_id,
+                                        self.record_id)
 
-        # Delete records.
-        storage = self.collection.storage
-        parent_id = '%s/collections/%s' % (self.collection.parent_id,
-                                           self.record_id)
-        storage.delete_all(collection_id='record',
-                           parent_id=parent_id,
-                           with_deleted=False)
-        storage.purge_deleted(collection_id='record', parent_id=parent_id)
+        # Delete records, along with their permissions.
+        purge_children(self.request, object_uri('collection', self.bucket_id,
+                                                self.record_id))
+        forget_default_bucket(self.request, self.bucket_id)
 
         return result
+
+    def process_record(self, new, old=None):
+        new = super(Collection, self).process_record(new, old)
+
+        # Records of a former collection with the same id must be gone first.
+        collection_id = new.get(self.collection.id_field)
+        if collection_id is not None:
+            collection_uri = object_uri('collection', self.bucket_id,
+                                        collection_id)
+            raise_503_if_purging(self.request, collection_uri)
+
+        return new
@@ -0,0 +1,79 @@
+from cliquet.utils import encode_header, json
+from cornice import Service
+from pyramid.response import Response
+
+from kinto.authorization import RouteFactory, object_uri
+from kinto.storage import iter_records
+from kinto.views.records import get_parent_collection
+
+
+# Media type of responses with one record per line.
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+
+class ExportRouteFactory(RouteFactory):
+    """Require the ``read`` permission on the exported collection."""
+    def __init__(self, request):
+        super(ExportRouteFactory, self).__init__(request)
+        self.permission_object_id = object_uri(
+            'collection',
+            request.matchdict['bucket_id'],
+            request.matchdict['collection_id'])
+        self.required_permission = 'read'
+
+
+collection_export = Service(name='collection-export',
+                            description='Export the records of a collection',
+                            path=('/buckets/{bucket_id}/collections/'
+                                  '{collection_id}/export'),
+                            factory=ExportRouteFactory)
+
+
+def _json_chunks(batches):
+    yield b'{"data":['
+    separator = b''
+    for records in batches:
+        chunk = b','.join(json.dumps(r).encode('utf-8') for r in records)
+        yield separator + chunk
+        separator = b','
+    yield b']}'
+
+
+def _ndjson_chunks(batches):
+    for records in batches:
+        yield b''.join(json.dumps(r).encode('utf-8') + b'\n'
+                       for r in records)
+
+
+@collection_export.get(permission='read')
+def export_get(request):
+    """Stream every record of the collection in a single response, from
+    the newest to the oldest.
+
+    Records are sent as a JSON list (``{"data": [...]}``), or one per line
+    if ``application/x-ndjson`` is accepted by the client. They are fetched
+    from the storage backend by batches, while the response is written.
+    """
+    bucket_id = request.matchdict['bucket_id']
+    collection_id = request.matchdict['collection_id']
+    # Raise 404 if the collection does not exist.
+    get_parent_collection(request, bucket_id, collection_id)
+
+    storage = request.registry.storage
+    parent_id = request.context.permission_object_id
+    timestamp = storage.collection_timestamp(collection_id='record',
+                                             parent_id=parent_id)
+    settings = request.registry.settings
+    batches = iter_records(storage, 'record', parent_id,
+                           batch_size=int(settings['export_batch_size']))
+
+    offers = ['application/json', NDJSON_CONTENT_TYPE]
+    if request.accept.best_match(offers) == NDJSON_CONTENT_TYPE:
+        content_type, app_iter = NDJSON_CONTENT_TYPE, _ndjson_chunks(batches)
+    else:
+        content_type, app_iter = 'application/json', _json_chunks(batches)
+
+    response = Response(app_iter=app_iter, content_type=content_type,
+                        charset='utf-8')
+    response.headers['ETag'] = encode_header('"%s"' % timestamp)
+    return response
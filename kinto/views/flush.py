@@ -13,4 +13,7 @@ def flush_post(request):
     request.registry.storage.flush()
     request.registry.permission.flush()
     request.registry.cache.flush()
+    request.registry.collections_cache.clear()
+    if request.registry.notifier is not None:
+        request.registry.notifier.flush()
     return httpexceptions.HTTPAccepted()
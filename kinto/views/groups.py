@@ -2,8 +2,88 @@ import colander
 
 from cliquet import resource
 from cliquet import schema
+from cliquet.errors import raise_invalid
 
-from kinto.views import NameGenerator
+from kinto.authorization import invalidate_principals, object_uri
+from kinto.notifications import notify_changes
+from kinto.permission import (add_principal_to_users, principal_members,
+                              remove_principals, remove_principal_from_users)
+from kinto.reaper import raise_404_if_purging
+from kinto.views import ProtectedViewSet
+
+
+def get_groups_members(request, bucket_id):
+    """Return the members of every group of the specified bucket, by group
+    URI.
+    """
+    groups, _ = request.registry.storage.get_all(
+        collection_id='group',
+        parent_id=object_uri('bucket', bucket_id))
+    return dict((object_uri('group', bucket_id, group['id']),
+                 set(group['members']))
+                for group in groups)
+
+
+def get_descendants(groups, group_uri):
+    """Return the members of the specified group, along with the members of
+    its nested groups, recursively.
+
+    :param dict groups: the members of the groups of the bucket, by URI.
+    """
+    descendants = set()
+    pending = [group_uri]
+    while pending:
+        for member in groups.get(pending.pop(), ()):
+            if member not in descendants:
+                descendants.add(member)
+                pending.append(member)
+    return descendants
+
+
+def get_ancestors(groups, groups_uris):
+    """Return the groups which contain the specified groups, recursively.
+
+    :param dict groups: the members of the groups of the bucket, by URI.
+    """
+    parents = {}
+    for uri, members in groups.items():
+        for member in members:
+            parents.setdefault(member, set()).add(uri)
+
+    ancestors = set()
+    pending = list(groups_uris)
+    while pending:
+        for parent in parents.get(pending.pop(), ()):
+            if parent not in ancestors:
+                ancestors.add(parent)
+                pending.append(parent)
+    return ancestors
+
+
+def update_members_closure(request, groups, groups_uris, stale=()):
+    """Give the principal of each specified group to the members of the
+    group and of its nested groups, and remove it from the others.
+
+    Only the differences with the members index are applied to the
+    permission backend, one statement per group at most.
+
+    :param dict groups: the members of the groups of the bucket, by URI.
+    :param stale: the members whose principals may be missing although
+        indexed (i.e. deleted groups, whose principals are deleted along with
+        their permissions by the memory backend).
+    :returns: the ids of the users whose principals changed.
+    :rtype: set
+    """
+    permission = request.registry.permission
+    changed = set()
+    for group_uri in groups_uris:
+        expected = get_descendants(groups, group_uri)
+        current = principal_members(permission, group_uri)
+        current.difference_update(stale)
+        add_principal_to_users(permission, expected - current, group_uri)
+        remove_principal_from_users(permission, current - expected, group_uri)
+        changed.update(expected ^ current)
+    return changed
 
 
 class GroupSchema(schema.ResourceSchema):
@@ -15,41 +95,74 @@ class GroupSchema(schema.ResourceSchema):
                    collection_path='/buckets/{{bucket_id}}/groups',
                    record_path='/buckets/{{bucket_id}}/groups/{{id}}')
 class Group(resource.ProtectedResource):
-
+    default_viewset = ProtectedViewSet
     mapping = GroupSchema()
 
     def __init__(self, *args, **kwargs):
         super(Group, self).__init__(*args, **kwargs)
-        self.collection.id_generator = NameGenerator()
+        self.collection.id_generator = self.request.registry.name_generator
+
+        bucket_id = self.request.matchdict['bucket_id']
+        raise_404_if_purging(self.request, object_uri('bucket', bucket_id))
 
     def get_parent_id(self, request):
         bucket_id = request.matchdict['bucket_id']
         parent_id = '/buckets/%s' % bucket_id
         return parent_id
 
+    def postprocess(self, result):
+        notify_changes(self.request, result, [self.collection.parent_id])
+        return super(Group, self).postprocess(result)
+
+    def _is_bucket_group(self, principal):
+        return principal.startswith(self.collection.parent_id + '/groups/')
+
+    def _get_parent_groups(self, group_uri):
+        """Return the groups of the bucket which contain the specified group,
+        recursively, from the members index.
+        """
+        permission = self.request.registry.permission
+        return set(p for p in permission.user_principals(group_uri)
+                   if self._is_bucket_group(p))
+
     def collection_delete(self):
-        filters = self._extract_filters()
-        groups, _ = self.collection.get_records(filters=filters)
         body = super(Group, self).collection_delete()
+        groups_ids = [self.context.get_permission_object_id(
+            self.request, group[self.collection.id_field])
+            for group in body['data']]
+        # Remove the groups principals from all their members at once.
         permission = self.request.registry.permission
-        for group in groups:
-            group_id = self.context.get_permission_object_id(
-                self.request, group[self.collection.id_field])
-            # Remove the group's principal from all members of the group.
-            for member in group['members']:
-                permission.remove_user_principal(
-                    member,
-                    group_id)
+        members = remove_principals(permission, groups_ids)
+
+        # The remaining groups which contained the deleted ones lose their
+        # nested members.
+        bucket_id = self.request.matchdict['bucket_id']
+        groups = get_groups_members(self.request, bucket_id)
+        parents = get_ancestors(groups, groups_ids)
+        members |= update_members_closure(self.request, groups, parents,
+                                          stale=groups_ids)
+
+        invalidate_principals(self.request, members)
         return body
 
     def delete(self):
-        group = self._get_record_or_404(self.record_id)
-        permission = self.request.registry.permission
-        body = super(Group, self).delete()
         group_id = self.context.permission_object_id
-        for member in group['members']:
-            # Remove the group's principal from all members of the group.
-            permission.remove_user_principal(member, group_id)
+        # Read before the group permissions are deleted.
+        parents = self._get_parent_groups(group_id)
+
+        body = super(Group, self).delete()
+        # Remove the group's principal from all members of the group.
+        permission = self.request.registry.permission
+        members = remove_principals(permission, [group_id])
+
+        # The groups which contained it lose its members.
+        if parents:
+            bucket_id = self.request.matchdict['bucket_id']
+            groups = get_groups_members(self.request, bucket_id)
+            members |= update_members_closure(self.request, groups, parents,
+                                              stale=[group_id])
+
+        invalidate_principals(self.request, members)
         return body
 
     def process_record(self, new, old=None):
@@ -64,12 +177,32 @@ class Group(resource.ProtectedResource):
         group_principal = self.context.get_permission_object_id(
             self.request, self.record_id)
         permission = self.request.registry.permission
-        for member in new_members:
-            # Add the group to the member principal.
-            permission.add_user_principal(member, group_principal)
 
-        for member in removed_members:
-            # Remove the group from the member principal.
-            permission.remove_user_principal(member, group_principal)
+        parents = self._get_parent_groups(group_principal)
+        nested = [m for m in existing_record_members | new_record_members
+                  if self._is_bucket_group(m)]
+        if parents or nested:
+            # Members of nested groups are members of their parents too:
+            # the group and its parents principals are updated from the
+            # members of the bucket groups.
+            bucket_id = self.request.matchdict['bucket_id']
+            groups = get_groups_members(self.request, bucket_id)
+            groups[group_principal] = new_record_members
+            if group_principal in get_descendants(groups, group_principal):
+                raise_invalid(self.request,
+                              name='members',
+                              description='Groups cannot contain themselves')
+            changed = update_members_closure(self.request, groups,
+                                             parents | {group_principal})
+            invalidate_principals(self.request, changed)
+            return new
+
+        # Add the group to the new members principals, and remove it from
+        # the former ones.
+        add_principal_to_users(permission, new_members, group_principal)
+        remove_principal_from_users(permission, removed_members,
+                                    group_principal)
+
+        invalidate_principals(self.request, new_members | removed_members)
 
         return new
@@ -0,0 +1,127 @@
+import six
+from cliquet.utils import json
+from cornice import Service
+
+from kinto.authorization import RouteFactory, object_uri
+from kinto.notifications import notify_changes
+from kinto.storage import import_records
+from kinto.views.records import (get_collection_validator,
+                                 get_parent_collection,
+                                 get_validation_errors)
+
+
+class ImportRouteFactory(RouteFactory):
+    """Require the ``write`` permission on the collection whose records are
+    imported.
+    """
+    def __init__(self, request):
+        super(ImportRouteFactory, self).__init__(request)
+        self.permission_object_id = object_uri(
+            'collection',
+            request.matchdict['bucket_id'],
+            request.matchdict['collection_id'])
+        self.required_permission = 'write'
+
+
+collection_import = Service(name='collection-import',
+                            description='Import records in a collection',
+                            path=('/buckets/{bucket_id}/collections/'
+                                  '{collection_id}/import'),
+                            factory=ImportRouteFactory)
+
+
+def read_chunks(lines, size):
+    """Group the non-empty lines of the specified iterable by chunks of
+    `size` lines at most.
+
+    :returns: an iterator of ``(line_numbers, lines)`` couples, where line
+        numbers start at 1.
+    """
+    numbers, chunk = [], []
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        numbers.append(number)
+        chunk.append(line)
+        if len(chunk) == size:
+            yield numbers, chunk
+            numbers, chunk = [], []
+    if chunk:
+        yield numbers, chunk
+
+
+def parse_record(line, id_generator, validator=None):
+    """Parse and validate a record line.
+
+    :returns: the record and the list of its ``(field, description)``
+        validation errors.
+    """
+    try:
+        record = json.loads(line.decode('utf-8'))
+    except ValueError:
+        return None, [(None, 'Invalid JSON')]
+    if not isinstance(record, dict):
+        return None, [(None, 'Records must be JSON objects')]
+
+    # Timestamps are assigned by the server.
+    record.pop('last_modified', None)
+    if 'id' not in record:
+        record['id'] = id_generator()
+    elif not (isinstance(record['id'], six.string_types) and
+              id_generator.match(record['id'])):
+        return None, [('id', 'Invalid record id')]
+
+    if validator is None:
+        return record, []
+    return record, get_validation_errors(validator, record)
+
+
+@collection_import.post(permission='write')
+def import_post(request):
+    """Create or replace the records of the collection sent in the request
+    body, one per line (NDJSON).
+
+    Lines are read as the body is received, and written by chunks of
+    ``kinto.import_batch_size`` records, one storage transaction each. Invalid
+    records are reported in the results of their chunk, and the valid ones
+    are imported anyway.
+    """
+    bucket_id = request.matchdict['bucket_id']
+    collection_id = request.matchdict['collection_id']
+    # Raise 404 if the collection does not exist.
+    collection = get_parent_collection(request, bucket_id, collection_id)
+
+    parent_id = request.context.permission_object_id
+    storage = request.registry.storage
+    id_generator = request.registry.id_generator
+    validator = get_collection_validator(request, parent_id, collection)
+    chunk_size = int(request.registry.settings['import_batch_size'])
+
+    results = []
+    latest = None
+    for numbers, lines in read_chunks(request.body_file, chunk_size):
+        records, errors = [], []
+        for number, line in zip(numbers, lines):
+            record, record_errors = parse_record(line, id_generator,
+                                                 validator)
+            for field, description in record_errors:
+                errors.append({'line': number,
+                               'name': field,
+                               'description': description})
+            if not record_errors:
+                if validator is not None:
+                    record['schema'] = collection['last_modified']
+                records.append(record)
+
+        stored = import_records(storage, 'record', parent_id, records)
+        if stored:
+            chunk_latest = max(r['last_modified'] for r in stored)
+            latest = max(latest or 0, chunk_latest)
+        results.append({'lines': [numbers[0], numbers[-1]],
+                        'imported': len(stored),
+                        'errors': errors})
+
+    if latest is not None:
+        notify_changes(request, {'last_modified': latest},
+                       [object_uri('bucket', bucket_id), parent_id])
+    return {'data': results}
@@ -0,0 +1,178 @@
+import sys
+import threading
+import time
+import timeit
+from collections import Counter
+
+from cliquet import resource
+from cliquet.errors import ERRORS, http_error, raise_invalid
+from cliquet.utils import native_value
+from cornice import Service
+from pyramid import httpexceptions
+from pyramid.response import Response
+
+from kinto.authorization import SettingsRouteFactory
+
+
+# Seconds between two samples of the worker threads stacks.
+SAMPLING_INTERVAL = 0.005
+
+# Default duration of a profile, in seconds.
+DEFAULT_DURATION = 10
+
+# Number of most sampled stacks returned in JSON.
+TOP_STACKS = 50
+
+# Name of the root frame of the stacks outside any view.
+OTHER_VIEW = '(other)'
+
+# Requests being processed have a frame in this module.
+ROUTER_MODULE = 'pyramid.router'
+
+# Held while a profile runs: profiles are not run concurrently.
+_running = threading.Lock()
+
+
+class ProfileRouteFactory(SettingsRouteFactory):
+    principals_setting = 'profile_endpoint_principals'
+
+
+profile = Service(name='profile',
+                  description='Sample the stacks of the current worker',
+                  path='/__profile__',
+                  factory=ProfileRouteFactory)
+
+
+def frame_label(frame):
+    code = frame.f_code
+    name = getattr(code, 'co_qualname', code.co_name)
+    return '%s:%s' % (frame.f_globals.get('__name__'), name)
+
+
+def view_label(frames):
+    """Return the name of the resource method (e.g.
+    ``Record.collection_get``), or else of the *Kinto* views function, which
+    runs the specified frames (from the outermost), or ``None``.
+    """
+    function = None
+    for frame in frames:
+        code = frame.f_code
+        if 'self' in code.co_varnames[:code.co_argcount]:
+            instance = frame.f_locals.get('self')
+            if isinstance(instance, resource.BaseResource):
+                return '%s.%s' % (type(instance).__name__, code.co_name)
+        module = frame.f_globals.get('__name__') or ''
+        if function is None and module.startswith('kinto.views.'):
+            function = frame_label(frame)
+    return function
+
+
+def sample_stacks(duration, interval=SAMPLING_INTERVAL):
+    """Sample the stacks of the threads processing a request, every
+    `interval` seconds, during `duration` seconds.
+
+    Threads running a profile are ignored.
+
+    :returns: the number of samples, and the number of times each stack was
+        sampled, by view (see :func:`view_label`).
+    :rtype: tuple
+    """
+    stacks = Counter()
+    timer = timeit.default_timer
+    deadline = timer() + duration
+    samples = 0
+    while timer() < deadline:
+        samples += 1
+        for frame in sys._current_frames().values():
+            frames = []
+            while frame is not None:
+                frames.append(frame)
+                frame = frame.f_back
+            frames.reverse()
+            modules = set(f.f_globals.get('__name__') for f in frames)
+            if ROUTER_MODULE not in modules or __name__ in modules:
+                continue
+            view = view_label(frames) or OTHER_VIEW
+            stack = tuple(frame_label(f) for f in frames)
+            stacks[(view, stack)] += 1
+        time.sleep(interval)
+    return samples, stacks
+
+
+def collapse(stacks):
+    """Return the stacks in the collapsed format of flame graphs tools (one
+    stack per line, with the view as root frame).
+    """
+    return ''.join('%s %s\n' % (';'.join((view,) + stack), count)
+                   for (view, stack), count in sorted(stacks.items()))
+
+
+def summarize(stacks):
+    """Return the number of samples of each view, and of the most sampled
+    stacks, in decreasing order.
+    """
+    views = Counter()
+    for (view, _), count in stacks.items():
+        views[view] += count
+    total = sum(views.values())
+    by_view = [{'view': view,
+                'samples': count,
+                'percent': round(100.0 * count / total, 1)}
+               for view, count in views.most_common()]
+    top = [{'view': view, 'stack': ';'.join(stack), 'samples': count}
+           for (view, stack), count in stacks.most_common(TOP_STACKS)]
+    return by_view, top
+
+
+def _extract_duration(request, max_duration):
+    value = request.GET.get('_duration')
+    if value is None:
+        return min(DEFAULT_DURATION, max_duration)
+    value = native_value(value)
+    is_number = isinstance(value, (int, float)) and value is not True
+    if not is_number or value <= 0 or value > max_duration:
+        raise_invalid(request,
+                      location='querystring',
+                      name='_duration',
+                      description=('_duration should be between 0 and %s '
+                                   'seconds' % max_duration))
+    return value
+
+
+@profile.get(permission='read')
+def profile_get(request):
+    """Sample the stacks of the requests processed by the current worker
+    during ``_duration`` seconds, and return them aggregated by view.
+
+    Stacks are returned in the collapsed format of flame graphs tools if
+    ``text/plain`` is accepted by the client.
+
+    Return ``409 Conflict`` if a profile is already running.
+    """
+    settings = request.registry.settings
+    max_duration = float(settings['profile_max_duration_seconds'])
+    duration = _extract_duration(request, max_duration)
+
+    if not _running.acquire(False):
+        raise http_error(httpexceptions.HTTPConflict(),
+                         errno=ERRORS.CONSTRAINT_VIOLATED,
+                         message='A profile is already running.')
+    try:
+        samples, stacks = sample_stacks(duration)
+    finally:
+        _running.release()
+
+    if request.accept.best_match(['application/json',
+                                  'text/plain']) == 'text/plain':
+        return Response(body=collapse(stacks).encode('utf-8'),
+                        content_type='text/plain',
+                        charset='utf-8')
+
+    views, top = summarize(stacks)
+    return {
+        'duration': duration,
+        'interval_ms': SAMPLING_INTERVAL * 1000,
+        'samples': samples,
+        'views': views,
+        'stacks': top,
+    }
@@ -1,10 +1,21 @@
-import jsonschema
+import hashlib
+import json
+
 from cliquet import resource, schema
-from cliquet.errors import raise_invalid
-from jsonschema import exceptions as jsonschema_exceptions
+from cliquet.errors import json_error_handler
+from cliquet.utils import decode_header, encode_header, native_value
+from jsonschema import validators
+from pyramid import httpexceptions
+from pyramid.renderers import render
 from pyramid.settings import asbool
+from repoze.lru import LRUCache
 
-from kinto.views import object_exists_or_404
+from kinto.authorization import object_uri
+from kinto.notifications import notify_changes
+from kinto.reaper import raise_404_if_purging
+from kinto.timings import timed
+from kinto.views import ProtectedViewSet
+from kinto.views.collections import get_collection_metadata
 
 
 class RecordSchema(schema.ResourceSchema):
@@ -12,67 +23,342 @@ class RecordSchema(schema.ResourceSchema):
         preserve_unknown = True
 
 
+# Number of collections schemas whose validator is kept in memory.
+VALIDATORS_CACHE_SIZE = 1000
+
+# Schemas only change with their collection timestamp. Their validators can
+# thus be shared among requests and workers threads.
+validators_cache = LRUCache(VALIDATORS_CACHE_SIZE)
+
+
+def get_schema_validator(collection_uri, collection_timestamp, schema):
+    """Return the (memoized) JSON schema validator of the specified
+    collection schema version.
+    """
+    key = (collection_uri, collection_timestamp)
+    validator = validators_cache.get(key)
+    if validator is None:
+        cls = validators.validator_for(schema)
+        cls.check_schema(schema)
+        validator = cls(schema)
+        validators_cache.put(key, validator)
+    return validator
+
+
+def get_collection_validator(request, collection_uri, collection):
+    """Return the JSON schema validator of the records of the specified
+    collection, or ``None`` if they are not validated.
+    """
+    schema = collection.get('schema')
+    settings = request.registry.settings
+    schema_validation = 'experimental_collection_schema_validation'
+    if not schema or not asbool(settings.get(schema_validation)):
+        return None
+    return get_schema_validator(collection_uri,
+                                collection['last_modified'],
+                                schema)
+
+
+def get_validation_errors(validator, record):
+    """Return the list of ``(field, description)`` couples for every
+    validation error of the record.
+    """
+    errors = []
+    reported = set()
+    for error in validator.iter_errors(record):
+        if error.path:
+            field = error.path[-1]
+        elif error.validator == 'required':
+            # One error per missing field, in the order of the schema. A
+            # field required several times (e.g. in ``allOf``) is reported
+            # again under its name.
+            missing = [f for f in error.validator_value if f not in record]
+            unreported = [f for f in missing if f not in reported]
+            field = (unreported or missing or [None])[0]
+        else:
+            field = None
+        reported.add(field)
+        errors.append((field, error.message))
+    return errors
+
+
+# Suffix of the records cache control settings, per bucket
+# (e.g. ``blog_record_cache_expires_seconds``) or per collection
+# (e.g. ``blog_articles_record_cache_expires_seconds``).
+RECORD_CACHE_EXPIRES_SUFFIX = '_record_cache_expires_seconds'
+
+
+def build_cache_expires_table(settings):
+    """Parse the records cache control settings into a
+    ``{bucket_id: {collection_id: seconds}}`` table, where the values set
+    for a whole bucket are stored under the ``None`` collection id.
+
+    Since identifiers can contain underscores, settings are registered for
+    every possible split of their name.
+
+    >>> table = build_cache_expires_table({
+    ...     'a_b_record_cache_expires_seconds': 30})
+    >>> table == {'a': {'b': 30}, 'a_b': {None: 30}}
+    True
+
+    """
+    table = {}
+    for key, value in settings.items():
+        # Prefixed settings are also available without their prefix.
+        if '.' in key or not key.endswith(RECORD_CACHE_EXPIRES_SUFFIX):
+            continue
+        name = key[:-len(RECORD_CACHE_EXPIRES_SUFFIX)]
+        if not name:
+            continue
+        seconds = int(value)
+        table.setdefault(name, {})[None] = seconds
+        parts = name.split('_')
+        for i in range(1, len(parts)):
+            bucket_id = '_'.join(parts[:i])
+            collection_id = '_'.join(parts[i:])
+            table.setdefault(bucket_id, {})[collection_id] = seconds
+    return table
+
+
+def get_cache_expires(table, bucket_id, collection_id):
+    """Return the cache control seconds of the specified collection records,
+    as set for the collection or its bucket, or ``None``.
+    """
+    by_bucket = table.get(bucket_id)
+    if by_bucket is None:
+        return None
+    return by_bucket.get(collection_id, by_bucket.get(None))
+
+
+# Key of the records list responses in the cache backend.
+RECORDS_CACHE_KEY = 'records:%s'
+
+# Headers of the records list responses, that are kept along their body.
+RECORDS_CACHE_HEADERS = ('Total-Records', 'Next-Page')
+
+
+def get_parent_collection(request, bucket_id, collection_id):
+    """Return the metadata of the records parent collection, or raise a 404
+    error if it does not exist or is being purged.
+
+    They are memoized on the request (and batch subrequests).
+    """
+    collection_uri = object_uri('collection', bucket_id, collection_id)
+    raise_404_if_purging(request,
+                         object_uri('bucket', bucket_id),
+                         collection_uri)
+
+    # Check if already fetched before (in batch).
+    collections = request.bound_data.setdefault('collections', {})
+    if collection_uri not in collections:
+        # Unknown yet, fetch from cache or storage.
+        collection = get_collection_metadata(request,
+                                             bucket_id,
+                                             collection_id)
+        collections[collection_uri] = collection
+
+    return collections[collection_uri]
+
+
+def add_cache_expires_headers(request, response, collection,
+                              bucket_id, collection_id):
+    """If the parent collection defines a ``cache_expires`` attribute,
+    then cache-control response headers are sent.
+
+    .. note::
+
+        Those headers are also sent if the
+        ``kinto.record_cache_expires_seconds`` setting is defined, or
+        the per bucket and per collection settings, which are parsed
+        once at startup (see :func:`build_cache_expires_table`).
+    """
+    cache_expires = collection.get('cache_expires')
+    if cache_expires is None:
+        table = request.registry.record_cache_expires
+        cache_expires = get_cache_expires(table, bucket_id, collection_id)
+
+    if cache_expires is not None:
+        response.cache_expires(seconds=cache_expires)
+
+
+# Querystring parameters that never change the result of a ``_since``
+# request without any change (i.e. an empty list).
+POLL_PARAMETERS = frozenset(['_since', '_sort'])
+
+
+def _get_poll_response(request):
+    """Return the response of a records list request that can be answered
+    from the collection timestamp only, or ``None``.
+
+    These are the requests whose ``If-None-Match`` header matches the
+    current timestamp (``304 Not Modified``), and the ``_since`` requests
+    without any change in the interim (empty list).
+    """
+    if_none_match = request.headers.get('If-None-Match')
+    since = request.GET.get('_since')
+    if if_none_match is None and since is None:
+        return None
+
+    if if_none_match is not None:
+        if_none_match = decode_header(if_none_match)
+        if not (if_none_match[:1] == if_none_match[-1:] == '"' and
+                if_none_match[1:-1].isdigit()):
+            # Invalid values are reported by the resource.
+            return None
+        if_none_match = int(if_none_match[1:-1])
+
+    if since is not None:
+        since = native_value(since)
+        # Other cases are handled by the resource.
+        is_poll = ('If-Match' not in request.headers and
+                   isinstance(since, int) and
+                   POLL_PARAMETERS.issuperset(request.GET.keys()))
+        if not is_poll:
+            since = None
+
+    if if_none_match is None and since is None:
+        return None
+
+    bucket_id = request.matchdict['bucket_id']
+    collection_id = request.matchdict['collection_id']
+    collection = get_parent_collection(request, bucket_id, collection_id)
+    timestamp = request.registry.storage.collection_timestamp(
+        collection_id='record',
+        parent_id=object_uri('collection', bucket_id, collection_id),
+        auth=request.headers.get('Authorization'))
+
+    if if_none_match is not None and timestamp <= if_none_match:
+        response = httpexceptions.HTTPNotModified()
+    elif since is not None and timestamp <= since:
+        response = request.response
+        response.headers['Total-Records'] = encode_header('0')
+        settings = request.registry.settings
+        global_expires = settings.get('record_cache_expires_seconds')
+        if global_expires is not None:
+            response.cache_expires(seconds=int(global_expires))
+        add_cache_expires_headers(request, response, collection,
+                                  bucket_id, collection_id)
+        body = render('json', {'data': []}, request=request)
+        response.content_type = 'application/json'
+        response.body = body.encode('utf-8')
+    else:
+        return None
+
+    response.last_modified = timestamp / 1000.0
+    response.headers['ETag'] = encode_header('"%s"' % timestamp)
+    return response
+
+
+def poll_fast_path(view):
+    """Decorate the records list view in order to answer polls from the
+    collection timestamp, before the resource is instantiated.
+
+    Like any view decorator, it runs once the request is authorized.
+    """
+    def wrapper(context, request):
+        response = _get_poll_response(request)
+        if response is None:
+            return view(context, request)
+        if isinstance(response, httpexceptions.HTTPNotModified):
+            raise response
+        return response
+    return wrapper
+
+
 _parent_path = '/buckets/{{bucket_id}}/collections/{{collection_id}}'
 
+_collection_get_arguments = dict(
+    ProtectedViewSet.collection_get_arguments,
+    decorator=poll_fast_path)
+
 
 @resource.register(name='record',
                    collection_path=_parent_path + '/records',
-                   record_path=_parent_path + '/records/{{id}}')
+                   record_path=_parent_path + '/records/{{id}}',
+                   collection_get_arguments=_collection_get_arguments)
 class Record(resource.ProtectedResource):
-
+    default_viewset = ProtectedViewSet
     mapping = RecordSchema()
     schema_field = 'schema'
 
-    def __init__(self, *args, **kwargs):
-        super(Record, self).__init__(*args, **kwargs)
-
-        # Check if already fetched before (in batch).
-        collections = self.request.bound_data.setdefault('collections', {})
-        collection_uri = self.get_parent_id(self.request)
-        if collection_uri not in collections:
-            # Unknown yet, fetch from storage.
-            collection_parent_id = '/buckets/%s' % self.bucket_id
-            collection = object_exists_or_404(self.request,
-                                              collection_id='collection',
-                                              parent_id=collection_parent_id,
-                                              object_id=self.collection_id)
-            collections[collection_uri] = collection
+    def __init__(self, request, *args, **kwargs):
+        self.bucket_id = request.matchdict['bucket_id']
+        self.collection_id = request.matchdict['collection_id']
+        super(Record, self).__init__(request, *args, **kwargs)
 
-        self._collection = collections[collection_uri]
+        with timed(self.request, 'collection_lookup'):
+            self._collection = get_parent_collection(self.request,
+                                                     self.bucket_id,
+                                                     self.collection_id)
 
     def get_parent_id(self, request):
-        self.bucket_id = request.matchdict['bucket_id']
-        self.collection_id = request.matchdict['collection_id']
-        return '/buckets/%s/collections/%s' % (self.bucket_id,
-                                               self.collection_id)
+        return object_uri('collection',
+                          request.matchdict['bucket_id'],
+                          request.matchdict['collection_id'])
 
     def is_known_field(self, field_name):
         """Without schema, any field is considered as known."""
         return True
 
+    def postprocess(self, result):
+        notify_changes(self.request, result,
+                       [object_uri('bucket', self.bucket_id),
+                        self.collection.parent_id])
+        return super(Record, self).postprocess(result)
+
     def process_record(self, new, old=None):
         """Validate records against collection schema, if any."""
         new = super(Record, self).process_record(new, old)
 
-        schema = self._collection.get('schema')
-        settings = self.request.registry.settings
-        schema_validation = 'experimental_collection_schema_validation'
-        if not schema or not asbool(settings.get(schema_validation)):
-            return new
-
-        collection_timestamp = self._collection[self.collection.modified_field]
+        with timed(self.request, 'schema_validation'):
+            validator = get_collection_validator(self.request,
+                                                 self.collection.parent_id,
+                                                 self._collection)
+            if validator is None:
+                return new
+            errors = get_validation_errors(validator, new)
 
-        try:
-            jsonschema.validate(new, schema)
-            new[self.schema_field] = collection_timestamp
-        except jsonschema_exceptions.ValidationError as e:
-            field = e.path.pop() if e.path else e.validator_value.pop()
-            raise_invalid(self.request, name=field, description=e.message)
+        if errors:
+            # Report every invalid field at once.
+            for field, description in errors:
+                self.request.errors.add('body', field, description)
+            raise json_error_handler(self.request.errors)
 
+        new[self.schema_field] = self._collection['last_modified']
         return new
 
     def collection_get(self):
-        result = super(Record, self).collection_get()
+        settings = self.request.registry.settings
+        ttl = int(settings['records_cache_ttl_seconds'])
+        if ttl <= 0:
+            result = super(Record, self).collection_get()
+            self._handle_cache_expires(self.request.response)
+            return result
+
+        cache = self.request.registry.cache
+        cache_key = self._get_records_cache_key()
+        cached = cache.get(cache_key)
+        if cached is None:
+            result = super(Record, self).collection_get()
+            headers = self.request.response.headers
+            cached = {
+                'body': result,
+                'headers': dict((name, headers[name])
+                                for name in RECORDS_CACHE_HEADERS
+                                if name in headers)
+            }
+            cache.set(cache_key, cached, ttl)
+        else:
+            # Same preconditions and headers as the storage query.
+            response = self.request.response
+            self._add_timestamp_header(response)
+            self._add_cache_header(response)
+            self._raise_304_if_not_modified()
+            self._raise_412_if_modified()
+            for name, value in cached['headers'].items():
+                response.headers[name] = encode_header(value)
+            result = cached['body']
+
         self._handle_cache_expires(self.request.response)
         return result
 
@@ -81,24 +367,26 @@ class Record(resource.ProtectedResource):
         self._handle_cache_expires(self.request.response)
         return result
 
-    def _handle_cache_expires(self, response):
-        """If the parent collection defines a ``cache_expires`` attribute,
-        then cache-control response headers are sent.
+    def _get_records_cache_key(self):
+        """Return the key of the current records list response in the cache
+        backend.
 
-        .. note::
-
-            Those headers are also sent if the
-            ``kinto.record_cache_expires_seconds`` setting is defined.
+        Responses only depend on the collection version, on the querystring
+        and on the records the current user is allowed to read. Users sharing
+        the same access thus share the same entries.
         """
-        cache_expires = self._collection.get('cache_expires')
-        if cache_expires is None:
-            by_bucket = 'kinto.%s_record_cache_expires_seconds' % (
-                self.bucket_id)
-            by_collection = '%s_%s_record_cache_expires_seconds' % (
-                self.bucket_id, self.collection_id)
-            settings = self.request.registry.settings
-            cache_expires = settings.get(by_collection,
-                                         settings.get(by_bucket))
-
-        if cache_expires is not None:
-            response.cache_expires(seconds=cache_expires)
+        context = {
+            'url': self.request.application_url,
+            # Collections can be deleted and created again.
+            'collection': [self.collection.parent_id,
+                           self._collection[self.collection.modified_field]],
+            'timestamp': self.timestamp,
+            'querystring': sorted(self.request.GET.items()),
+            'shared_ids': sorted(self.context.shared_ids or []),
+        }
+        serialized = json.dumps(context, sort_keys=True).encode('utf-8')
+        return RECORDS_CACHE_KEY % hashlib.sha256(serialized).hexdigest()
+
+    def _handle_cache_expires(self, response):
+        add_cache_expires_headers(self.request, response, self._collection,
+                                  self.bucket_id, self.collection_id)
@@ -0,0 +1,18 @@
+from cornice import Service
+
+from kinto.authorization import SettingsRouteFactory
+
+
+class StatsRouteFactory(SettingsRouteFactory):
+    principals_setting = 'stats_endpoint_principals'
+
+
+stats = Service(name='stats',
+                description='Durations of the phases of requests',
+                path='/__stats__',
+                factory=StatsRouteFactory)
+
+
+@stats.get(permission='read')
+def stats_get(request):
+    return request.registry.timings.as_dict()
@@ -0,0 +1,35 @@
+"""Actions of the simulation load tests, shared by the loads test case
+and the open-loop generator. This module has no dependency.
+"""
+import uuid
+
+
+ACTIONS_FREQUENCIES = [
+    ('create', 20),
+    ('create_put', 20),
+    ('batch_create', 50),
+    ('batch_create_put', 50),
+    ('batch_replace', 50),
+    ('batch_update', 50),
+    ('update', 50),
+    ('filter_sort', 60),
+    ('delete', 10),
+    ('batch_delete', 10),
+    ('poll_changes', 90),
+    ('poll_not_modified', 60),
+    ('list_archived', 20),
+    ('list_deleted', 40),
+    ('batch_count', 50),
+    ('list_continuated_pagination', 80),
+]
+
+
+def build_article():
+    suffix = uuid.uuid4().hex
+    data = {
+        "title": "Corp Site {0}".format(suffix),
+        "url": "http://mozilla.org/{0}".format(suffix),
+        "resolved_url": "http://mozilla.org/{0}".format(suffix),
+        "added_by": "FxOS-{0}".format(suffix),
+    }
+    return data
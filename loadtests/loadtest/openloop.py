@@ -0,0 +1,494 @@
+"""Open-loop load generator for the simulation actions.
+
+Unlike the *loads* test case, where each user sends its next request once the
+previous one is answered (closed loop), requests are started at a fixed rate,
+whatever the response times of the server. When the server slows down,
+requests thus pile up as they would with real clients, and their latency is
+measured from the time they were scheduled to start, instead of the time they
+were actually sent (*coordinated omission* correction).
+
+Each virtual user keeps track of its own records, instead of listing the whole
+collection before every action.
+
+Requires Python 3.5+ and ``aiohttp``::
+
+    python -m loadtest.openloop --server-url http://localhost:8888 \\
+        --rate 100 --duration 60 --users 20
+
+"""
+import argparse
+import asyncio
+import bisect
+import contextlib
+import itertools
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+import aiohttp
+
+from .actions import ACTIONS_FREQUENCIES, build_article
+
+
+# Upper bounds of the latency histograms buckets, in milliseconds.
+HISTOGRAM_BOUNDS = [2 ** i for i in range(18)]
+
+# Percentiles reported for each action.
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class ActionError(Exception):
+    pass
+
+
+# Returned by the actions whose response could not be served from the
+# client cache.
+MISS = 'miss'
+
+
+class Mix(object):
+    """Pick actions randomly, in proportion of their frequencies."""
+    def __init__(self, frequencies):
+        self.actions = [action for action, _ in frequencies]
+        self.cumulated = list(itertools.accumulate(
+            frequency for _, frequency in frequencies))
+
+    def pick(self):
+        value = random.uniform(0, self.cumulated[-1])
+        return self.actions[bisect.bisect_left(self.cumulated, value)]
+
+
+class Stats(object):
+    """Latencies of an action, in milliseconds.
+
+    Latencies of failed actions (including timeouts) are kept apart, so that
+    fast errors do not hide the slow successes, nor the other way around.
+    """
+    def __init__(self):
+        self.latencies = []
+        self.service_times = []
+        self.error_latencies = []
+        self.misses = 0
+
+    @property
+    def errors(self):
+        return len(self.error_latencies)
+
+    def add(self, latency, service_time):
+        self.latencies.append(latency)
+        self.service_times.append(service_time)
+
+    def add_error(self, latency):
+        self.error_latencies.append(latency)
+
+    @staticmethod
+    def percentile(values, percent):
+        rank = int(-(-percent * len(values) // 100))
+        return values[min(max(rank, 1), len(values)) - 1]
+
+    @staticmethod
+    def histogram(values):
+        histogram = {}
+        for value in values:
+            index = bisect.bisect_left(HISTOGRAM_BOUNDS, value)
+            bound = ('<=%s' % HISTOGRAM_BOUNDS[index]
+                     if index < len(HISTOGRAM_BOUNDS) else 'more')
+            histogram[bound] = histogram.get(bound, 0) + 1
+        return histogram
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        service_times = sorted(self.service_times)
+        error_latencies = sorted(self.error_latencies)
+        report = {'count': len(latencies), 'errors': self.errors,
+                  'misses': self.misses}
+        if error_latencies:
+            report['error_p50_ms'] = round(
+                self.percentile(error_latencies, 50), 3)
+            report['error_max_ms'] = round(error_latencies[-1], 3)
+            report['error_histogram_ms'] = self.histogram(error_latencies)
+        if not latencies:
+            return report
+        for percent in PERCENTILES:
+            key = 'p%s_ms' % percent
+            report[key] = round(self.percentile(latencies, percent), 3)
+        report['max_ms'] = round(latencies[-1], 3)
+        # Without the queueing delay, as a closed loop would measure it.
+        report['service_p50_ms'] = round(
+            self.percentile(service_times, 50), 3)
+        report['service_p99_ms'] = round(
+            self.percentile(service_times, 99), 3)
+        report['histogram_ms'] = self.histogram(latencies)
+        return report
+
+
+class VirtualUser(object):
+    """A user of the simulation, with its own collection records."""
+    def __init__(self, session, server_url, options):
+        self.session = session
+        self.server_url = server_url.rstrip('/')
+        self.auth = aiohttp.BasicAuth(uuid.uuid4().hex, 'secret')
+        self.batch_requests_size = options.batch_requests_size
+        self.nb_initial_records = random.randint(3,
+                                                 options.max_initial_records)
+        self.bucket_path = '/buckets/default'
+        self.collection_path = self.bucket_path + '/collections/articles'
+        self.records_path = self.collection_path + '/records'
+        # Records of the user, by id, except those reserved by the actions in
+        # flight.
+        self.records = {}
+        self.collection_timestamp = 0
+
+    def url(self, path):
+        return '%s/v1%s' % (self.server_url, path)
+
+    def record_path(self, record_id):
+        return '%s/%s' % (self.records_path, record_id)
+
+    async def request(self, method, path, body=None, headers=None,
+                      status=200):
+        """Send the request, and return the JSON body of its response along
+        with its headers. The expected status can be a tuple.
+        """
+        expected = status if isinstance(status, tuple) else (status,)
+        if body is not None:
+            body = json.dumps(body)
+        request_headers = {'Content-Type': 'application/json'}
+        request_headers.update(headers or {})
+        async with self.session.request(method, self.url(path), data=body,
+                                        headers=request_headers,
+                                        auth=self.auth) as response:
+            if response.status not in expected:
+                raise ActionError('%s %s: %s' % (method, path,
+                                                 response.status))
+            if response.status in (200, 201):
+                return await response.json(), response.headers
+            return None, response.headers
+
+    async def setup(self):
+        """Create the collection and the initial records of the user."""
+        await self.request('PUT', self.collection_path, {'data': {}},
+                           status=201)
+        for _ in range(self.nb_initial_records):
+            await self.create()
+
+    def touch(self, record):
+        # Actions of a user run concurrently: keep the latest timestamp.
+        self.collection_timestamp = max(self.collection_timestamp,
+                                        record['last_modified'])
+
+    def remember(self, record):
+        self.records[record['id']] = record
+        self.touch(record)
+
+    def forget(self, record):
+        self.records.pop(record['id'], None)
+        self.touch(record)
+
+    @contextlib.contextmanager
+    def reserve(self, count, keep=False):
+        """Take up to `count` random records out of the user records during
+        the action, so that concurrent actions cannot modify or delete them.
+
+        They are put back if the action fails, or if `keep` is true (i.e.
+        read-only actions). Otherwise, the action remembers or forgets them.
+        """
+        count = min(count, len(self.records))
+        records = [self.records.pop(record['id']) for record in
+                   random.sample(list(self.records.values()), count)]
+        if not records:
+            raise ActionError('No record available')
+        try:
+            yield records
+        except BaseException:
+            self.put_back(records)
+            raise
+        if keep:
+            self.put_back(records)
+
+    def put_back(self, records):
+        for record in records:
+            self.records.setdefault(record['id'], record)
+
+    async def run_batch(self, data):
+        body, _ = await self.request('POST', '/batch', data)
+        for response in body['responses']:
+            if response['status'] >= 400:
+                raise ActionError('Batch subrequest %s %s: %s' % (
+                    response['path'], response.get('method', ''),
+                    response['status']))
+        return body['responses']
+
+    async def create(self):
+        body, _ = await self.request('POST', self.records_path,
+                                     {'data': build_article()}, status=201)
+        self.remember(body['data'])
+
+    async def create_put(self):
+        body, _ = await self.request('PUT', self.record_path(uuid.uuid4()),
+                                     {'data': build_article()}, status=201)
+        self.remember(body['data'])
+
+    async def batch_create(self):
+        data = {'defaults': {'method': 'POST', 'path': self.records_path},
+                'requests': [{'body': {'data': build_article()}}
+                             for _ in range(self.batch_requests_size)]}
+        for response in await self.run_batch(data):
+            self.remember(response['body']['data'])
+
+    async def batch_create_put(self):
+        data = {'defaults': {'method': 'PUT'},
+                'requests': [{'path': self.record_path(uuid.uuid4()),
+                              'body': {'data': build_article()}}
+                             for _ in range(self.batch_requests_size)]}
+        for response in await self.run_batch(data):
+            self.remember(response['body']['data'])
+
+    async def batch_replace(self):
+        with self.reserve(self.nb_initial_records) as records:
+            data = {'defaults': {'method': 'PUT'},
+                    'requests': [{'path': self.record_path(r['id']),
+                                  'body': {'data': build_article()}}
+                                 for r in records]}
+            for response in await self.run_batch(data):
+                self.remember(response['body']['data'])
+
+    async def batch_update(self):
+        with self.reserve(self.nb_initial_records) as records:
+            data = {'defaults': {'method': 'PATCH'},
+                    'requests': [{'path': self.record_path(r['id']),
+                                  'body': {'data': {
+                                      'title': 'Some title %s' % (
+                                          random.randint(0, 100))}}}
+                                 for r in records]}
+            for response in await self.run_batch(data):
+                self.remember(response['body']['data'])
+
+    async def update(self):
+        data = {
+            'title': 'Some title {}'.format(random.randint(0, 1)),
+            'archived': bool(random.randint(0, 1)),
+            'is_article': bool(random.randint(0, 1)),
+            'favorite': bool(random.randint(0, 1)),
+        }
+        with self.reserve(1) as (record,):
+            body, _ = await self.request('PATCH',
+                                         self.record_path(record['id']),
+                                         {'data': data})
+            self.remember(body['data'])
+
+    async def filter_sort(self):
+        queries = [
+            'archived=false',
+            'unread=true&archived=false',
+            '_sort=-last_modified&archived=true',
+            '_sort=title',
+            '_sort=-added_by,-stored_on&archived=false',
+        ]
+        await self.request('GET', self.records_path + '?' +
+                           random.choice(queries))
+
+    async def delete(self):
+        with self.reserve(1) as (record,):
+            body, _ = await self.request('DELETE',
+                                         self.record_path(record['id']))
+            self.forget(body['data'])
+
+    async def batch_delete(self):
+        with self.reserve(5) as records:
+            data = {'defaults': {'method': 'DELETE'},
+                    'requests': [{'path': self.record_path(r['id'])}
+                                 for r in records]}
+            for response in await self.run_batch(data):
+                self.forget(response['body']['data'])
+
+    async def poll_changes(self):
+        with self.reserve(1, keep=True) as (record,):
+            await self.request('GET', self.records_path + '?_since=%s' % (
+                record['last_modified']))
+
+    async def poll_not_modified(self):
+        headers = {'If-None-Match': '"%s"' % self.collection_timestamp}
+        body, response_headers = await self.request('GET', self.records_path,
+                                                    headers=headers,
+                                                    status=(200, 304))
+        if body is None:
+            return None
+        # Changed by concurrent actions of the user since it was known.
+        etag = response_headers.get('ETag')
+        if etag is not None:
+            self.collection_timestamp = max(self.collection_timestamp,
+                                            int(etag.strip('"')))
+        return MISS
+
+    async def list_archived(self):
+        await self.request('GET', self.records_path + '?archived=true')
+
+    async def list_deleted(self):
+        with self.reserve(1, keep=True) as (record,):
+            await self.request('GET', self.records_path +
+                               '?_since=%s&deleted=true' % (
+                                   record['last_modified']))
+
+    async def batch_count(self):
+        filters = ['archived=true', 'is_article=true', 'favorite=true',
+                   'unread=false', 'min_read_position=100']
+        data = {'defaults': {'method': 'HEAD'},
+                'requests': [{'path': self.records_path + '?' + f}
+                             for f in filters]}
+        await self.run_batch(data)
+
+    async def list_continuated_pagination(self):
+        path = self.records_path + '?_limit=20'
+        while path:
+            _, headers = await self.request('GET', path)
+            next_page = headers.get('Next-Page')
+            path = next_page and next_page[next_page.index('/buckets/'):]
+
+    async def prepare(self, action):
+        """Create the records needed by the action, if any."""
+        # Actions on existing records need at least two of them.
+        if len(self.records) < 2 and action not in ('create', 'create_put',
+                                                    'batch_create',
+                                                    'batch_create_put'):
+            await self.create()
+            await self.create()
+
+    async def perform(self, action):
+        return await getattr(self, action)()
+
+
+async def send(user, action, scheduled, stats):
+    """Perform the action, and record its latency from its scheduled start,
+    whether it succeeded or not.
+
+    The time spent creating the records needed by the action beforehand is
+    not measured.
+    """
+    started = time.monotonic()
+    prepared = 0
+    try:
+        await user.prepare(action)
+        prepared = time.monotonic() - started
+        started += prepared
+        outcome = await user.perform(action)
+    except Exception as e:
+        # A failed action must not stop the others (nor go unnoticed).
+        failed = time.monotonic()
+        stats[action].add_error((failed - scheduled - prepared) * 1000)
+        print('%s: %r' % (action, e), file=sys.stderr)
+        return
+    finished = time.monotonic()
+    if outcome == MISS:
+        stats[action].misses += 1
+    stats[action].add((finished - scheduled - prepared) * 1000,
+                      (finished - started) * 1000)
+
+
+async def generate(options):
+    mix = Mix(ACTIONS_FREQUENCIES)
+    forced_action = options.action or os.getenv('LOAD_ACTION')
+    stats = dict((action, Stats()) for action, _ in ACTIONS_FREQUENCIES)
+
+    # Requests beyond the pool size wait for a connection: their latency
+    # includes this wait.
+    connector = aiohttp.TCPConnector(limit=options.connections)
+    timeout = aiohttp.ClientTimeout(total=options.timeout)
+    async with aiohttp.ClientSession(connector=connector,
+                                     timeout=timeout) as session:
+        users = [VirtualUser(session, options.server_url, options)
+                 for _ in range(options.users)]
+        await asyncio.gather(*[user.setup() for user in users])
+
+        interval = 1.0 / options.rate
+        start = time.monotonic()
+        pending = set()
+        for i in itertools.count():
+            # Arrivals are scheduled on a fixed timeline: a late loop does
+            # not postpone the next requests.
+            scheduled = start + i * interval
+            if scheduled - start >= options.duration:
+                break
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            action = forced_action or mix.pick()
+            user = users[i % len(users)]
+            task = asyncio.ensure_future(send(user, action, scheduled, stats))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.wait(pending)
+        elapsed = time.monotonic() - start
+
+    actions = dict((action, s.report()) for action, s in stats.items()
+                   if s.latencies or s.errors)
+    total = sum(len(s.latencies) for s in stats.values())
+    return {
+        'rate': options.rate,
+        'duration': options.duration,
+        'users': options.users,
+        'connections': options.connections,
+        'throughput': round(total / elapsed, 1),
+        'actions': actions,
+    }
+
+
+def print_report(results, output=sys.stdout):
+    print('%-28s %7s %6s %6s %10s %10s %10s %12s %12s' % (
+        'action', 'count', 'errors', 'misses', 'p50 ms', 'p99 ms', 'max ms',
+        'service p99', 'error max'), file=output)
+    for action, report in sorted(results['actions'].items()):
+        if report['errors']:
+            error_max = '%12.1f' % report['error_max_ms']
+        else:
+            error_max = '%12s' % '-'
+        if not report['count']:
+            print('%-28s %7s %6s %6s %10s %10s %10s %12s %s' % (
+                action, 0, report['errors'], 0, '-', '-', '-', '-',
+                error_max), file=output)
+            continue
+        print('%-28s %7s %6s %6s %10.1f %10.1f %10.1f %12.1f %s' % (
+            action, report['count'], report['errors'], report['misses'],
+            report['p50_ms'], report['p99_ms'], report['max_ms'],
+            report['service_p99_ms'], error_max), file=output)
+    print('Throughput: %s actions/sec (target: %s)' % (
+        results['throughput'], results['rate']), file=output)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--server-url', default='http://localhost:8888')
+    parser.add_argument('--rate', type=float, default=50,
+                        help='Number of actions started per second')
+    parser.add_argument('--duration', type=float, default=60,
+                        help='Number of seconds during which actions are '
+                             'started')
+    parser.add_argument('--users', type=int, default=20,
+                        help='Number of virtual users')
+    parser.add_argument('--connections', type=int, default=100,
+                        help='Size of the connections pool')
+    parser.add_argument('--timeout', type=float, default=30,
+                        help='Timeout of each request, in seconds')
+    parser.add_argument('--max-initial-records', type=int, default=100)
+    parser.add_argument('--batch-requests-size', type=int, default=25)
+    parser.add_argument('--action', choices=[a for a, _ in
+                                             ACTIONS_FREQUENCIES],
+                        help='Run this action only (or LOAD_ACTION)')
+    parser.add_argument('--output',
+                        help='Write the JSON results to this file')
+    options = parser.parse_args(args)
+
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(generate(options))
+    print_report(results)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,36 +3,8 @@ import os
 import random
 import uuid
 
-from . import BaseLoadTest
-
-ACTIONS_FREQUENCIES = [
-    ('create', 20),
-    ('create_put', 20),
-    ('batch_create', 50),
-    ('batch_create_put', 50),
-    ('batch_replace', 50),
-    ('batch_update', 50),
-    ('update', 50),
-    ('filter_sort', 60),
-    ('delete', 10),
-    ('batch_delete', 10),
-    ('poll_changes', 90),
-    ('list_archived', 20),
-    ('list_deleted', 40),
-    ('batch_count', 50),
-    ('list_continuated_pagination', 80),
-]
-
-
-def build_article():
-    suffix = uuid.uuid4().hex
-    data = {
-        "title": "Corp Site {0}".format(suffix),
-        "url": "http://mozilla.org/{0}".format(suffix),
-        "resolved_url": "http://mozilla.org/{0}".format(suffix),
-        "added_by": "FxOS-{0}".format(suffix),
-    }
-    return data
+from .actions import ACTIONS_FREQUENCIES, build_article
+from .base import BaseLoadTest
 
 
 class SimulationLoadTest(BaseLoadTest):
@@ -70,6 +42,7 @@ class SimulationLoadTest(BaseLoadTest):
                 self.create()
             resp = self.session.get(self.collection_url())
             self.records = resp.json()['data']
+        self.collection_etag = resp.headers['ETag']
 
         # Pick a random record
         self.random_record = random.choice(self.records)
@@ -246,6 +219,11 @@ class SimulationLoadTest(BaseLoadTest):
         resp = self.session.get(modified_url)
         self.assertEqual(resp.status_code, 200)
 
+    def poll_not_modified(self):
+        headers = {'If-None-Match': self.collection_etag}
+        resp = self.session.get(self.collection_url(), headers=headers)
+        self.assertEqual(resp.status_code, 304)
+
     def list_archived(self):
         archived_url = self.collection_url() + '?archived=true'
         resp = self.session.get(archived_url)
@@ -4,7 +4,7 @@ import re
 import uuid
 
 from requests.auth import HTTPBasicAuth
-from . import BaseLoadTest
+from .base import BaseLoadTest
 
 
 def build_task():
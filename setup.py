@@ -19,6 +19,7 @@ REQUIREMENTS = [
     'waitress',
     'cliquet',
     'jsonschema',
+    'repoze.lru',
 ]
 
 POSTGRESQL_REQUIREMENTS = REQUIREMENTS + [